@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""DIGIT SPAN KEY BENCHMARK.
+compares the number of keys per second generated by DigitSpan.generate_key,
+which builds a key one character at a time and goes back when no character
+fits, with the rejection sampling it replaced, which draws whole keys until
+one is valid, for several key lengths and types of key. Rejections are whole
+keys discarded for the rejection sampling, and characters discarded for the
+generator.
+
+Usage: python benchmarks/digitspan_keys.py [keys per length] [seconds per cell]
+"""
+
+import os
+import sys
+import time
+from random import random, randint
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks', 'digitspan'))
+
+from digitspan import DigitSpan, KeyConstraints
+
+KEY_LENGTHS = [3, 5, 8, 10, 12, 15, 18, 20, 25]
+KEY_TYPES = ['numeric', 'alphabetic']
+
+
+def rejection_key(seq_length, type):
+    # the previous implementation, counting the keys it discarded
+    rejections = 0
+    while True:
+        key = ''
+        while len(key) < seq_length:
+            if type == 'numeric':
+                key += '{:.15f}'.format(random()).split('.')[1][-(seq_length-len(key)):]
+            else:
+                key += chr(randint(97, 122))
+        if DigitSpan.check_key_validity(key):
+            return(key, rejections)
+        rejections += 1
+
+
+def constructive_key(seq_length, type):
+    rejections = [0]
+    push = KeyConstraints.push
+
+    def counted(self, character):
+        valid = push(self, character)
+        rejections[0] += not valid
+        return(valid)
+    KeyConstraints.push = counted
+    try:
+        return(DigitSpan.generate_key(seq_length, type), rejections[0])
+    finally:
+        KeyConstraints.push = push
+
+
+def run(generator, number, seconds, seq_length, type):
+    # keys per second and rejections per key; stops early after the seconds
+    start = time.time()
+    rejections = []
+    while len(rejections) < number and time.time() - start < seconds:
+        rejections.append(generator(seq_length, type)[1])
+    return(len(rejections) / (time.time() - start), 1.0 * sum(rejections) / len(rejections))
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    print('{} keys per length, at most {} s each'.format(number, seconds))
+    print('{:<11} {:>6} {:>16} {:>16} {:>14} {:>14}'.format(
+        'type', 'length', 'rejection [1/s]', 'generator [1/s]', 'rejected rej.', 'rejected gen.'))
+    for type in KEY_TYPES:
+        for seq_length in KEY_LENGTHS:
+            rate_rejection, rejected_rejection = run(rejection_key, number, seconds, seq_length, type)
+            rate_generator, rejected_generator = run(constructive_key, number, seconds, seq_length, type)
+            print('{:<11} {:>6} {:>16.0f} {:>16.0f} {:>14.1f} {:>14.1f}'.format(
+                type, seq_length, rate_rejection, rate_generator, rejected_rejection, rejected_generator))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""DIGIT SPAN SCORING BENCHMARK.
+compares the number of trials per second scored by the evaluation the task
+used before _alignment.py, which creates a difflib.SequenceMatcher for every
+trial, with _alignment.evaluate, for the metrics of difflib only and for all
+metrics, and with _alignment.evaluate_batch, which scores every distinct
+pair of answer and sequence once. Answers are either as in the task, where
+a share of them is correct and the others have typos, swapped, left out, or
+added digits, or unrelated random digits. Each cell is the best of three
+runs.
+
+Usage: python benchmarks/digitspan_scoring.py [trials] [share of correct answers]
+"""
+
+import difflib
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks', 'digitspan'))
+
+import _alignment
+
+KEY_LENGTHS = range(3, 13)
+DIGITS = '0123456789'
+
+
+def previous_evaluate_trial(answer, sequence):
+    # DigitSpan.evaluate_trial before the alignment module
+    evaluation = {}
+    seq_match = difflib.SequenceMatcher(None, answer, sequence)
+    matches = seq_match.get_matching_blocks()
+    evaluation['longest_match'] = max(matches, key=lambda x: x.size)[2]
+    evaluation['total_match'] = sum(m.size for m in matches)
+    evaluation['initial_match_answer'] = matches[0].size if matches[0].a == 0 else 0
+    evaluation['initial_match_sequence'] = matches[0].size if matches[0].b == 0 else 0
+    evaluation['similarity'] = seq_match.ratio()
+    return(evaluation)
+
+
+def task_answer(rng, sequence, correct):
+    if rng.random() < correct:
+        return(sequence)
+    answer = list(sequence)
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(answer))
+        edit = rng.randrange(4)
+        if edit == 0:
+            answer.insert(i, rng.choice(DIGITS))
+        elif edit == 1 and len(answer) > 1:
+            del answer[i]
+        elif edit == 2 or i + 1 == len(answer):
+            answer[i] = rng.choice(DIGITS)
+        else:
+            answer[i], answer[i + 1] = answer[i + 1], answer[i]
+    return(''.join(answer))
+
+
+def random_answer(rng, sequence, correct):
+    return(''.join(rng.choice(DIGITS) for _ in range(len(sequence))))
+
+
+def trials(number, answer, correct, rng):
+    pairs = []
+    for _ in range(number):
+        sequence = ''.join(rng.choice(DIGITS) for _ in range(rng.choice(KEY_LENGTHS)))
+        pairs.append((answer(rng, sequence, correct), sequence))
+    return(pairs)
+
+
+def run(score, pairs):
+    # trials per second, the best of three runs
+    took = []
+    for _ in range(3):
+        start = time.time()
+        score(pairs)
+        took.append(time.time() - start)
+    return(len(pairs) / min(took))
+
+
+SCORERS = [
+    ('difflib (previous)', lambda pairs: [previous_evaluate_trial(a, s) for a, s in pairs]),
+    ('evaluate, difflib metrics',
+     lambda pairs: [_alignment.evaluate(a, s, _alignment.DIFFLIB_METRICS) for a, s in pairs]),
+    ('evaluate, all metrics', lambda pairs: [_alignment.evaluate(a, s) for a, s in pairs]),
+    ('evaluate_batch, all metrics', _alignment.evaluate_batch)
+]
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    correct = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    print('{} trials of length {} to {}, {:.0%} of task answers correct'.format(
+        number, KEY_LENGTHS[0], KEY_LENGTHS[-1], correct))
+    print('{:<8} {:<28} {:>14} {:>8}'.format('answers', 'scoring', 'trials [1/s]', 'speedup'))
+    for name, answer in [('task', task_answer), ('random', random_answer)]:
+        pairs = trials(number, answer, correct, random.Random(1))
+        baseline = None
+        for scorer, score in SCORERS:
+            rate = run(score, pairs)
+            baseline = baseline or rate
+            print('{:<8} {:<28} {:>14.0f} {:>7.2f}x'.format(name, scorer, rate, rate / baseline))
+
+
+if __name__ == '__main__':
+    main()
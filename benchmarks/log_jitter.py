@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""LOGGING JITTER BENCHMARK.
+compares the timing of a simulated trial loop when the logs are written
+synchronously on the presentation thread and when they are handed to the
+background writer (`background_writer = yes` in the [LOG] section).
+
+Every trial logs one row, writes the logs in the break as the tasks do,
+and then waits for the next stimulus onset; the reported jitter is the
+delay between the scheduled and the actual onset.
+
+Usage: python benchmarks/log_jitter.py [trials] [rows per write] [row length]
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks'))
+
+from _base_expyriment import LogFile, LogWriter, detach_log_buffer, mean, sd, median
+
+
+def run(trials, rows_per_write, row_length, writer=None, interval=0.01):
+    directory = tempfile.mkdtemp()
+    try:
+        log = LogFile(filename='jitter.csv', directory=directory,
+                      col_names=['trial', 'payload'])
+        log.save()
+        payload = 'x' * row_length
+        delays = []
+        onset = time.time() + interval
+        for trial in range(trials):
+            log.add([trial, payload])
+            if trial % rows_per_write == 0:
+                job = detach_log_buffer(log) if writer else None
+                if job:
+                    writer.put(job)
+                else:
+                    log.save()
+            while time.time() < onset:
+                pass
+            delays.append((time.time() - onset) * 1000)
+            onset += interval
+        if writer:
+            writer.close()
+        log.save()
+        return(delays)
+    finally:
+        shutil.rmtree(directory)
+
+
+def report(name, delays):
+    print('{:<12} mean {:7.3f} ms   sd {:7.3f} ms   median {:7.3f} ms   max {:7.3f} ms'.format(
+        name, mean(delays), sd(delays), median(delays), max(delays)))
+
+
+def main():
+    trials = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    rows_per_write = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    row_length = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+    print('{} trials, writing every {} row(s) of {} characters'.format(
+        trials, rows_per_write, row_length))
+    report('synchronous', run(trials, rows_per_write, row_length))
+    report('background', run(trials, rows_per_write, row_length, LogWriter()))
+
+
+if __name__ == '__main__':
+    main()
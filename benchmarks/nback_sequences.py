@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""NBACK SEQUENCE BENCHMARK.
+compares the time needed to generate the trials of an n-back block with
+NBack.generate_sequence and with the generator it replaced, and reports
+the realised rate of repeats and of lures (matches n-1 or n+1 back) of
+both for several block lengths and levels. the numpy and the pure python
+verification of the generated sequences are checked to agree.
+
+Usage: python benchmarks/nback_sequences.py [repetitions] [options per mode]
+"""
+
+import os
+import sys
+import time
+from random import choice, shuffle, Random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks', 'nback'))
+
+import nback as module
+from nback import NBack
+from _base_expyriment import median
+
+TRIAL_COUNTS = [20, 100, 1000, 5000]
+LEVELS = [1, 2, 3]
+MODES = 'PC'
+PROBABILITY = 0.3
+
+
+def previous_sequence(num_trials, modes, probability, nback, num_options):
+    # the previous implementation, returning option indices per mode
+    log = dict((m, []) for m in modes)
+    num_repeat = int(num_trials * probability)
+    each_repeat = int(num_repeat / len(modes))
+    repeats = [''] * (num_trials - num_repeat)
+    [repeats.extend([m] * each_repeat) for m in modes]
+    [repeats.append(choice(modes)) for i in range(num_repeat - each_repeat * len(modes))]
+    shuffle(repeats)
+
+    def findnback(l, n): return ([l[-n]] if len(l) >= n else [])
+    for repeat in repeats:
+        next = {}
+        if repeat:
+            choose = findnback(log[repeat], nback)
+            next[repeat] = choice(choose) if choose else choice(range(num_options))
+        for m in modes:
+            if m not in next:
+                avoid = findnback(log[m], nback)
+                next[m] = choice([x for x in range(num_options) if x not in avoid])
+            log[m].append(next[m])
+    return(repeats, log)
+
+
+def rates(repeats, items, nback):
+    # share of trials per mode that match n back, and that are lures
+    num_repeats, num_lures, total = 0, 0, 0
+    for m, sequence in items.items():
+        for i, x in enumerate(sequence):
+            total += 1
+            if i >= nback and x == sequence[i - nback]:
+                num_repeats += 1
+            elif nback > 1 and i >= nback - 1 and x == sequence[i - nback + 1] or \
+                    i >= nback + 1 and x == sequence[i - nback - 1]:
+                num_lures += 1
+    return(100. * num_repeats / total, 100. * num_lures / total)
+
+
+def run(repetitions, num_options, num_trials, nback):
+    options = dict((m, num_options) for m in MODES)
+    times = {'previous': [], 'generator': []}
+    realised = {'previous': [], 'generator': []}
+    agree = True
+    rng = Random(num_trials * nback)
+    for _ in range(repetitions):
+        start = time.time()
+        repeats, items = previous_sequence(num_trials, MODES, PROBABILITY, nback, num_options)
+        times['previous'].append((time.time() - start) * 1000)
+        realised['previous'].append(rates(repeats, items, nback))
+
+        start = time.time()
+        repeats, items = NBack.generate_sequence(num_trials, MODES, PROBABILITY, nback, options, rng=rng)
+        times['generator'].append((time.time() - start) * 1000)
+        realised['generator'].append(rates(repeats, items, nback))
+
+        if module.numpy is not None:
+            vectorised = NBack.verify_sequence(repeats, items, nback, 0)
+            numpy, module.numpy = module.numpy, None
+            agree = agree and vectorised == NBack.verify_sequence(repeats, items, nback, 0)
+            module.numpy = numpy
+    return(times, realised, agree)
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    num_options = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    print('modes {}, {} options per mode, repeat probability {}, {} repetitions{}'.format(
+        MODES, num_options, PROBABILITY, repetitions, '' if module.numpy else ' (without numpy)'))
+    print('{:>7} {:>5} {:>14} {:>15} {:>12} {:>12} {:>11} {:>11} {:>6}'.format(
+        'trials', 'n', 'previous [ms]', 'generator [ms]', 'repeats prev', 'repeats gen',
+        'lures prev', 'lures gen', 'agree'))
+    for num_trials in TRIAL_COUNTS:
+        for nback in LEVELS:
+            times, realised, agree = run(repetitions, num_options, num_trials, nback)
+            print('{:>7} {:>5} {:>14.2f} {:>15.2f} {:>11.1f}% {:>11.1f}% {:>10.1f}% {:>10.1f}% {:>6}'.format(
+                num_trials, nback, median(times['previous']), median(times['generator']),
+                median([r for r, l in realised['previous']]), median([r for r, l in realised['generator']]),
+                median([l for r, l in realised['previous']]), median([l for r, l in realised['generator']]),
+                'yes' if agree else 'NO'))
+
+
+if __name__ == '__main__':
+    main()
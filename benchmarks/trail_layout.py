@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""TRAIL MAKING LAYOUT BENCHMARK.
+compares the time needed to place the targets of the trail making task
+with the poisson-disk sampling of TrailMaking.make_random_positions and
+with the rejection sampling it replaced, for several target counts and
+window sizes at the default radius and minimum distance.
+
+Usage: python benchmarks/trail_layout.py [repetitions] [radius in px]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks', 'trailmaking'))
+
+from trailmaking import TrailMaking
+from _base_expyriment import mean, median
+
+WINDOW_SIZES = [(800, 600), (1280, 800), (1920, 1080)]
+TARGET_COUNTS = [10, 25, 50, 98]
+
+
+def rejection_positions(area, radius, num_positions, min_distance, min_attempts):
+    # the previous implementation, with the recursion turned into a loop
+    while True:
+        positions = []
+        for i in range(num_positions):
+            failed_position = 0
+            while True:
+                p = random.randint(int(-area[0]/2 + radius), int(area[0]/2 - radius)), \
+                    random.randint(int(-area[1]/2 + radius), int(area[1]/2 - radius))
+                if not [1 for x in positions if TrailMaking.point_distance(p, x) < min_distance]:
+                    positions.append(p)
+                    break
+                failed_position += 1
+                if failed_position > min_attempts:
+                    break
+            if failed_position > min_attempts:
+                break
+        if len(positions) == num_positions:
+            return(positions, min_distance)
+        min_distance -= 0.05 * radius
+
+
+def closest(positions):
+    return(min([TrailMaking.point_distance(a, b) for i, a in enumerate(positions)
+                for b in positions[i + 1:]]))
+
+
+def run(repetitions, radius, size, count):
+    times = {'rejection': [], 'poisson': []}
+    distances = {'rejection': [], 'poisson': []}
+    for _ in range(repetitions):
+        start = time.time()
+        positions, _ = rejection_positions(size, radius, count, 4 * radius, 200)
+        times['rejection'].append((time.time() - start) * 1000)
+        distances['rejection'].append(closest(positions))
+
+        start = time.time()
+        positions = TrailMaking.make_random_positions(size, radius, count, 4 * radius, 30)
+        times['poisson'].append((time.time() - start) * 1000)
+        distances['poisson'].append(closest(positions))
+    return(times, distances)
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    radius = float(sys.argv[2]) if len(sys.argv) > 2 else 19
+    print('radius {} px, minimum distance {} px, {} repetitions'.format(radius, 4 * radius, repetitions))
+    print('{:<11} {:>7} {:>15} {:>15} {:>13} {:>13}'.format(
+        'window', 'targets', 'rejection [ms]', 'poisson [ms]', 'closest rej.', 'closest poi.'))
+    for size in WINDOW_SIZES:
+        for count in TARGET_COUNTS:
+            times, distances = run(repetitions, radius, size, count)
+            print('{:<11} {:>7} {:>15.2f} {:>15.2f} {:>13.1f} {:>13.1f}'.format(
+                '{}x{}'.format(*size), count, median(times['rejection']), median(times['poisson']),
+                mean(distances['rejection']), mean(distances['poisson'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -41,6 +41,19 @@ SOFTWARE.
 import sys
 import os
 import re
+import heapq
+import atexit
+import threading
+import json
+import mmap
+import struct
+import codecs
+import gzip
+import math
+import random
+from bisect import bisect_right
+from collections import namedtuple, OrderedDict, deque
+from numbers import Integral, Real
 from ast import literal_eval
 from expyriment import design, control, stimuli, io, misc
 
@@ -54,8 +67,30 @@ try:
 except ImportError:
     android = None
 
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 fallback_dpi = 96
 
+# parsed configuration, reused as long as the configuration files are unchanged
+config_cache_file = '.config-cache.json'
+
+# the configuration of the task, and options that replace those set in it,
+# e.g. the [SIMULATION] options set by tools/simulate.py for every session
+config_file = 'config.conf'
+config_overrides = {}
+
+# time [ms] that reacting to the response to a message may be delayed by
+# preloading stimuli while the message is shown
+message_prefetch_budget = 100
+
 COLOURS = {
     'black': (0, 0, 0),
     'blue': (0, 0, 255),
@@ -78,7 +113,86 @@ DEFAULTS = {
     'button_text_colour': 'white',
     'button_highlight_colour': (255, 200, 200),
     'button_highlight_duration': 50,
-    'experiment_text_size': 20
+    'experiment_text_size': 20,
+    'message_cache': 16,
+    'flush_rows': 1,
+    'flush_interval': 0,
+    'flush_on_block': 'yes',
+    'background_writer': 'no',
+    'background_writer_queue': 64,
+    'rt_mu': 400,
+    'rt_sigma': 50,
+    'rt_tau': 100,
+    'accuracy': 0.9,
+    'false_alarm_rate': 0.05,
+    'message_time': 1000,
+    'digit_span': 6,
+    'trail_speed': '100mm',
+    'trail_sway': '2mm'
+}
+
+# types of the options used by all tasks, completed by the SCHEMA of each task;
+# an option is (type, flags...), the types being str, int, float, bool, unit
+# (a number with mm, cm, in, or no unit for pixels), colour, pair (two
+# numbers), and columns (names separated by commas); per_block options have
+# one value or one value per block, required options need to be set
+SCHEMA = {
+    'GENERAL': {
+        'language': ('str', 'required'),
+        'log_session': ('bool', 'required'),
+        'experiment_text_size': ('int',),
+        'window_size': ('pair',),
+        'fullscreen': ('bool',),
+        'dpi': ('int',),
+        'screen_diagonal': ('str',),
+        'fallback_dpi': ('int',),
+        'message_cache': ('int',),
+        'sequence_bank': ('str',)
+    },
+    'DESIGN': {
+        'blocks': ('int', 'required'),
+        'practice': ('bool', 'per_block')
+    },
+    'APPEARANCE': {
+        'button_height': ('unit',),
+        'button_background_colour': ('colour',),
+        'button_border_colour': ('colour',),
+        'button_text_colour': ('colour',),
+        'button_highlight_colour': ('colour',)
+    },
+    'LOG': {
+        'cols_trial': ('columns',),
+        'cols_block': ('columns',),
+        'cols_experiment': ('columns',),
+        'block_summary_file': ('str',),
+        'experiment_summary_file': ('str',),
+        'flush_rows': ('int',),
+        'flush_interval': ('int',),
+        'flush_on_block': ('bool',),
+        'background_writer': ('bool',),
+        'background_writer_queue': ('int',),
+        'columnar_directory': ('str',)
+    },
+    'DEVELOPMENT': {
+        'active': ('bool',),
+        'log_all_variables': ('str',)
+    },
+    'SIMULATION': {
+        'active': ('bool',),
+        'display': ('bool',),
+        'seed': ('int',),
+        'subject': ('int',),
+        'session': ('int',),
+        'rt_mu': ('float',),
+        'rt_sigma': ('float',),
+        'rt_tau': ('float',),
+        'accuracy': ('float',),
+        'false_alarm_rate': ('float',),
+        'message_time': ('int',),
+        'digit_span': ('float',),
+        'trail_speed': ('unit',),
+        'trail_sway': ('unit',)
+    }
 }
 
 # PATCHING THE CIRCLE DIAMETER/RADIUS INCOMPATIBILITY
@@ -129,72 +243,118 @@ if expyriment_version == [0, 9, 0]:
 i18n = {}
 
 
-def _(key): return(i18n[key].decode('utf-8', 'replace') if key in i18n else (None if key else ''))
+def _(key): return(i18n[key] if key in i18n else (None if key else ''))
 
 
 class BaseExpyriment(design.Experiment):
-    def __init__(self, default_config={}):
-        self._load_config(default_config)
-        design.defaults.experiment_text_size = self.config.getint('GENERAL', 'experiment_text_size')
+    def __init__(self, default_config={}, schema={}):
+        self._load_config(default_config, schema)
+        design.defaults.experiment_text_size = self.settings.general.experiment_text_size
         design.Experiment.__init__(self, _('title'))
         control.set_develop_mode(self._dev_mode)
 
-        if self.config.has_option('GENERAL', 'window_size') and not self._dev_mode:
-            control.defaults.window_size = self.config.gettuple(
-                'GENERAL', 'window_size', assert_length=2)
-        if self.config.has_option('GENERAL', 'fullscreen') and not self._dev_mode:
-            control.defaults.window_mode = self.config.getboolean('GENERAL', 'fullscreen')
+        if self.settings.general.window_size is not None and not self._dev_mode:
+            control.defaults.window_size = self.settings.general.window_size
+        if self.settings.general.fullscreen is not None and not self._dev_mode:
+            control.defaults.window_mode = self.settings.general.fullscreen
+        self.simulated = bool(self.settings.simulation.active)
+        if self.simulated:
+            simulation_defaults(self.settings.simulation.display)
         control.initialize(self)
         if self._dev_mode:
             self.mouse.show_cursor()
+        if self.simulated:
+            # time passes only while the experiment waits
+            self._clock = SimulatedClock()
 
         self.expyriment_version = expyriment_version
         self.python_version = python_version
 
-        self.trialdata = None
+        self.trialdata = TrialData(self._log_columns('cols_block'), self._log_columns('cols_experiment'))
         self.trial_log = None
         self.block_log = None
         self.by_block_vars = []
         self.experiment_log = None
         self.dev_log = None
+        self._summary_columns = {}
+
+        self._flush_rows = self.settings.log.flush_rows
+        self._flush_interval = self.settings.log.flush_interval
+        self._flush_on_block = self.settings.log.flush_on_block
+        self._unsaved_rows = 0
+        self._last_flush = 0
+        self._row_buffer = RowBuffer(self._flush_rows or 64)
+        self.columnar_logs = {}
+        self._columnar_directory = self.settings.log.columnar_directory
+        self._log_writer = None
+        if self.settings.log.background_writer:
+            self._log_writer = LogWriter(self.settings.log.background_writer_queue)
 
         self.screen.dpi = self._get_dpi()
+        self.messages = MessageCache(self.settings.general.message_cache)
+        self.prefetcher = Prefetcher(self.clock)
+        self.sequences = None
+        # the responses come from the mouse and keyboard, or from a
+        # simulated participant; see tools/simulate.py
+        self.input_source = SimulatedParticipant(self, self.settings.simulation) \
+            if self.simulated else DeviceInput(self)
 
     def _start(self):
         self._session = None
-        if self.config.getboolean('GENERAL', 'log_session'):
-            subject, session = _prompt_participant_information()
+        if self.settings.general.log_session:
+            subject, session = self.input_source.participant()
             self._subject = subject
             self._session = session
             self._filename_suffix = '{0}.{0}-{1}'.format(subject.strip(), session.strip())
 
-        control.start(subject_id=int(self._subject))
+        if self.simulated:
+            control.start(subject_id=int(self._subject), skip_ready_screen=True)
+        else:
+            control.start(subject_id=int(self._subject))
+        # rows that are not yet written when the program ends, e.g. after a
+        # crash; registered after the data file, whose own handler runs later
+        atexit.register(self._close_logs)
 
         if self._session is not None:
             self.data.add_subject_info('session: ' + self._session)
+        # sequences generated in advance by tools/precompile.py
+        if self.settings.general.sequence_bank is not None:
+            self.sequences = SequenceBank.load(self.settings.general.sequence_bank, self.subject)
+            self.data.add_subject_info('sequence bank: ' + self.settings.general.sequence_bank)
 
     def _end(self):
+        self._close_logs()
         control.end()
 
-    def _load_config(self, defaults={}):
-        d1 = DEFAULTS.copy()
-        d1.update(defaults)
-        d1 = {k: str(v) for k, v in d1.items()}
-        self.config = ConfigReader(d1)
-        self.config.read(['config.conf', 'i18n.conf'])
+    def _close_logs(self):
+        # everything that is left is queued behind the rows the background
+        # writer already has, and written before this returns
+        self._flush_logs(force=True)
+        if self._log_writer:
+            self._log_writer.close()
+
+    def _load_config(self, defaults={}, schema={}):
+        # all options are read and checked here, before the window opens,
+        # and are then read from this snapshot rather than from the parser
+        self.config, self.settings = read_settings(defaults, schema, config_file, config_cache_file,
+                                                   config_overrides)
 
         global i18n
-        i18n = dict(self.config.items(self.config.get('GENERAL', 'language')))
+        self.catalog = Catalog('i18n.conf', self.settings.general.language)
+        i18n = self.catalog.messages
 
-        self._dev_mode = False
-        if self.config.has_option('DEVELOPMENT', 'active') and self.config.getboolean('DEVELOPMENT', 'active'):
-            self._dev_mode = True
+        # compile summary columns early so that errors show before the session
+        for option in ['cols_trial', 'cols_block', 'cols_experiment']:
+            SummaryColumns(self._log_columns(option))
+
+        self._dev_mode = bool(self.settings.development.active)
 
     def _load_block_settings(self, block, settings=[], section='DESIGN'):
-        if self.config.has_option(section, 'practice'):
+        values = getattr(self.settings, section.lower())
+        if getattr(values, 'practice', None) is not None:
             settings = settings + [('practice', bool)]
         for setting, cast in settings:
-            block_var = self.config.getforblock(section, setting, block.id - 1, cast=cast)
+            block_var = getattr(values, setting)[block.id - 1]
             if cast == bool:
                 block_var = int(block_var)
             block.set_factor(setting, block_var)
@@ -204,34 +364,42 @@ class BaseExpyriment(design.Experiment):
 
     def _show_message(self, caption, text, format={}, response='both',
                       stall=0, block=None, **kwargs):
-        if caption == 'SKIP' or text == 'SKIP':
+        screen = self._message_screen(caption, text, format, block, kwargs)
+        if screen is None:
             return()
-        if block:
-            if block.get_factor('practice'):
-                if _(caption + '[practice]') is not None:
-                    caption += '[practice]'
-                if _(text + '[practice]') is not None:
-                    text += '[practice]'
-            block_specific = '[block:{}]'.format(block.id)
-            if _(caption + block_specific) is not None:
-                caption += block_specific
-            if _(text + block_specific) is not None:
-                text += block_specific
-        if _(caption + '[highlight]') and _(caption + '[highlight]').lower() in ['yes', 'true', '1']:
-            kwargs.update({'heading_bold':True, 'heading_colour':(255,0,0)})
-        stimuli.TextScreen(_(caption).format(**format),
-                _(text).format(**format), **kwargs).present()
-        self.clock.wait(stall)
-        self.keyboard.clear()
-        self.mouse.clear()
+        screen.present()
+        self._idle_wait(stall - self._flush_logs())
+        self.input_source.clear()
         while True:
-            self.clock.wait(10)
-            if (android or response == 'mouse' or response == 'both') and \
-                self.mouse.get_last_button_down_event() is not None or \
-                (response == 'keyboard' or response == 'both') and \
-                    len(self.keyboard.read_out_buffered_keys()) > 0:
+            self.clock.wait(10 - self.prefetcher.run(message_prefetch_budget))
+            if self.input_source.responded(response):
                 break
 
+    def _idle_wait(self, duration):
+        # waits, preloading upcoming stimuli as long as they fit in the time
+        start = self.clock.time
+        self.prefetcher.run(duration)
+        self.clock.wait(duration - (self.clock.time - start))
+
+    def _prepare_message(self, caption, text, format={}, block=None, **kwargs):
+        # renders a message that is likely to be shown next, e.g. while
+        # waiting anyway; returns the time it took so that it can be
+        # subtracted from the wait
+        start = self.clock.time
+        self._message_screen(caption, text, format, block, kwargs)
+        return(self.clock.time - start)
+
+    def _message_screen(self, caption, text, format, block, kwargs):
+        if caption == 'SKIP' or text == 'SKIP':
+            return(None)
+        caption = self.catalog.resolve(caption, block)
+        text = self.catalog.resolve(text, block)
+        if self.catalog.highlighted(caption):
+            kwargs = dict(kwargs, heading_bold=True, heading_colour=(255,0,0))
+        heading, body = _(caption).format(**format), _(text).format(**format)
+        return(self.messages.get((heading, body, kwargs),
+                                 lambda: stimuli.TextScreen(heading, body, **kwargs)))
+
     def _in2px(self, size, scale=1):
         if type(size) == str:
             size = float(size)
@@ -261,22 +429,28 @@ class BaseExpyriment(design.Experiment):
             return(self._unit2px(float(unit[:-2]), unit[-2:]))
 
     def _get_dpi(self):
-        if self.config.has_option('GENERAL', 'dpi'):
-            return(self.config.getint('GENERAL', 'dpi'))
+        if self.settings.general.dpi is not None:
+            return(self.settings.general.dpi)
         if android:
             return(android.get_dpi())
-        if self.config.has_option('GENERAL', 'screen_diagonal'):
+        if self.settings.general.screen_diagonal is not None:
             # NOTE: assuming full screen mode!
-            screen_diagonal = self.config.get('GENERAL', 'screen_diagonal')
+            screen_diagonal = self.settings.general.screen_diagonal
             width, height = self.screen.window_size
             if 'in' == screen_diagonal[-2:] and not ',' in screen_diagonal:
                 return(int((width**2 + height**2)**0.5 / float(screen_diagonal[:-2])))
             elif 'cm' == screen_diagonal[-2:] and not ',' in screen_diagonal:
                 return(int((width**2 + height**2)**0.5 / (float(screen_diagonal[:-2]) / 2.54)))
-        return(self.config.getint('GENERAL', 'fallback_dpi') if self.config.has_option('GENERAL', 'fallback_dpi') else fallback_dpi)
+        return(self.settings.general.fallback_dpi if self.settings.general.fallback_dpi is not None else fallback_dpi)
 
     @staticmethod
     def _colours(colour):
+        if colour not in _colour_cache:
+            _colour_cache[colour] = BaseExpyriment._parse_colours(colour)
+        return(copy_value(_colour_cache[colour]))
+
+    @staticmethod
+    def _parse_colours(colour):
         if colour.strip() == "" or colour.lower() == "none":
             return(None)
         if colour in COLOURS:
@@ -307,85 +481,136 @@ class BaseExpyriment(design.Experiment):
         return([k for k in COLOURS if COLOURS[k] == colour][0])
 
     def _log_trial(self, *argv):
-        if not self.config.has_option('LOG', 'cols_trial'):
+        if not self.settings.log.cols_trial:
             return
 
         args = log_args_to_dict(self, *argv)
         col_names = ['subject', 'session', 'block', 'trial'] + \
-            [col.strip() for col in self.config.get('LOG', 'cols_trial').split(',')] + self.by_block_vars
+            self._log_columns('cols_trial') + self.by_block_vars
         col_names = remove_duplicates(col_names)
-        columns = log_values_to_cols(col_names, args)
+        columns = self._summarise(col_names, args)
 
-        if not self.trialdata:
-            self.trialdata = dict((arg, []) for arg in args)
-        [self.trialdata[arg].append(args[arg]) for arg in args]
+        self.trialdata.append(args)
 
         if not self.trial_log:
             self.trial_log = self.data
             self.add_data_variable_names(col_names)
 
-        self.data.add(columns)
+        self._row_buffer.add(self.data, columns)
+        self._log_columnar('trials_' + '-'.join([str(i) for i in [self._subject, self._session]
+                                                 if i is not None]), col_names, columns)
+        self._unsaved_rows += 1
 
         self._log_dev(args)
 
     def _log_block(self, *argv):
-        if not self.config.has_option('LOG', 'cols_block') or not self.config.has_option('LOG', 'block_summary_file'):
+        if not self.settings.log.cols_block or not self.settings.log.block_summary_file:
             return
-        args = self.trialdata.copy()
-
-        block_start_index = args['block'].index(args['block'][-1])
-        args = {k: v[block_start_index:] for k, v in args.items()}
-
-        args.update(log_args_to_dict(self, *argv))
+        args = dict(self.trialdata.block)
+        overridden = log_args_to_dict(self, *argv)
+        args.update(overridden)
 
         col_names = ['subject', 'session', 'block'] + \
-                    [col.strip() for col in
-                        self.config.get('LOG', 'cols_block').split(',')] + \
+                    self._log_columns('cols_block') + \
                     self.by_block_vars
         col_names = remove_duplicates(col_names)
 
         if not self.block_log:
-            self.block_log = LogFile(filename=self.config.get('LOG', 'block_summary_file'),
+            self.block_log = LogFile(filename=self.settings.log.block_summary_file,
                                      directory=io.defaults.datafile_directory,
-                                     col_names=col_names)
-        self.block_log.add(log_values_to_cols(col_names, args))
+                                     col_names=col_names, writer=self._log_writer)
+        values = self._summarise(col_names, args, self.trialdata.block_summary, overridden)
+        self.block_log.add(values)
+        self._log_columnar(self.settings.log.block_summary_file.rsplit('.', 1)[0],
+                           col_names, values)
+        self._unsaved_rows += 1
+        self._flush_logs(force=self._flush_on_block)
         return(args)
 
     def _log_experiment(self, *argv):
-        if not self.config.has_option('LOG', 'cols_experiment') or not self.config.has_option('LOG', 'expriment_summary_file'):
+        if not self.settings.log.cols_experiment or not self.settings.log.experiment_summary_file:
             return
-        args = self.trialdata.copy()
-        args.update(log_args_to_dict(self, *argv))
-        col_names = ['subject', 'session'] + [col.strip()
-                                              for col in self.config.get('LOG', 'cols_experiment').split(',')]
+        args = dict(self.trialdata.session)
+        overridden = log_args_to_dict(self, *argv)
+        args.update(overridden)
+        col_names = ['subject', 'session'] + self._log_columns('cols_experiment')
 
         if not self.experiment_log:
-            self.experiment_log = LogFile(filename=self.config.get('LOG', 'experiment_summary_file'),
+            self.experiment_log = LogFile(filename=self.settings.log.experiment_summary_file,
                                           directory=io.defaults.datafile_directory,
-                                          col_names=col_names)
-        self.experiment_log.add(log_values_to_cols(col_names, args))
+                                          col_names=col_names, writer=self._log_writer)
+        values = self._summarise(col_names, args, self.trialdata.session_summary, overridden)
+        self.experiment_log.add(values)
+        self._log_columnar(self.settings.log.experiment_summary_file.rsplit('.', 1)[0],
+                           col_names, values)
+        self._unsaved_rows += 1
 
     def _log_dev(self, args):
-        if self._dev_mode and self.config.has_option('DEVELOPMENT', 'log_all_variables'):
+        if self._dev_mode and self.settings.development.log_all_variables:
             keys = sorted(args.keys())
             if not self.dev_log:
-                self.dev_log = LogFile(filename=self.config.get('DEVELOPMENT', 'log_all_variables'),
+                self.dev_log = LogFile(filename=self.settings.development.log_all_variables,
                                        directory=io.defaults.datafile_directory,
-                                       col_names=keys)
+                                       col_names=keys, writer=self._log_writer)
             self.dev_log.add(log_values_to_cols(keys, args))
 
+    def _log_columnar(self, name, col_names, values):
+        if not self._columnar_directory:
+            return
+        if name not in self.columnar_logs:
+            script = os.path.split(sys.argv[0])[1].replace('.py', '')
+            self.columnar_logs[name] = ColumnarLog(os.path.join(
+                io.defaults.datafile_directory, self._columnar_directory,
+                script + '_' + name))
+        self.columnar_logs[name].add(list(zip(col_names, values)))
+
+    def _flush_logs(self, force=False):
+        # logged rows are buffered in memory; this writes them to disk and
+        # must only be called in between trials or while a message is shown
+        due = force or \
+            self._flush_rows and self._unsaved_rows >= self._flush_rows or \
+            self._flush_interval and self._unsaved_rows and \
+            self.clock.time - self._last_flush >= self._flush_interval
+        if not due or not self._unsaved_rows:
+            return(0)
+        start = self.clock.time
+        self._row_buffer.commit()
+        for log in [self.trial_log, self.block_log, self.experiment_log, self.dev_log] + \
+                list(self.columnar_logs.values()):
+            if not log:
+                continue
+            job = detach_log_buffer(log) if self._log_writer else None
+            if job:
+                self._log_writer.put(job)
+            elif job is None:
+                if self._log_writer:
+                    # rewriting a header must not overlap with queued rows
+                    self._log_writer.join()
+                log.save()
+        self._unsaved_rows = 0
+        self._last_flush = self.clock.time
+        return(self._last_flush - start)
+
+    def _log_columns(self, option):
+        return(list(getattr(self.settings.log, option) or ()))
+
+    def _summarise(self, col_names, args, running=None, overridden=()):
+        key = tuple(col_names)
+        if key not in self._summary_columns:
+            self._summary_columns[key] = SummaryColumns(col_names)
+        return(self._summary_columns[key].evaluate(args, running, overridden))
+
     def prepare_button_boxes(self, labels):
         buttons = []
         for i, lb in enumerate(labels):
             width, height = self.screen.window_size
-            size = (width / len(labels), self._unit(self.config.get('APPEARANCE', 'button_height')))
+            size = (width / len(labels), self._unit(self.settings.appearance.button_height))
             pos = (int(size[0] * (i - len(labels) / 2.0 + 0.5)), -(height - size[1]) / 2)
-            btn = stimuli.Rectangle(size=size, position=pos, colour=self._colours(
-                self.config.get('APPEARANCE', 'button_background_colour')))
-            stimuli.Rectangle(size=size, line_width=5, colour=self._colours(
-                self.config.get('APPEARANCE', 'button_border_colour'))).plot(btn)
-            text = stimuli.TextLine(text=lb, text_colour=self._colours(
-                self.config.get('APPEARANCE', 'button_text_colour')))
+            btn = stimuli.Rectangle(size=size, position=pos,
+                                    colour=self.settings.appearance.button_background_colour)
+            stimuli.Rectangle(size=size, line_width=5,
+                              colour=self.settings.appearance.button_border_colour).plot(btn)
+            text = stimuli.TextLine(text=lb, text_colour=self.settings.appearance.button_text_colour)
             text.plot(btn)
             btn.label = lb
             btn.preload()
@@ -448,7 +673,7 @@ def _numeric_input(title, default=''):
         return(io.TextInput(message=title, length=3).get(str(default)))
 
 
-def _prompt_participant_information():
+def _prompt_participant_information(numeric_input=_numeric_input):
     next = 1
     existing_files = None
     if os.path.isdir(io.defaults.datafile_directory):
@@ -458,7 +683,7 @@ def _prompt_participant_information():
                                           for y in existing_files if '-' in y] if x.isdigit()]
         next = max(done_subjects) + 1 if done_subjects else 1
 
-    subject = _numeric_input('SUBJECT ID', next)
+    subject = numeric_input('SUBJECT ID', next)
 
     next = 1
     if existing_files:
@@ -466,11 +691,29 @@ def _prompt_participant_information():
             '-')[1] for y in existing_files if '-' in y and int(y.split('-')[0]) == int(subject)] if z.isdigit()]
         next = max(done_sessions) + 1 if done_sessions else 1
 
-    session = _numeric_input('SESSION ID', next)
+    session = numeric_input('SESSION ID', next)
 
     return(subject, session)
 
 
+def read_settings(defaults={}, schema={}, filename='config.conf', cache=None, overrides={}):
+    # the parsed configuration and the snapshot of all options of the
+    # schema of a task, completed by the options used by all tasks;
+    # overrides are options by section that replace those of the file
+    d1 = DEFAULTS.copy()
+    d1.update(defaults)
+    d1 = {k: str(v) for k, v in d1.items()}
+    config = ConfigReader(d1)
+    config.read([filename], cache=cache)
+    for section, options in overrides.items():
+        for option, value in options.items():
+            config.set(section, option, value)
+    s1 = dict((section, dict(options)) for section, options in SCHEMA.items())
+    for section, options in schema.items():
+        s1.setdefault(section, {}).update(options)
+    return(config, config.snapshot(s1))
+
+
 def log_args_to_dict(exp, *argv):
     stash = {'subject': exp._subject, 'session': exp._session}
     for arg in argv:
@@ -486,54 +729,262 @@ def log_args_to_dict(exp, *argv):
 
 
 def log_values_to_cols(column_names, data):
-    cols = []
-    for col in column_names:
-        func = None
-        filter = None
-        if '(' in col and ')' == col[-1]:
-            func, col = col[:-1].split('(')
-        if '[' in col and ']' == col[-1]:
-            col, filter = col[:-1].split('[')
-        value = data.get(col, 'NA')
-
-        if filter and type(value) == list:  # FIXME abbreviate?
-            if '==' in filter:
-                filter_field, filter_value = filter.split('==')
-                filter_value = literal_eval(filter_value)
-                value = [value[i] for i in range(len(value)) if str(
-                    data[filter_field][i]) == str(filter_value)]
-            elif '!=' in filter:
-                filter_field, filter_value = filter.split('!=')
-                filter_value = literal_eval(filter_value)
-                value = [value[i] for i in range(len(value)) if str(
-                    data[filter_field][i]) != str(filter_value)]
-            else:
-                value = [value[i] for i in range(len(value)) if data[filter][i]]
-
-        if func:
-            if func not in ['max', 'min', 'avg', 'mean', 'sum', 'abs', 'len', 'sd', 'var', 'median']:
-                raise ValueError('Function {} not supported for data summary.'.format(func))
-            if type(value) is not list and func != 'abs' and func != 'len':
-                raise TypeError('Could not find a list for summary column {}.'.format(col))
-
-            value = [v for v in value if v]
-
-            if func == 'avg' or func == 'mean':
-                value = mean(value)
-            elif func == 'sd' or func == 'sdev':
-                value = sd(value)
-            elif func == 'median':
-                value = median(value)
-            elif func == 'var' or func == 'variance':
-                value = var(value)
-            elif func in __builtins__:
-                value = __builtins__[func](value)
-            elif func in locals():
-                value = locals()[func](value)
+    return(SummaryColumns(column_names).evaluate(data))
+
+
+class SummaryColumns():
+    # column specifications such as `mean(rt[correct_repeat==1])` are
+    # compiled once into a tree of ('function', name, child) and
+    # ('value', column, filter) nodes; filter masks are shared between
+    # all columns that are evaluated together and use the same filter
+    functions = ['max', 'min', 'avg', 'mean', 'sum', 'abs', 'len', 'sd', 'var', 'median']
+    # functions that combine all values of a column into one, and those
+    # that can be applied to every single value inside of them
+    aggregates = ['max', 'min', 'avg', 'mean', 'sum', 'len', 'sd', 'var', 'median']
+    elementwise = ['abs', 'len']
+    regex_function = re.compile(r'^(\w+)\s*\((.*)\)$')
+    regex_filter = re.compile(r'^(\w+)\s*\[\s*(\w+)\s*(?:(==|!=|>=|<=|>|<)\s*(.*?))?\s*\]$')
+    _compiled = {}
+
+    def __init__(self, column_names):
+        self.names = list(column_names)
+        self.columns = [SummaryColumns.compile(name) for name in self.names]
+
+    def evaluate(self, data, running=None, overridden=()):
+        masks = {}
+        values = []
+        for column in self.columns:
+            value = RunningSummary.missing
+            if running is not None:
+                value = running.get(column, data, overridden)
+            if value is RunningSummary.missing:
+                value = self._evaluate(column, data, masks)
+            values.append(value)
+        return(values)
+
+    @staticmethod
+    def compile(spec):
+        if spec in SummaryColumns._compiled:
+            return(SummaryColumns._compiled[spec])
+        node = SummaryColumns._compile(spec.strip(), spec)
+        SummaryColumns._check_nesting(node, spec)
+        SummaryColumns._compiled[spec] = node
+        return(node)
+
+    @staticmethod
+    def _compile(column, spec):
+        match = SummaryColumns.regex_function.match(column)
+        if match:
+            if match.group(1) not in SummaryColumns.functions:
+                raise ValueError('Function {} not supported for data summary.'.format(match.group(1)))
+            return(('function', match.group(1), SummaryColumns._compile(match.group(2).strip(), spec)))
+        match = SummaryColumns.regex_filter.match(column)
+        if match:
+            field, operator, value = match.group(2), match.group(3), match.group(4)
+            if operator:
+                value = SummaryColumns._filter_value(value, operator, spec)
+            return(('value', match.group(1), (field, operator, value)))
+        # e.g. a missing parenthesis, which would otherwise be an unknown column
+        if any(c in column for c in '()[]'):
+            raise ValueError('Summary column {} has unbalanced brackets.'.format(spec))
+        return(('value', column, None))
+
+    @staticmethod
+    def _check_nesting(node, spec):
+        # the outermost aggregate combines the values of a column, functions
+        # inside of it are applied to every single value, and only abs can
+        # be applied to the combined value, e.g. abs(mean(len(user_input)))
+        combined = False
+        while node[0] == 'function':
+            if combined and node[1] not in SummaryColumns.elementwise:
+                raise ValueError('Function {} cannot be nested in summary column {}.'.format(
+                    node[1], spec))
+            combined = combined or node[1] in SummaryColumns.aggregates
+            node = node[2]
+
+    @staticmethod
+    def _filter_value(value, operator, spec):
+        try:
+            value = literal_eval(value)
+        except (ValueError, SyntaxError):
+            if any(c in value for c in '()[]'):
+                raise ValueError('Summary column {} has unbalanced brackets.'.format(spec))
+        if operator in ('==', '!='):
+            return(str(value))
+        try:
+            return(float(value))
+        except (TypeError, ValueError):
+            raise ValueError('Filter in summary column {} needs a number to compare with.'.format(spec))
+
+    @staticmethod
+    def _filter_match(item, operator, value):
+        if operator is None:
+            return(bool(item))
+        if operator == '==':
+            return(str(item) == value)
+        if operator == '!=':
+            return(str(item) != value)
+        try:
+            item = float(item)
+        except (TypeError, ValueError):
+            return(False)
+        if operator == '>':
+            return(item > value)
+        if operator == '>=':
+            return(item >= value)
+        if operator == '<':
+            return(item < value)
+        return(item <= value)
+
+    def _evaluate(self, node, data, masks, elementwise=False):
+        if node[0] == 'value':
+            value = data.get(node[1], 'NA')
+            if node[2] and type(value) == list:
+                if node[2] not in masks:
+                    field, operator, filter_value = node[2]
+                    masks[node[2]] = [SummaryColumns._filter_match(item, operator, filter_value)
+                                      for item in data[field]]
+                value = [v for v, keep in zip(value, masks[node[2]]) if keep]
+            return(value)
+
+        func = summary_functions[node[1]]
+        value = self._evaluate(node[2], data, masks,
+                               elementwise or node[1] in SummaryColumns.aggregates)
+        if type(value) is not list:
+            if node[1] != 'abs' and node[1] != 'len':
+                raise TypeError('Could not find a list for summary column {}.'.format(
+                    SummaryColumns.name(node)))
+            # e.g. abs(mean(difference)) of a block without differences
+            return(func(value) if value is not None else None)
+        # nested functions are applied to each item, e.g. mean(len(user_input))
+        if elementwise:
+            return([func(v) if v is not None else None for v in value])
+        return(func([v for v in value if v]))
+
+    @staticmethod
+    def name(node):
+        while node[0] == 'function':
+            node = node[2]
+        return(node[1])
+
+
+class RunningSummary():
+    # keeps the aggregated summary columns up to date while trials are
+    # logged, so that reading them does not depend on the number of trials;
+    # columns that cannot be streamed are evaluated from the trial data
+    missing = object()
+    aggregates = SummaryColumns.aggregates
+
+    def __init__(self, column_names=()):
+        self.statistics = {}
+        for name in column_names:
+            node = SummaryColumns.compile(name)
+            if node[0] != 'function' or node[1] not in RunningSummary.aggregates:
+                continue
+            if node[2] not in self.statistics:
+                self.statistics[node[2]] = RunningStatistic()
+            if node[1] == 'median':
+                self.statistics[node[2]].track_median()
+
+    def add(self, row):
+        for node, statistic in self.statistics.items():
+            if statistic.failed:
+                continue
+            try:
+                value = RunningSummary._item(node, row)
+                if value:
+                    statistic.add(value)
+            except (TypeError, ValueError):
+                # left to the evaluation on the full trial data
+                statistic.failed = True
+
+    def get(self, column, data, overridden=()):
+        if column[0] != 'function' or column[2] not in self.statistics:
+            return(RunningSummary.missing)
+        statistic = self.statistics[column[2]]
+        if statistic.failed or statistic.count == 0:
+            return(RunningSummary.missing)
+        for field in RunningSummary._fields(column[2]):
+            if field not in data or field in overridden:
+                return(RunningSummary.missing)
+        return(statistic.get(column[1]))
+
+    @staticmethod
+    def _item(node, row):
+        if node[0] == 'function':
+            value = RunningSummary._item(node[2], row)
+            return(summary_functions[node[1]](value) if value is not None else None)
+        if node[2] and not SummaryColumns._filter_match(row.get(node[2][0]), node[2][1], node[2][2]):
+            return(None)
+        return(row.get(node[1]))
+
+    @staticmethod
+    def _fields(node):
+        while node[0] == 'function':
+            node = node[2]
+        return([node[1], node[2][0]] if node[2] else [node[1]])
+
+
+class RunningStatistic():
+    # moments by Welford's algorithm, the median by two heaps
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._lower = None
+        self._upper = None
+        self.failed = False
+
+    def track_median(self):
+        if self._lower is None and self.count == 0:
+            self._lower, self._upper = [], []
+
+    def add(self, value):
+        self.total = self.total + value
+        if self.count == 0 or value < self.minimum:
+            self.minimum = value
+        if self.count == 0 or value > self.maximum:
+            self.maximum = value
+        self.count += 1
+        delta = value - self._mean
+        self._mean += delta * 1.0 / self.count
+        self._m2 += delta * (value - self._mean)
+        if self._lower is not None:
+            # the lower half is a max-heap of (-value, value), so that the
+            # median is the logged value itself, e.g. True rather than 1
+            if self._lower and value > self._lower[0][1]:
+                heapq.heappush(self._upper, value)
             else:
-                raise ValueError('Could not locate function {}.'.format(func))
-        cols.append(value)
-    return(cols)
+                heapq.heappush(self._lower, (-value, value))
+            if len(self._lower) > len(self._upper) + 1:
+                heapq.heappush(self._upper, heapq.heappop(self._lower)[1])
+            elif len(self._upper) > len(self._lower):
+                value = heapq.heappop(self._upper)
+                heapq.heappush(self._lower, (-value, value))
+
+    def get(self, func):
+        if func == 'len':
+            return(self.count)
+        if func == 'sum':
+            return(self.total)
+        if func == 'max':
+            return(self.maximum)
+        if func == 'min':
+            return(self.minimum)
+        if func == 'mean' or func == 'avg':
+            return(self.total * 1.0 / self.count)
+        if func == 'var':
+            return(self._m2 / self.count)
+        if func == 'sd':
+            return((self._m2 / (self.count - 1)) ** 0.5 if self.count >= 2 else None)
+        if func == 'median':
+            if self.count % 2 == 1:
+                return(self._lower[0][1])
+            return((self._lower[0][1] + self._upper[0]) / 2.0)
+        return(RunningSummary.missing)
 
 
 def mean(ll): return sum(ll) * 1.0 / len(ll) if len(ll) >= 1 else None
@@ -542,14 +993,35 @@ def mean(ll): return sum(ll) * 1.0 / len(ll) if len(ll) >= 1 else None
 def median(ll):
     n = len(ll)
     if n < 1: return(None)
-    if n % 2 == 1: return(sorted(ll)[n//2])
-    return(sum(sorted(ll)[n//2-1:n//2+1])/2.0)
-
-
-def sd(ll): return (sum((x-mean(ll))**2 for x in ll) / (len(ll)-1)) ** 0.5 if len(ll) >= 2 else None
-
-
-def var(ll): return sum((x - mean(ll)) ** 2 for x in ll) / len(ll)
+    ll = sorted(ll)
+    if n % 2 == 1: return(ll[n//2])
+    return(sum(ll[n//2-1:n//2+1])/2.0)
+
+
+def sd(ll):
+    if len(ll) < 2: return(None)
+    m = mean(ll)
+    return((sum((x - m) ** 2 for x in ll) / (len(ll) - 1)) ** 0.5)
+
+
+def var(ll):
+    if len(ll) < 1: return(None)
+    m = mean(ll)
+    return(sum((x - m) ** 2 for x in ll) / len(ll))
+
+
+summary_functions = {
+    'max': max,
+    'min': min,
+    'avg': mean,
+    'mean': mean,
+    'sum': sum,
+    'abs': abs,
+    'len': len,
+    'sd': sd,
+    'var': var,
+    'median': median
+}
 
 
 def remove_duplicates(ll):
@@ -559,11 +1031,527 @@ def remove_duplicates(ll):
             new_ll.append(item)
     return(new_ll)
 
+def detach_log_buffer(log):
+    # takes the buffered lines off a log file and returns a function that
+    # appends them to the file, or False if there is nothing to write; None
+    # if the file needs its own save(), which is the case while expyriment
+    # still has to (re)write a data file header
+    if hasattr(log, 'detach'):
+        return(log.detach())
+    if getattr(log, '_variable_names_changed', False) or \
+            getattr(log, '_subject_info', None) or \
+            getattr(log, '_experiment_info', None):
+        return(None)
+    lines, log._buffer = log._buffer, []
+    if not lines:
+        return(False)
+    path = log._fullpath
+
+    def append():
+        with open(path, 'ab') as f:
+            f.write(b''.join([line if isinstance(line, bytes) else line.encode('utf-8')
+                              for line in lines]))
+    return(append)
+
+class RowBuffer():
+    # rows that are added to their logs only when the logs are written, as
+    # (log, row) pairs with the lists of the row copied. the list of pairs
+    # is kept and reused after every flush, and doubled in length when more
+    # rows are logged in between two flushes
+    def __init__(self, size=64):
+        self._rows = [None] * max(size, 1)
+        self.count = 0
+
+    def add(self, log, row):
+        if self.count == len(self._rows):
+            self._rows.extend([None] * len(self._rows))
+        # lists may still be changed by the task until the row is written
+        self._rows[self.count] = (log, [list(v) if type(v) is list else v for v in row])
+        self.count += 1
+
+    def commit(self):
+        # adds the rows to their logs, in the order they were logged
+        for i in range(self.count):
+            log, row = self._rows[i]
+            self._rows[i] = None
+            log.add(row)
+        self.count = 0
+
+
+class ColumnarLog():
+    # typed columns, appended to one binary file per column in a directory;
+    # numbers are stored little-endian, integers as 64 bit and booleans as
+    # 8 bit integers with an additional file marking missing values, and
+    # floats as doubles with nan for missing values; text and lists of
+    # numbers have an additional file of end offsets per row. schema.json
+    # holds the column names and types, how the numbers of a column are
+    # stored ('dtype', doubles if not given), and the number of complete rows.
+    def __init__(self, directory):
+        self.directory = directory
+        self.columns = []
+        self.rows = 0
+        self._index = {}
+        self._buffer = []
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        schema = read_columnar_schema(directory)
+        if schema:
+            self.columns = schema['columns']
+            self.rows = schema['rows']
+            self._index = dict((c['name'], c) for c in self.columns)
+            # drop whatever an interrupted write left behind the last full row
+            for column in self.columns:
+                self._truncate(column)
+
+    def add(self, row):
+        self._buffer.append(row)
+
+    def save(self):
+        job = self.detach()
+        if job:
+            job()
+
+    def detach(self):
+        rows, self._buffer = self._buffer, []
+        if not rows:
+            return(False)
+        return(lambda: self._write(rows))
+
+    def _write(self, rows):
+        rows = [dict(row) for row in rows]
+        for row in rows:
+            for name, value in row.items():
+                if name not in self._index:
+                    column = {'name': name, 'type': None, 'file': 'c{}'.format(len(self.columns))}
+                    self.columns.append(column)
+                    self._index[name] = column
+                self._adapt_type(self._index[name], value)
+        for column in self.columns:
+            # columns without any value so far are not written at all
+            if column['type'] is not None:
+                self._append(column, [row.get(column['name']) for row in rows], self.rows)
+        self.rows += len(rows)
+        self._write_schema()
+
+    def _adapt_type(self, column, value):
+        value_type = columnar_type(value)
+        if value_type is None or value_type == column['type'] or column['type'] == 'text':
+            return
+        if column['type'] is None:
+            column['type'] = value_type
+            if value_type == 'list':
+                column['item'] = 'int'
+            if value_type in COLUMNAR_DTYPES:
+                column['dtype'] = COLUMNAR_DTYPES[value_type]
+            # rows before the first value of this column are missing
+            if self.rows:
+                self._append(column, [None] * self.rows, 0)
+        elif set([column['type'], value_type]) == set(['int', 'float']):
+            # rewrite as doubles
+            values = columnar_values(self.directory, column, self.rows)
+            self._remove(column)
+            column['type'] = 'float'
+            column.pop('dtype', None)
+            self._append(column, values, 0)
+        else:
+            # rewrite as text, keeping the values as they would be in the csv
+            values = [format_columnar_value(v, column) for v in
+                      columnar_values(self.directory, column, self.rows)]
+            self._remove(column)
+            column['type'] = 'text'
+            column.pop('dtype', None)
+            self._append(column, values, 0)
+
+    def _append(self, column, values, written):
+        path = os.path.join(self.directory, column['file'])
+        if column['type'] in ('bool', 'int', 'float'):
+            dtype = column.get('dtype', 'd')
+            if dtype == 'd':
+                _append_numbers(path, [float('nan') if v is None or v != v else float(v)
+                                       for v in values])
+            else:
+                _append_numbers(path, [0 if v is None else int(v) for v in values], dtype)
+                _append_numbers(path + '.na', [int(v is None) for v in values], 'b')
+            return
+        if column['type'] == 'list':
+            if any(isinstance(x, float) for v in values if v for x in v):
+                column['item'] = 'float'
+            items = [float(x) for v in values if v for x in v]
+            ends = _columnar_ends(path + '.idx', written, [len(v) if v else 0 for v in values])
+            _append_numbers(path, items)
+            _append_numbers(path + '.idx', ends)
+            return
+        encoded = [format_columnar_value(v).encode('utf-8') if not isinstance(v, bytes) else v
+                   for v in values]
+        ends = _columnar_ends(path + '.idx', written, [len(v) for v in encoded])
+        with open(path, 'ab') as f:
+            f.write(b''.join(encoded))
+        _append_numbers(path + '.idx', ends)
+
+    def _truncate(self, column):
+        path = os.path.join(self.directory, column['file'])
+        if column['type'] is None:
+            return
+        if column['type'] in ('list', 'text'):
+            ends = read_columnar_numbers(path + '.idx', self.rows)
+            _truncate_file(path + '.idx', 8 * self.rows)
+            _truncate_file(path, int(ends[-1] * (8 if column['type'] == 'list' else 1))
+                           if self.rows else 0)
+        else:
+            _truncate_file(path, struct.calcsize(column.get('dtype', 'd')) * self.rows)
+            _truncate_file(path + '.na', self.rows)
+
+    def _remove(self, column):
+        path = os.path.join(self.directory, column['file'])
+        for p in [path, path + '.idx', path + '.na']:
+            if os.path.exists(p):
+                os.remove(p)
+
+    def _write_schema(self):
+        path = os.path.join(self.directory, 'schema.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'rows': self.rows, 'columns': self.columns}, f)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+
+
+# how the numbers of int and bool columns are stored, see ColumnarLog
+COLUMNAR_DTYPES = {'int': 'q', 'bool': 'b'}
+
+
+def columnar_type(value):
+    if value is None:
+        return(None)
+    if isinstance(value, bool):
+        return('bool')
+    if isinstance(value, Integral):
+        # integers that do not fit into 64 bits are kept exactly as text
+        return('int' if -2**63 <= value < 2**63 else 'text')
+    if isinstance(value, Real):
+        return('float')
+    if type(value) in (list, tuple) and \
+            all(isinstance(v, Real) and not isinstance(v, bool) for v in value):
+        return('list')
+    return('text')
+
+
+def format_columnar_value(value, column=None):
+    # the same text as in the csv files written by LogFile and expyriment
+    if column is not None and value is not None:
+        if column['type'] == 'list':
+            value = [int(v) if column.get('item') == 'int' else v for v in value]
+        elif value != value:
+            value = None
+        elif column['type'] == 'int':
+            value = int(value)
+        elif column['type'] == 'bool':
+            value = bool(value)
+    if type(value) in (list, tuple):
+        return('|'.join([str(v) for v in value]))
+    if isinstance(value, bytes) and not isinstance(value, str):
+        return(value.decode('utf-8'))
+    if isinstance(value, type(u'')):
+        return(value)
+    return(str(value))
+
+
+def read_columnar_schema(directory):
+    path = os.path.join(directory, 'schema.json')
+    if not os.path.exists(path):
+        return(None)
+    with open(path, 'r') as f:
+        return(json.load(f))
+
+
+def read_columns(directory, names=None):
+    # numbers are returned as memory-mapped numpy arrays if numpy is
+    # available, otherwise as lists; floats are nan where they are missing,
+    # ints and bools are masked arrays (None in lists)
+    schema = read_columnar_schema(directory)
+    data = {}
+    for column in schema['columns']:
+        if names is None or column['name'] in names:
+            data[column['name']] = read_columnar_column(directory, column, schema['rows'])
+    return(data)
+
+
+def read_columnar_column(directory, column, rows):
+    path = os.path.join(directory, column['file'])
+    if column['type'] is None:
+        return([None] * rows)
+    if column['type'] in ('bool', 'int', 'float'):
+        dtype = column.get('dtype', 'd')
+        values = read_columnar_numbers(path, rows, dtype)
+        if dtype == 'd':
+            return(values)
+        missing = read_columnar_numbers(path + '.na', rows, 'b')
+        if numpy is not None:
+            return(numpy.ma.MaskedArray(values.view(bool) if column['type'] == 'bool' else values,
+                                        mask=missing.view(bool)))
+        convert = bool if column['type'] == 'bool' else int
+        return([None if m else convert(v) for v, m in zip(values, missing)])
+    ends = [int(e) for e in read_columnar_numbers(path + '.idx', rows)]
+    starts = [0] + ends[:-1]
+    if column['type'] == 'list':
+        items = read_columnar_numbers(path, ends[-1] if ends else 0)
+        return([items[a:b] for a, b in zip(starts, ends)])
+    if not ends or not ends[-1]:
+        return([u''] * rows)
+    with open(path, 'rb') as f:
+        blob = mmap.mmap(f.fileno(), ends[-1], access=mmap.ACCESS_READ)
+        try:
+            return([blob[a:b].decode('utf-8') for a, b in zip(starts, ends)])
+        finally:
+            blob.close()
+
+
+def columnar_values(directory, column, rows):
+    # the values of a column as a list, with None for missing ints and bools
+    values = read_columnar_column(directory, column, rows)
+    return(values.tolist() if hasattr(values, 'tolist') else list(values))
+
+
+def read_columnar_numbers(path, count, dtype='d'):
+    # count little-endian numbers of the struct format dtype
+    if not count:
+        return(numpy.zeros(0, dtype='<' + dtype) if numpy is not None else [])
+    size = struct.calcsize(dtype) * count
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+    if numpy is not None:
+        return(numpy.frombuffer(mapped, dtype='<' + dtype, count=count))
+    values = list(struct.unpack('<{}{}'.format(count, dtype), mapped[:size]))
+    mapped.close()
+    return(values)
+
+
+def columnar_to_csv(directory, filename, delimiter=','):
+    # writes the columns in the layout of the csv files written by LogFile
+    schema = read_columnar_schema(directory)
+    names = [c['name'] for c in schema['columns']]
+    data = [columnar_values(directory, c, schema['rows']) for c in schema['columns']]
+    with open(filename, 'wb') as f:
+        f.write((delimiter.join(names) + '\n').encode('utf-8'))
+        for i in range(schema['rows']):
+            f.write((delimiter.join([format_columnar_value(values[i], column)
+                                     for values, column in zip(data, schema['columns'])]) +
+                     '\n').encode('utf-8'))
+
+
+def _append_numbers(path, values, dtype='d'):
+    with open(path, 'ab') as f:
+        f.write(struct.pack('<{}{}'.format(len(values), dtype), *values))
+
+
+def _columnar_ends(path, written, lengths):
+    end = 0
+    if written:
+        end = int(read_columnar_numbers(path, written)[-1])
+    ends = []
+    for length in lengths:
+        end += length
+        ends.append(end)
+    return(ends)
+
+
+def _truncate_file(path, size):
+    if os.path.exists(path) and os.path.getsize(path) > size:
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+
+def copy_value(value):
+    if type(value) is list:
+        return([copy_value(v) for v in value])
+    return(value)
+
+
+def freeze_value(value):
+    if type(value) in (list, tuple):
+        return(tuple(freeze_value(v) for v in value))
+    return(value)
+
+
+_colour_cache = {}
+
+
+class Prefetcher():
+    # stimuli that are presented soon, and functions preparing them, are
+    # preloaded in order whenever there is time to spare; with a budget
+    # [ms], only those that are expected to fit, by the time the last one
+    # of the same kind took, or by half of the previous estimate if that
+    # was longer, so that a single slow one does not hold back its kind for
+    # long. jobs that do not fit are skipped for the time being. jobs
+    # belong to a group, the job itself unless given, e.g. a trial, and
+    # are dropped with expire() once they would no longer be in time
+    unknown_cost = 50
+
+    def __init__(self, clock):
+        self.clock = clock
+        self._queue = deque()
+        self._costs = {}
+
+    def add(self, job, kind=None, group=None):
+        if kind is None:
+            kind = type(job).__name__ if hasattr(job, 'preload') else getattr(job, '__name__', '')
+        self._queue.append((job, kind, job if group is None else group))
+
+    def expire(self, group):
+        self._queue = deque(entry for entry in self._queue if entry[2] != group)
+
+    def cost(self, kind):
+        return(self._costs.get(kind, Prefetcher.unknown_cost))
+
+    def run(self, budget=None):
+        start = self.clock.time
+        skipped = deque()
+        while self._queue:
+            job, kind, group = self._queue.popleft()
+            if getattr(job, 'is_preloaded', False):
+                continue
+            if budget is not None and self.clock.time - start + self.cost(kind) > budget:
+                skipped.append((job, kind, group))
+                continue
+            before = self.clock.time
+            if hasattr(job, 'preload'):
+                job.preload()
+            else:
+                job()
+            took = self.clock.time - before
+            self._costs[kind] = max(took, (self._costs.get(kind, took) + took) / 2.0)
+        self._queue = skipped
+        return(self.clock.time - start)
+
+
+class MessageCache():
+    # message screens by their text and arguments, rendered once and kept
+    # until more than `size` other screens were used since
+    def __init__(self, size=16):
+        self.size = size
+        self._screens = OrderedDict()
+
+    def get(self, key, create):
+        heading, body, kwargs = key
+        key = (heading, body, tuple(sorted((k, freeze_value(v)) for k, v in kwargs.items())))
+        try:
+            screen = self._screens.pop(key, None)
+        except TypeError:
+            # arguments that cannot be compared are not cached
+            key, screen = None, None
+        if screen is None:
+            screen = create()
+            screen.preload()
+        if key is not None and self.size > 0:
+            self._screens[key] = screen
+            while len(self._screens) > self.size:
+                self._screens.popitem(last=False)
+        return(screen)
+
+
+class LogWriter():
+    # writes log buffers on a background thread; put() blocks while the
+    # queue is full, close() returns once everything has been written and
+    # is called by BaseExpyriment, also at exit. jobs put after that are
+    # written right away
+    def __init__(self, queue_size=64):
+        self._queue = Queue(maxsize=queue_size)
+        self._failed = []
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, job):
+        if self._closed:
+            job()
+            return
+        self._queue.put(job)
+
+    def join(self):
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        # jobs that failed in the background are retried here so that
+        # their error is raised rather than lost
+        for job in self._failed:
+            job()
+        self._failed = []
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    break
+                if self._failed:
+                    # keep the order of rows once a write has failed
+                    self._failed.append(job)
+                else:
+                    job()
+            except (IOError, OSError):
+                self._failed.append(job)
+            finally:
+                self._queue.task_done()
+
+
+class TrialData():
+    # columns of all logged trials, for the whole session and for the
+    # current block; both are filled as trials are logged so that the
+    # summaries never have to search or slice the session history;
+    # aggregated summary columns are kept up to date alongside
+    def __init__(self, block_columns=(), session_columns=()):
+        self.session = {}
+        self.block = {}
+        self._block_columns = block_columns
+        self.block_summary = RunningSummary(block_columns)
+        self.session_summary = RunningSummary(session_columns)
+        self._block_id = None
+        self._session_rows = 0
+        self._block_rows = 0
+
+    def append(self, row):
+        if self._block_rows == 0 or row.get('block') != self._block_id:
+            self.block = {}
+            self.block_summary = RunningSummary(self._block_columns)
+            self._block_rows = 0
+            self._block_id = row.get('block')
+        self._session_rows += 1
+        self._block_rows += 1
+        TrialData._append_row(self.session, row, self._session_rows)
+        TrialData._append_row(self.block, row, self._block_rows)
+        self.block_summary.add(row)
+        self.session_summary.add(row)
+
+    def __len__(self):
+        return(self._session_rows)
+
+    @staticmethod
+    def _append_row(columns, row, num_rows):
+        for key, value in row.items():
+            if key not in columns:
+                columns[key] = [None] * (num_rows - 1)
+            columns[key].append(value)
+        # keep columns aligned if a row misses some of the known keys
+        if len(row) < len(columns):
+            for key in columns:
+                if key not in row:
+                    columns[key].append(None)
+
+
 class LogFile(io.OutputFile):
-    def __init__(self, filename, col_names, delimiter=None, comment_char=None, suffix='', directory=''):
+    def __init__(self, filename, col_names, delimiter=None, comment_char=None, suffix='', directory='',
+                 writer=None):
         import atexit
 
         io._input_output.Output.__init__(self)
+        # rows of this file that are queued on a background writer
+        self._writer = writer
 
         self._filename_ = filename
         if delimiter is not None:
@@ -603,6 +1591,13 @@ class LogFile(io.OutputFile):
         rtn = os.path.split(sys.argv[0])[1].replace(".py", "")
         return rtn + '_' + self._filename_ + self.suffix
 
+    def save(self):
+        # the queued rows come before those still buffered, also when this
+        # is called at exit before the writer is closed
+        if self._writer is not None:
+            self._writer.join()
+        return(io.OutputFile.save(self))
+
     def add(self, data):
         def coerce_list_to_string(l): return '|'.join(
             [str(i) for i in l]) if type(l) is list or type(l) is tuple else l
@@ -617,16 +1612,50 @@ class LogFile(io.OutputFile):
             self.write_line(io.DataFile._typecheck_and_cast2str(data))
 
 class ConfigReader():
+    regex_key = r'([\w:\[\]]+)\s*=\s*(.*)'
+
     def __init__(self, defaults={}):
         self.defaults = defaults
         self.error_string = 'Configuration Option [{}] -> {} '
-        self.regex_key = r'([\w:\[\]]+)\s*=\s*(.*)'
+        self._values = {}
+
+    def read(self, files, cache=None):
+        if type(files) is str: files = [files]
+        self._values = {}
+        if cache:
+            # the cache is only valid for files of the same size and time
+            stamp = [[f, os.path.getmtime(f), os.path.getsize(f)] for f in files]
+            self.config = self._read_cache(cache, stamp)
+            if self.config is not None:
+                return
+        self.config = self._parse(files)
+        if cache:
+            try:
+                with open(cache, 'w') as f:
+                    json.dump({'files': stamp, 'config': self.config}, f)
+            except (IOError, OSError):
+                pass
 
-    def read(self, files):
+    @staticmethod
+    def _read_cache(cache, stamp):
+        try:
+            with open(cache, 'r') as f:
+                data = json.load(f)
+            if data['files'] != stamp or type(data['config']) is not dict:
+                return(None)
+            config = data['config']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return(None)
+        if python_version[0] == 2:
+            # json returns unicode, while the files are read as bytes
+            config = dict((s.encode('utf-8'), dict((k.encode('utf-8'), v.encode('utf-8'))
+                                                  for k, v in o.items())) for s, o in config.items())
+        return(config)
+
+    def _parse(self, files):
         section = 'DEFAULTS'
         config = {section:{}}
 
-        if type(files) is str: files = [files]
         for fname in files:
             with open(fname, 'r') as f:
                 key_store = None
@@ -642,11 +1671,15 @@ class ConfigReader():
                             config[section][key.group(1)] = key.group(2).strip()
                         else:
                             config[section][key_store] += '\n' + line.strip()
-        self.config = config
+        return(config)
 
     def has_section(self, section):
         return(section in self.config)
 
+    def set(self, section, option, value):
+        self.config.setdefault(section, {})[option] = str(value)
+        self._values = {}
+
     def has_option(self, section, option):
         return(section in self.config and option in self.config[section])
 
@@ -664,7 +1697,23 @@ class ConfigReader():
             raise ValueError((self.error_string +
                 'not found.').format(section, option))
 
+    def _memoized(self, key, func):
+        # parsed values are kept per option and type; mutable ones are copied
+        # so that callers cannot change the stored value
+        try:
+            if key in self._values:
+                return(copy_value(self._values[key]))
+        except TypeError:
+            return(func())
+        value = func()
+        self._values[key] = value
+        return(copy_value(value))
+
     def _get(self, section, option, func, **kwargs):
+        return(self._memoized((section, option, func, kwargs.get('default')),
+                              lambda: self._cast(section, option, func, **kwargs)))
+
+    def _cast(self, section, option, func, **kwargs):
         try:
             return(func(self.get(section, option, **kwargs)))
         except ValueError:
@@ -678,6 +1727,11 @@ class ConfigReader():
         return(self._get(section, option, float, **kwargs))
 
     def gettuple(self, section, option, assert_length=None, allow_single=False, cast=int, **kwargs):
+        return(self._memoized(
+            (section, option, 'tuple', assert_length, allow_single, cast, kwargs.get('default')),
+            lambda: self._tuple(section, option, assert_length, allow_single, cast, **kwargs)))
+
+    def _tuple(self, section, option, assert_length=None, allow_single=False, cast=int, **kwargs):
         value = self.get(section, option, **kwargs).strip()
         if value.lower() == 'none' or value == '':
             return(None)
@@ -705,7 +1759,8 @@ class ConfigReader():
                     ' or 1' if allow_single else ''))
 
     def getboolean(self, section, option, **kwargs):
-        return self._bool(self.get(section, option, **kwargs), section, option)
+        return(self._memoized((section, option, bool, kwargs.get('default')),
+                              lambda: self._bool(self.get(section, option, **kwargs), section, option)))
 
     def _bool(self, item, section='', option=''):
         item = item.lower()
@@ -728,3 +1783,434 @@ class ConfigReader():
         if len(self.gettuple(section, option, cast=None)) > 1:
             return(True)
         return(False)
+
+    def snapshot(self, schema):
+        # reads and checks all options of the schema at once, and returns
+        # them as a namedtuple of sections, each a namedtuple of the values;
+        # options which are neither set nor have a default are None
+        sections = {}
+        for section, options in schema.items():
+            names = sorted(options)
+            values = [self._setting(section, option, options[option]) for option in names]
+            sections[section.lower()] = namedtuple(section.capitalize(), names)(*values)
+        return(namedtuple('Settings', sorted(sections))(**sections))
+
+    def _setting(self, section, option, spec):
+        kind, flags = spec[0], spec[1:]
+        if not self.has_option(section, option) and option not in self.defaults:
+            if 'required' in flags:
+                raise ValueError((self.error_string + 'not found.').format(section, option))
+            return(None)
+        if 'per_block' not in flags:
+            return(self._typed(section, option, kind, self.get(section, option)))
+        # one value per block, even if the same value is set for all blocks
+        blocks = self.getint('DESIGN', 'blocks')
+        values = self.gettuple(section, option, assert_length=blocks, allow_single=True, cast=None)
+        if not values:
+            return(None)
+        values = tuple(self._typed(section, option, kind, v) for v in values)
+        return(values * blocks if len(values) == 1 else values)
+
+    def _typed(self, section, option, kind, value):
+        if kind == 'bool':
+            return(self._bool(value, section, option))
+        if kind == 'pair':
+            return(freeze_value(self.gettuple(section, option, assert_length=2)))
+        try:
+            if kind == 'int':
+                return(int(value))
+            if kind == 'float':
+                return(float(value))
+            if kind == 'colour':
+                colours = freeze_value(BaseExpyriment._colours(value))
+                for colour in ([] if colours is None else
+                               colours if type(colours[0]) is tuple else [colours]):
+                    if len(colour) not in (3, 4):
+                        raise ValueError(value)
+                return(colours)
+            if kind == 'columns':
+                return(tuple(col.strip() for col in value.split(',')))
+            if kind == 'unit':
+                # converted to pixels once the dpi of the screen is known
+                float(value[:-2] if value[-2:] in ('mm', 'cm', 'in') else value)
+            return(value)
+        except ValueError:
+            raise ValueError((self.error_string + 'could not be coerced to ' +
+                'the {} datatype.').format(section, option, kind))
+
+
+class Catalog():
+    # the messages of one language in i18n.conf, decoded once when they are
+    # read; other languages are skipped. which variant of a message is shown
+    # for a block ([practice], [block:N]) is looked up once per block
+    def __init__(self, filename, language):
+        self.language = language
+        self.messages = Catalog.read(filename, language)
+        self._variants = {}
+        self._highlighted = {}
+
+    def get(self, key):
+        return(self.messages[key] if key in self.messages else (None if key else u''))
+
+    def resolve(self, key, block=None):
+        if not block:
+            return(key)
+        practice = bool(block.factor_dict.get('practice'))
+        cache_key = (key, block.id, practice)
+        if cache_key not in self._variants:
+            variant = key
+            if practice and variant + '[practice]' in self.messages:
+                variant += '[practice]'
+            if variant + '[block:{}]'.format(block.id) in self.messages:
+                variant += '[block:{}]'.format(block.id)
+            self._variants[cache_key] = variant
+        return(self._variants[cache_key])
+
+    def highlighted(self, key):
+        if key not in self._highlighted:
+            value = self.messages.get(key + '[highlight]')
+            self._highlighted[key] = bool(value) and value.lower() in ['yes', 'true', '1']
+        return(self._highlighted[key])
+
+    @staticmethod
+    def read(filename, language):
+        messages = None
+        key = None
+        with codecs.open(filename, 'r', 'utf-8', 'replace') as f:
+            for line in f:
+                if not line.strip() or line[0] == '#':
+                    continue
+                if line.startswith('['):
+                    if messages is not None:
+                        break
+                    if line.strip(u'[]\r\n ') == language:
+                        messages = {}
+                    continue
+                if messages is None:
+                    continue
+                match = re.match(ConfigReader.regex_key, line)
+                if match:
+                    key = str(match.group(1))
+                    messages[key] = match.group(2).strip()
+                else:
+                    messages[key] += u'\n' + line.strip()
+        if messages is None:
+            raise ValueError('Language [{}] not found in {}.'.format(language, filename))
+        return(messages)
+
+
+class SequenceBank():
+    # sequences generated in advance by tools/precompile.py, in a gzipped
+    # json file. subjects are assigned to groups in turn, and every group has
+    # its own pools of sequences, one per task and settings. every subject
+    # draws from each pool in the order of one row of a balanced latin
+    # square, so that across the subjects of a group every sequence is shown
+    # equally often and equally often after every other sequence; only the
+    # order differs within a group, not the sequences themselves
+    def __init__(self, pools, orders):
+        self.pools = pools
+        self.orders = orders
+
+    def next(self, kind, *settings):
+        # the next sequence of the subject, None if there are none (left)
+        order = self.orders.get(SequenceBank.key(kind, *settings))
+        if not order:
+            return(None)
+        return(self.pools[SequenceBank.key(kind, *settings)][order.pop(0)])
+
+    def sequences(self):
+        # all sequences of the subject, in the order they are drawn
+        return(dict((key, [self.pools[key][i] for i in order]) for key, order in self.orders.items()))
+
+    @staticmethod
+    def key(kind, *settings):
+        return(json.dumps([kind] + list(settings)))
+
+    @staticmethod
+    def order(subject, size):
+        # row of a williams design; with an odd size, the rows are followed by
+        # their reverse, so that it is balanced over twice as many subjects
+        rows = size if size % 2 == 0 else 2 * size
+        row = (subject - 1) % rows
+        first = [0 if j == 0 else (j + 1) // 2 if j % 2 else size - j // 2 for j in range(size)]
+        order = [(x + row) % size for x in first]
+        return(order if row < size else [(x + row - size) % size for x in first][::-1])
+
+    @staticmethod
+    def load(filename, subject):
+        with gzip.open(filename, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+        subject = int(subject)
+        if not 1 <= subject <= data['subjects']:
+            raise ValueError('Subject {} is not in the sequence bank {} of {} subjects.'.format(
+                subject, filename, data['subjects']))
+        # files without groups have the pools of a single group
+        groups = data.get('groups')
+        pools = data['pools'][(subject - 1) % groups] if groups else data['pools']
+        row = (subject - 1) // groups + 1 if groups else subject
+        return(SequenceBank(pools, dict(
+            (key, SequenceBank.order(row, len(pool))) for key, pool in pools.items())))
+
+    @staticmethod
+    def save(filename, task, subjects, pools):
+        # pools is a list of the pools of every group
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with gzip.open(filename, 'wb') as f:
+            f.write(json.dumps({'task': task, 'subjects': subjects, 'groups': len(pools),
+                                'pools': pools},
+                               sort_keys=True, separators=(',', ':')).encode('utf-8'))
+        return(filename)
+
+
+def simulation_defaults(display=False):
+    # no delays, ready or goodbye screens, and a window of the configured
+    # size, which is not shown unless the display is asked for
+    control.defaults.window_mode = True
+    control.defaults.fast_quit = True
+    control.defaults.goodbye_delay = 0
+    for name in ['initialize_delay', 'initialise_delay']:
+        if hasattr(control.defaults, name):
+            setattr(control.defaults, name, 0)
+    if not display:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        for name in ['opengl', 'open_gl']:
+            if hasattr(control.defaults, name):
+                setattr(control.defaults, name, 0)
+
+
+class SimulatedClock(misc.Clock):
+    # the clock of a simulated session; time passes only when it is waited
+    # for, so that a session runs as fast as it can be computed
+    def __init__(self):
+        misc.Clock.__init__(self)
+        self.now = 0
+        self.start = 0
+
+    @property
+    def time(self):
+        return(int(self.now))
+
+    @property
+    def stopwatch_time(self):
+        return(int(self.now - self.start))
+
+    def reset_stopwatch(self):
+        self.start = self.now
+
+    def wait(self, waiting_time, *args, **kwargs):
+        self.now += max(waiting_time, 0)
+
+
+class DeviceInput():
+    # the responses of the participant, read from the mouse and keyboard;
+    # the methods are those of expyriment's io.Mouse and io.TextInput that
+    # the tasks use, and SimulatedParticipant replaces them
+    def __init__(self, exp):
+        self.exp = exp
+
+    def participant(self):
+        return(_prompt_participant_information())
+
+    def expect(self, **expected):
+        # what a correct response to the current trial would be, which only
+        # a simulated participant makes use of
+        pass
+
+    def clear(self):
+        self.exp.keyboard.clear()
+        self.exp.mouse.clear()
+
+    def responded(self, response='both'):
+        # whether a message was answered since clear()
+        return((android or response == 'mouse' or response == 'both') and
+               self.exp.mouse.get_last_button_down_event() is not None or
+               (response == 'keyboard' or response == 'both') and
+               len(self.exp.keyboard.read_out_buffered_keys()) > 0)
+
+    @property
+    def position(self):
+        return(self.exp.mouse.position)
+
+    @property
+    def pressed_buttons(self):
+        return(self.exp.mouse.pressed_buttons)
+
+    def wait_press(self, duration=None):
+        return(self.exp.mouse.wait_press(duration=duration))
+
+    def wait_motion(self, duration=None):
+        return(self.exp.mouse.wait_motion(duration=duration))
+
+    def text_input(self, message, **kwargs):
+        return(io.TextInput(message, **kwargs).get())
+
+
+class SimulatedParticipant(DeviceInput):
+    # responds as set in the [SIMULATION] section: reaction times are drawn
+    # from an ex-gaussian distribution (rt_mu, rt_sigma, rt_tau in ms), an
+    # expected response is given with the probability `accuracy`, and one
+    # that is not expected with `false_alarm_rate`. a sequence is recalled
+    # with a probability that halves at the length `digit_span`, or else
+    # with one item swapped, left out, or replaced. the pen of a trail
+    # rests on every target for a reaction time and moves on at
+    # `trail_speed` per second, swaying by up to `trail_sway` and bending
+    # around the other targets; an error first touches a later target and
+    # then goes back to the last correct one
+    def __init__(self, exp, settings):
+        DeviceInput.__init__(self, exp)
+        self.settings = settings
+        self.rng = random.Random(settings.seed)
+        self.speed = exp._unit(settings.trail_speed) / 1000.0
+        self.sway = exp._unit(settings.trail_sway)
+        self.cleared = 0
+        self.press = None
+        self.answer = ''
+        self.trail = []
+        self.trail_ends = []
+        self._position = (0, 0)
+
+    def participant(self):
+        # the ids of the settings, or else those suggested by the prompt
+        ids = {'SUBJECT ID': self.settings.subject, 'SESSION ID': self.settings.session}
+        return(_prompt_participant_information(
+            lambda title, default: str(default if ids[title] is None else ids[title])))
+
+    def reaction_time(self):
+        rt = self.rng.gauss(self.settings.rt_mu, self.settings.rt_sigma)
+        if self.settings.rt_tau > 0:
+            rt += self.rng.expovariate(1.0 / self.settings.rt_tau)
+        return(max(rt, 1))
+
+    def expect(self, buttons=(), correct=(), answer=None, alphabet='', targets=None, radius=0):
+        # buttons of which the correct ones are to be pressed, the answer to
+        # type, or the positions of the targets of a trail
+        now = self.exp.clock.time
+        self.press = None
+        if correct and self.rng.random() < self.settings.accuracy:
+            self.press = (now + self.reaction_time(), self.rng.choice(correct).position)
+        elif buttons and not correct and self.rng.random() < self.settings.false_alarm_rate:
+            self.press = (now + self.reaction_time(), self.rng.choice(buttons).position)
+        if answer is not None:
+            self.answer = self.recall(answer, alphabet)
+        if targets:
+            self.plan_trail(now, targets, radius)
+
+    def clear(self):
+        self.cleared = self.exp.clock.time
+
+    def responded(self, response='both'):
+        return(self.exp.clock.time - self.cleared >= self.settings.message_time)
+
+    def wait_press(self, duration=None):
+        now = self.exp.clock.time
+        if self.press is not None and (duration is None or self.press[0] <= now + duration):
+            pressed_at, self._position = self.press
+            self.press = None
+            self.exp.clock.wait(pressed_at - now)
+            return(0, self._position, max(int(pressed_at - now), 0))
+        self.exp.clock.wait(duration or 0)
+        return(None, self._position, None)
+
+    def text_input(self, message, length=None, **kwargs):
+        # typed one character after another
+        for _ in range(len(self.answer) + 1):
+            self.exp.clock.wait(self.reaction_time())
+        return(self.answer[:length] if length else self.answer)
+
+    def recall(self, answer, alphabet=''):
+        probability = self.settings.accuracy / (1 + math.exp(len(answer) - self.settings.digit_span))
+        if not answer or self.rng.random() < probability:
+            return(answer)
+        errors = ['omission'] + (['transposition'] if len(answer) > 1 else []) + \
+            (['substitution'] if len(set(alphabet)) > 1 else [])
+        error = self.rng.choice(errors)
+        i = self.rng.randrange(len(answer) - (error == 'transposition'))
+        if error == 'transposition':
+            return(answer[:i] + answer[i + 1] + answer[i] + answer[i + 2:])
+        if error == 'substitution':
+            return(answer[:i] + self.rng.choice([c for c in alphabet if c != answer[i]]) + answer[i + 1:])
+        return(answer[:i] + answer[i + 1:])
+
+    @property
+    def position(self):
+        return(self._position)
+
+    @property
+    def pressed_buttons(self):
+        return((1, 0, 0))
+
+    def wait_motion(self, duration=None):
+        self.exp.clock.wait(duration or 0)
+        self._position = self.trail_position(self.exp.clock.time)
+        return(self._position, duration)
+
+    def plan_trail(self, now, targets, radius):
+        # segments (start, end, from, to, sway) of the path of the pen
+        order = [targets[0]]
+        for k in range(1, len(targets)):
+            if targets[k + 1:] and self.rng.random() >= self.settings.accuracy:
+                order += [self.rng.choice(targets[k + 1:]), targets[k - 1]]
+            order.append(targets[k])
+        clearance = 2 * radius
+        sway = min(self.sway, radius / 2.0) if radius else self.sway
+        self.trail = []
+        t = now
+        for i, target in enumerate(order):
+            if i:
+                obstacles = [p for p in targets if p != order[i - 1] and p != target]
+                points = [order[i - 1]] + self.route(order[i - 1], target, obstacles, clearance)
+                for a, b in zip(points, points[1:]):
+                    duration = max(math.hypot(b[0] - a[0], b[1] - a[1]) / self.speed, 1)
+                    self.trail.append((t, t + duration, a, b,
+                                       max(-sway, min(sway, self.rng.gauss(0, sway)))))
+                    t += duration
+            duration = self.reaction_time()
+            self.trail.append((t, t + duration, target, target, 0))
+            t += duration
+        self.trail_ends = [segment[1] for segment in self.trail]
+
+    def trail_position(self, time):
+        if not self.trail:
+            return(self._position)
+        start, end, a, b, sway = self.trail[min(bisect_right(self.trail_ends, time), len(self.trail) - 1)]
+        f = min(max(1.0 * (time - start) / (end - start), 0), 1)
+        dx, dy = b[0] - a[0], b[1] - a[1]
+        length = math.hypot(dx, dy) or 1
+        offset = sway * math.sin(math.pi * f)
+        return((int(round(a[0] + f * dx - offset * dy / length)),
+                int(round(a[1] + f * dy + offset * dx / length))))
+
+    def route(self, a, b, obstacles, clearance):
+        # waypoints after a up to b, bending around every obstacle closer
+        # than the clearance to the straight line, within the window
+        width, height = self.exp.screen.window_size
+        points = [a, b]
+        i = 0
+        for _ in range(4 * len(obstacles) + 1):
+            if i >= len(points) - 1:
+                break
+            p, q = points[i], points[i + 1]
+            near = [(SimulatedParticipant.closest_point(o, p, q), o) for o in obstacles]
+            near = [(c, o) for c, o in near if math.hypot(c[0] - o[0], c[1] - o[1]) < clearance]
+            if not near:
+                i += 1
+                continue
+            c, o = min(near, key=lambda n: math.hypot(n[1][0] - p[0], n[1][1] - p[1]))
+            nx, ny = c[0] - o[0], c[1] - o[1]
+            if math.hypot(nx, ny) < 1e-6:
+                nx, ny = -(q[1] - p[1]), q[0] - p[0]
+            scale = 1.2 * clearance / (math.hypot(nx, ny) or 1)
+            points.insert(i + 1, (max(-width / 2 + 1, min(width / 2 - 1, o[0] + nx * scale)),
+                                  max(-height / 2 + 1, min(height / 2 - 1, o[1] + ny * scale))))
+        return(points[1:])
+
+    @staticmethod
+    def closest_point(o, p, q):
+        # the point of the line from p to q closest to o
+        dx, dy = q[0] - p[0], q[1] - p[1]
+        f = 1.0 * ((o[0] - p[0]) * dx + (o[1] - p[1]) * dy) / (dx * dx + dy * dy or 1)
+        f = min(max(f, 0), 1)
+        return((p[0] + f * dx, p[1] + f * dy))
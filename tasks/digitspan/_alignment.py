@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" SEQUENCE ALIGNMENT.
+scores the answer of a digit span trial against the presented sequence.
+
+The matches are those of python's difflib.SequenceMatcher(None, answer,
+sequence), which repeatedly takes the longest continuous match and then
+matches what is left on either side of it. They are found here with the
+same search as difflib, without the set-up of a SequenceMatcher and its junk
+heuristics, which do not apply to the short keys of the task, and without
+any search at all for answers that equal the sequence. Sequences of 200
+characters or more are left to difflib, which then treats frequent
+characters as junk.
+
+On top of these, the edit distance (Levenshtein), the longest common
+subsequence, and the number of transpositions are computed with bit-parallel
+algorithms, see Hyyrö (2004), Bit-Parallel LCS-length Computation Revisited,
+Myers (1999), A Fast Bit-Vector Algorithm for Approximate String Matching,
+and Hyyrö (2003), A Bit-Vector Algorithm for Computing Levenshtein and
+Damerau Edit Distances. Only the metrics that are asked for are computed.
+
+evaluate_batch() and evaluate_rows() score many trials at once, e.g. all
+rows of the .xpd-files of a study, see evaluate_file(), and
+benchmarks/digitspan_scoring.py for how long that takes.
+
+MIT License, see LICENSE in the repository.
+"""
+
+import csv
+import difflib
+
+# the length of sequence from which difflib ignores frequent characters
+DIFFLIB_AUTOJUNK = 200
+
+METRICS = ('longest_match', 'total_match', 'initial_match_answer', 'initial_match_sequence',
+           'similarity', 'edit_distance', 'transpositions', 'omissions', 'intrusions')
+DIFFLIB_METRICS = METRICS[:5]
+_DIFFLIB = frozenset(DIFFLIB_METRICS)
+_DISTANCES = frozenset(METRICS[5:])
+
+
+def evaluate(answer, sequence, metrics=METRICS):
+    # the metrics of one trial; the first five are those of difflib
+    everything = metrics is METRICS
+    if answer == sequence:
+        n = len(answer)
+        scores = {'longest_match': n, 'total_match': n, 'initial_match_answer': n,
+                  'initial_match_sequence': n, 'similarity': 1.0, 'edit_distance': 0,
+                  'transpositions': 0, 'omissions': 0, 'intrusions': 0}
+    else:
+        scores = {}
+        if everything or not _DIFFLIB.isdisjoint(metrics):
+            matches = matching_blocks(answer, sequence)
+            longest = total = 0
+            for m in matches:
+                total += m[2]
+                if m[2] > longest:
+                    longest = m[2]
+            first = matches[0]
+            scores['longest_match'] = longest
+            scores['total_match'] = total
+            scores['initial_match_answer'] = first[2] if first[0] == 0 else 0
+            scores['initial_match_sequence'] = first[2] if first[1] == 0 else 0
+            scores['similarity'] = 2.0 * total / (len(answer) + len(sequence))
+        if everything or not _DISTANCES.isdisjoint(metrics):
+            distance, osa, common = distances(answer, sequence)
+            scores['edit_distance'] = distance
+            scores['transpositions'] = distance - osa
+            scores['omissions'] = len(sequence) - common
+            scores['intrusions'] = len(answer) - common
+    return(scores if everything else dict((m, scores[m]) for m in metrics))
+
+
+def matching_blocks(a, b):
+    # (i, j, size) of every match of a[i:i+size] and b[j:j+size], with
+    # adjacent matches joined, followed by (len(a), len(b), 0), as returned
+    # by difflib.SequenceMatcher(None, a, b).get_matching_blocks()
+    if len(b) >= DIFFLIB_AUTOJUNK:
+        return([tuple(m) for m in difflib.SequenceMatcher(None, a, b).get_matching_blocks()])
+    if a == b:
+        return([(0, 0, len(a)), (len(a), len(b), 0)] if a else [(0, 0, 0)])
+    # the positions of every character in b
+    b2j = {}
+    for j, x in enumerate(b):
+        b2j.setdefault(x, []).append(j)
+    blocks = []
+    queue = [(0, len(a), 0, len(b))]
+    while queue:
+        alo, ahi, blo, bhi = queue.pop()
+        i, j, k = longest_match(a, b2j, alo, ahi, blo, bhi)
+        if k:
+            blocks.append((i, j, k))
+            if alo < i and blo < j:
+                queue.append((alo, i, blo, j))
+            if i + k < ahi and j + k < bhi:
+                queue.append((i + k, ahi, j + k, bhi))
+    blocks.sort()
+    joined = []
+    i1 = j1 = k1 = 0
+    for i2, j2, k2 in blocks:
+        if i1 + k1 == i2 and j1 + k1 == j2:
+            k1 += k2
+        else:
+            if k1:
+                joined.append((i1, j1, k1))
+            i1, j1, k1 = i2, j2, k2
+    if k1:
+        joined.append((i1, j1, k1))
+    joined.append((len(a), len(b), 0))
+    return(joined)
+
+
+def longest_match(a, b2j, alo, ahi, blo, bhi):
+    # the longest match of a[alo:ahi] and b[blo:bhi]; of those equally long,
+    # the one starting first in a, and then first in b, as difflib does.
+    # lengths holds, by position in b, the length of the match ending there
+    # and at the previous character of a
+    besti, bestj, bestsize = alo, blo, 0
+    lengths = {}
+    nothing = ()
+    for i in range(alo, ahi):
+        previous, lengths = lengths.get, {}
+        for j in b2j.get(a[i], nothing):
+            if j < blo:
+                continue
+            if j >= bhi:
+                break
+            k = lengths[j] = previous(j - 1, 0) + 1
+            if k > bestsize:
+                besti, bestj, bestsize = i - k + 1, j - k + 1, k
+    return(besti, bestj, bestsize)
+
+
+def _masks(a):
+    # one bit per position of a for every character
+    masks = {}
+    for i, x in enumerate(a):
+        masks[x] = masks.get(x, 0) | 1 << i
+    return(masks)
+
+
+def lcs_length(a, b):
+    # length of the longest common subsequence; every zero bit of v is one
+    # character of a in the subsequence
+    if not a or not b:
+        return(0)
+    masks = _masks(a)
+    full = (1 << len(a)) - 1
+    v = full
+    for x in b:
+        u = v & masks.get(x, 0)
+        v = ((v + u) | (v - u)) & full
+    return(len(a) - bin(v).count('1'))
+
+
+def edit_distance(a, b):
+    # number of characters inserted, deleted, or replaced to turn a into b;
+    # pv and mv are the vertical differences of +1 and -1 in the current
+    # column of the distance matrix, and the distance is tracked in its
+    # last row
+    if not a:
+        return(len(b))
+    masks = _masks(a)
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    pv, mv, distance = full, 0, len(a)
+    for x in b:
+        eq = masks.get(x, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv & full
+    return(distance)
+
+
+def osa_distance(a, b):
+    # the edit distance when swapping two neighbouring characters counts as
+    # one edit (optimal string alignment); the difference to the edit
+    # distance is the number of such swaps. as edit_distance, with the
+    # swaps added to the diagonal differences d0
+    if not a:
+        return(len(b))
+    masks = _masks(a)
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    pv, mv, d0, previous, distance = full, 0, 0, 0, len(a)
+    for x in b:
+        eq = masks.get(x, 0)
+        swaps = ((~d0 & eq) << 1) & previous
+        d0 = ((((eq & pv) + pv) ^ pv) | eq | mv | swaps) & full
+        ph = mv | ~(d0 | pv)
+        mh = d0 & pv
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = (ph << 1) | 1
+        mh = mh << 1
+        pv = (mh | ~(d0 | ph)) & full
+        mv = ph & d0 & full
+        previous = eq
+    return(distance)
+
+
+def distances(a, b):
+    # edit_distance, osa_distance, and lcs_length in one pass over b
+    if not a:
+        return(len(b), len(b), 0)
+    masks = _masks(a)
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+    pv, mv, distance = full, 0, len(a)
+    opv, omv, d0, previous, osa = full, 0, 0, 0, len(a)
+    v = full
+    for x in b:
+        eq = masks.get(x, 0)
+        u = v & eq
+        v = ((v + u) | (v - u)) & full
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | ~(xh | pv)
+        mh = pv & xh
+        if ph & last:
+            distance += 1
+        elif mh & last:
+            distance -= 1
+        ph = (ph << 1) | 1
+        pv = ((mh << 1) | ~(xv | ph)) & full
+        mv = ph & xv & full
+        swaps = ((~d0 & eq) << 1) & previous
+        d0 = ((((eq & opv) + opv) ^ opv) | eq | omv | swaps) & full
+        ph = omv | ~(d0 | opv)
+        mh = d0 & opv
+        if ph & last:
+            osa += 1
+        elif mh & last:
+            osa -= 1
+        ph = (ph << 1) | 1
+        opv = ((mh << 1) | ~(d0 | ph)) & full
+        omv = ph & d0 & full
+        previous = eq
+    return(distance, osa, len(a) - bin(v).count('1'))
+
+
+def evaluate_batch(pairs, metrics=METRICS):
+    # metrics of many (answer, sequence) pairs; as the same short keys and
+    # answers recur, every distinct pair is only scored once
+    scores = {}
+    results = []
+    for pair in pairs:
+        if pair in scores:
+            results.append(dict(scores[pair]))
+        else:
+            scores[pair] = evaluate(pair[0], pair[1], metrics)
+            results.append(scores[pair])
+    return(results)
+
+
+def is_reversed(value):
+    return(str(value).strip().lower() in ('1', 'true', 'yes'))
+
+
+def evaluate_rows(rows, answer='user_input', sequence='sequence', reverse='reverse',
+                  metrics=METRICS):
+    # rows of a trial log as dictionaries, with the metrics added; the answer
+    # of a reverse block is scored from its end, as in the experiment
+    rows = list(rows)
+    pairs = [((row[answer] or '')[::-1] if is_reversed(row.get(reverse)) else row[answer] or '',
+              row[sequence] or '') for row in rows]
+    for row, scores in zip(rows, evaluate_batch(pairs, metrics)):
+        row.update(scores)
+        yield row
+
+
+def read_rows(filename, delimiter=','):
+    # columns and rows of a csv file, or of an .xpd-file without its comments
+    with open(filename, 'r') as f:
+        reader = csv.DictReader((line for line in f if not line.startswith('#')),
+                                delimiter=delimiter)
+        rows = list(reader)
+    return(reader.fieldnames or [], rows)
+
+
+def evaluate_file(filename, output, delimiter=',', metrics=METRICS, **columns):
+    # scores all trials of a csv or .xpd-file and writes them to output,
+    # with the metrics replacing or following the columns of the file
+    fieldnames, rows = read_rows(filename, delimiter)
+    fieldnames = list(fieldnames) + [m for m in metrics if m not in fieldnames]
+    with open(output, 'w') as f:
+        writer = csv.DictWriter(f, fieldnames, delimiter=delimiter, lineterminator='\n')
+        writer.writeheader()
+        for row in evaluate_rows(rows, metrics=metrics, **columns):
+            writer.writerow(row)
+    return(len(rows))
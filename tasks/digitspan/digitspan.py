@@ -40,9 +40,9 @@ SOFTWARE.
 # keywords for the android app expyriment.initialize()
 from expyriment import design, control, stimuli, io, misc
 from _base_expyriment import BaseExpyriment, _
-from random import random, randint
+import random
 from collections import Counter
-import difflib
+import _alignment
 try:
     import android
 except ImportError:
@@ -63,16 +63,40 @@ DEFAULTS = {
     'duration_break': 200
 }
 
+SCHEMA = {
+    'DESIGN': {
+        'trials': ('int', 'per_block', 'required'),
+        'starting_length': ('int', 'per_block'),
+        'sequence_type': ('str', 'per_block'),
+        'reverse': ('bool', 'per_block'),
+        'duration_display': ('int',),
+        'duration_break': ('int',)
+    },
+    'APPEARANCE': {
+        'stimulus_offset': ('pair',),
+        'input_offset': ('pair',),
+        'stimulus_text_size_scale': ('int',),
+        'input_text_size_scale': ('int',),
+        'stimulus_colour': ('colour',),
+        'foreground_colour': ('colour',),
+        'background_colour': ('colour',)
+    },
+    'ANDROID': {
+        'input_offset': ('pair',),
+        'input_method': ('str',)
+    }
+}
+
 
 class DigitSpan():
     @staticmethod
     def run():
-        exp = BaseExpyriment(DEFAULTS)
+        exp = BaseExpyriment(DEFAULTS, SCHEMA)
         digitspan = DigitSpan(exp)
 
         digitspan.start()
 
-        for i in range(exp.config.getint('DESIGN', 'blocks')):
+        for i in range(exp.settings.design.blocks):
             digitspan.run_block(block_id=i+1)
 
         exp._log_experiment()
@@ -82,23 +106,22 @@ class DigitSpan():
 
     def __init__(self, exp):
         self.exp = exp
+        self.settings = self.exp.settings
 
         # OPTIONAL OPTIONS
-        if self.exp.config.has_section('APPEARANCE'):
-            pass
-        self.stimulus_offset = self.exp.config.gettuple('APPEARANCE', 'stimulus_offset', assert_length=2)
-        self.input_offset = self.exp.config.gettuple('ANDROID' if android else 'APPEARANCE', 'input_offset', assert_length=2)
+        self.stimulus_offset = self.settings.appearance.stimulus_offset
+        self.input_offset = (self.settings.android if android else self.settings.appearance).input_offset
         self.stimulus_text_size = design.defaults.experiment_text_size * \
-            self.exp.config.getint('APPEARANCE', 'stimulus_text_size_scale')
+            self.settings.appearance.stimulus_text_size_scale
         self.input_text_size = design.defaults.experiment_text_size * \
-            self.exp.config.getint('APPEARANCE', 'input_text_size_scale')
-        self.stimulus_colour = self.exp.config.gettuple(
-            'APPEARANCE', 'stimulus_colour', assert_length=3)
+            self.settings.appearance.input_text_size_scale
+        self.stimulus_colour = self.settings.appearance.stimulus_colour
         # TODO
-        self.foreground_colour = self.exp.config.gettuple(
-            'APPEARANCE', 'foreground_colour', assert_length=3)
-        self.background_colour = self.exp.config.gettuple(
-            'APPEARANCE', 'stimulus_colour', assert_length=3)
+        self.foreground_colour = self.settings.appearance.foreground_colour
+        self.background_colour = self.settings.appearance.stimulus_colour
+        self.duration_display = self.settings.design.duration_display
+        self.duration_break = self.settings.design.duration_break
+        self.input_method = self.settings.android.input_method
 
     def start(self):
         self.exp._start()
@@ -108,27 +131,22 @@ class DigitSpan():
         if block_id:
             block._id = block_id
         block.set_factor('starting_length',
-                            self.exp.config.getforblock('DESIGN',
-                                'starting_length', block_id-1, cast=int))
+                            self.settings.design.starting_length[block_id-1])
         block.set_factor('reverse',
-                            int(self.exp.config.getforblock('DESIGN',
-                                'reverse', block_id-1, cast=bool)))
+                            int(self.settings.design.reverse[block_id-1]))
         block.set_factor('sequence_type',
-                            self.exp.config.getforblock('DESIGN',
-                                'sequence_type', block_id-1))
+                            self.settings.design.sequence_type[block_id-1])
         seq_length = block.get_factor('starting_length')
         instructions_changed = False
         if block_id > 1 and block.get_factor('reverse') != \
-            int(self.exp.config.getforblock('DESIGN','reverse', block_id-2,
-                cast=bool)):
+            int(self.settings.design.reverse[block_id-2]):
             instructions_changed = True
         self.exp._show_message('instruction_title_changed' if
              instructions_changed else 'instruction_title',
              'instruction_reverse' if block.get_factor('reverse') else
              'instruction', stall=8000, heading_bold=True,
              heading_colour=(255,0,0) if instructions_changed else None)
-        block.set_factor('trials', self.exp.config.getforblock('DESIGN',
-                            'trials', block_id-1, cast=int))
+        block.set_factor('trials', self.settings.design.trials[block_id-1])
         for t in range(block.get_factor('trials')):
             correct = self.run_trial(block, seq_length, trial_id=t+1)
             seq_length += 1 if correct else -1
@@ -137,20 +155,25 @@ class DigitSpan():
         self.exp._log_block(block)
 
     def run_trial(self, block, seq_length, trial_id=None):
-        key = DigitSpan.generate_key(seq_length, block.get_factor('sequence_type'))
+        key = self.exp.sequences.next('digitspan', seq_length, block.get_factor('sequence_type')) \
+            if self.exp.sequences else None
+        if key is None:
+            key = DigitSpan.generate_key(seq_length, block.get_factor('sequence_type'))
         trial = self.prepare_trial(key)
         if trial_id:
             trial._id = trial_id
         block.add_trial(trial)
+        for stimulus in trial.stimuli:
+            self.exp.prefetcher.add(stimulus)
+        self.exp.prefetcher.add(lambda: self.prepare_feedback(trial, block), 'feedback', trial)
 
-        self.play_trial(trial)
+        self.play_trial(trial, block)
         correct, user_input = self.user_answer(block, trial)
+        self.exp.prefetcher.expire(trial)
 
-        self.exp._log_trial(block, trial,
-                            {'correct': correct, 'user_input': user_input},
-                              DigitSpan.evaluate_trial(user_input[::-1] if
-                                block.get_factor('reverse') else user_input,
-                              trial.get_factor('sequence')))
+        self.exp._log_trial(block, trial, {'user_input': user_input},
+                            DigitSpan.score_trial(user_input, trial.get_factor('sequence'),
+                                                  block.get_factor('reverse')))
         return(correct)
 
     def prepare_trial(self, key):
@@ -166,39 +189,49 @@ class DigitSpan():
         trial.set_factor('sequence_length', len(key))
         return(trial)
 
-    def play_trial(self, trial):
+    def play_trial(self, trial, block=None):
         self.exp._show_message('', 'click_to_start')
-        duration_display = self.exp.config.getint('DESIGN', 'duration_display')
-        duration_break = self.exp.config.getint('DESIGN', 'duration_break')
+        duration_display = self.duration_display
+        duration_break = self.duration_break
         blank = stimuli.BlankScreen()
-        self.exp.clock.wait(duration_display / 2 - trial.preload_stimuli() - blank.present())
+        # stimuli and feedback not preloaded while the message was shown
+        # are preloaded in between, as far as there is time
+        self.exp._idle_wait(duration_display / 2 - blank.present())
         for i, stimulus in enumerate(trial.stimuli):
-            self.exp.clock.wait(duration_display - stimulus.present())
-            self.exp.clock.wait(duration_break - blank.present())
-        self.exp.clock.wait(duration_display / 2 - stimuli.BlankScreen().present())
+            self.exp.prefetcher.expire(stimulus)
+            self.exp._idle_wait(duration_display - stimulus.present())
+            self.exp._idle_wait(duration_break - blank.present())
+        self.exp._idle_wait(duration_display / 2 - stimuli.BlankScreen().present())
+
+    def prepare_feedback(self, trial, block=None):
+        reverse = block.get_factor('reverse') if block else False
+        format = DigitSpan.feedback_format(trial)
+        return(self.exp._prepare_message('', 'correct_trial', format=format) +
+               self.exp._prepare_message('', 'incorrect_trial_reverse' if reverse else
+                                         'incorrect_trial', format=format))
 
     def user_answer(self, block, trial):
         reverse = block.get_factor('reverse')
         correct_answer = trial.get_factor('sequence')
         seq_length = trial.get_factor('sequence_length')
-        input_method = self.exp.config.get('ANDROID', 'input_method')
+        input_method = self.input_method
         if android and input_method == 'keyboard':
             android.show_keyboard()
         self.exp.keyboard.clear()
+        self.exp.input_source.expect(answer=correct_answer[::-1] if reverse else correct_answer,
+                                     alphabet=DigitSpan.key_alphabet(block.get_factor('sequence_type')))
         if not android or input_method == 'keyboard' or input_method == 'none':
-            user_input = io.TextInput(_('remember_sequence_reverse') if
+            user_input = self.exp.input_source.text_input(_('remember_sequence_reverse') if
                                         reverse else _('remember_sequence'),
                                         length=seq_length,
                                         position=self.input_offset,
                                         user_text_size=self.input_text_size
-                                    ).get().strip()
+                                    ).strip()
             android.hide_keyboard() if android else None
         else:
             pass
         answer = user_input[::-1] if reverse else user_input
-        format = {'sequence': correct_answer,
-                  'sequence_length': seq_length,
-                  'sequence_reverse': correct_answer[::-1]}
+        format = DigitSpan.feedback_format(trial)
         if answer.strip() == correct_answer:
             self.exp._show_message('', 'correct_trial', format=format)
         else:
@@ -210,50 +243,132 @@ class DigitSpan():
         self.exp._end()
 
     @staticmethod
-    def evaluate_trial(answer, sequence):
-        evaluation = {}
-        seq_match = difflib.SequenceMatcher(None, answer, sequence)
-        matches = seq_match.get_matching_blocks()
-        evaluation['longest_match'] = max(matches, key=lambda x: x.size)[2]
-        evaluation['total_match'] = sum(m.size for m in matches)
-        evaluation['initial_match_answer'] = matches[0].size if matches[0].a == 0 else 0
-        evaluation['initial_match_sequence'] = matches[0].size if matches[0].b == 0 else 0
-        evaluation['similarity'] = seq_match.ratio()
-        return(evaluation)
+    def feedback_format(trial):
+        sequence = trial.get_factor('sequence')
+        return({'sequence': sequence,
+                'sequence_length': trial.get_factor('sequence_length'),
+                'sequence_reverse': sequence[::-1]})
+
+    @staticmethod
+    def score_trial(user_input, sequence, reverse, metrics=_alignment.METRICS):
+        # the answer of a reverse block is compared from its end; see
+        # tools/rescore.py
+        answer = user_input[::-1] if reverse else user_input
+        scores = DigitSpan.evaluate_trial(answer, sequence, metrics)
+        scores['correct'] = answer == sequence
+        return(scores)
 
     @staticmethod
-    def generate_key(seq_length, type):
-        while True:
-            key = ''
-            while len(key) < seq_length:
-                if type == 'numeric':
-                    key += '{:.15f}'.format(random()).split('.')[1][-(seq_length-len(key)):]
-                elif type == 'ALPHABETIC' or type == 'ALPHABETICAL':
-                    key += chr(randint(65, 90))
-                elif type == 'alphabetic' or type == 'alphabetical':
-                    key += chr(randint(97, 122))
-                else:
-                    raise ValueError(
-                        'Digit Span type needs to be `numeric` or `alphabetic` or `ALPHABETIC`')
-            if DigitSpan.check_key_validity(key):
-                return(key)
+    def evaluate_trial(answer, sequence, metrics=_alignment.METRICS):
+        # the same matches as difflib, plus edit distance, transpositions,
+        # omissions, and intrusions, see _alignment.py
+        return(_alignment.evaluate(answer, sequence, metrics))
 
     @staticmethod
-    def check_key_validity(key):
-        if sorted(Counter(key).values())[-1] > max(1, len(key) / 4) \
-                or sum([1 for i in range(1, len(key)) if key[i] == key[i-1]]) > len(key) / 7 \
-                or sum([1 for i in range(2, len(key)) if key[i] == key[i-2]]) > len(key) / 8 \
-                or sum([1 for i in range(3, len(key)) if key[i] == key[i-3]]) > len(key) / 9:
-            return(False)
-        if len(key) >= 2:
-            diffs = [ord(key[i]) - ord(key[i-1]) for i in range(1, len(key))]
-            if Counter(diffs)[0] > max(1, len(key) / 6) \
-                    or sorted(Counter(diffs).values())[-1] > max(1, len(key) / 3) \
-                    or sum([1 for i in range(1, len(diffs)) if diffs[i] == diffs[i-1]]) > max(1, len(key) / 16):
+    def generate_key(seq_length, type, rng=random):
+        # the key is built one character at a time, and a character is only
+        # added if the key can still be valid; as all limits of a valid key
+        # are on counts that can only grow, a key whose beginning exceeds
+        # them cannot become valid anymore. if no character fits, the
+        # previous one is replaced by one not tried yet
+        alphabet = DigitSpan.key_alphabet(type)
+        constraints = KeyConstraints(seq_length)
+        candidates = [list(alphabet)]
+        while len(constraints.key) < seq_length:
+            untried = candidates[-1]
+            if not untried:
+                candidates.pop()
+                if not constraints.key:
+                    raise ValueError('No valid Digit Span key of length {}.'.format(seq_length))
+                constraints.pop()
+                continue
+            # characters not tried yet are drawn without replacement
+            i = int(rng.random() * len(untried))
+            untried[i], untried[-1] = untried[-1], untried[i]
+            if constraints.push(untried.pop()):
+                candidates.append(list(alphabet))
+            else:
+                constraints.pop()
+        return(''.join(constraints.key))
+
+    @staticmethod
+    def key_alphabet(type):
+        if type == 'numeric':
+            return('0123456789')
+        elif type == 'ALPHABETIC' or type == 'ALPHABETICAL':
+            return(''.join(chr(i) for i in range(65, 91)))
+        elif type == 'alphabetic' or type == 'alphabetical':
+            return(''.join(chr(i) for i in range(97, 123)))
+        raise ValueError(
+            'Digit Span type needs to be `numeric` or `alphabetic` or `ALPHABETIC`')
+
+    @staticmethod
+    def check_key_validity(key, length=None):
+        # with a length, whether a key starting with these characters can
+        # still be valid once it has that length
+        constraints = KeyConstraints(length or len(key))
+        for character in key:
+            if not constraints.push(character):
                 return(False)
         return(True)
 
 
+class KeyConstraints():
+    # the counts limited for a valid key of the given length, updated for
+    # every character added to or removed from the end of the key: how often
+    # each character occurs, how often a character equals the one 1, 2, or 3
+    # before, how often each difference between neighbouring characters
+    # occurs, and how often a difference equals the one before. push is
+    # False as soon as the key exceeds a limit, which it then cannot fall
+    # below anymore by adding characters
+    def __init__(self, length):
+        self.key = []
+        self.diffs = []
+        self.characters = Counter()
+        self.differences = Counter()
+        self.repeats = [0, 0, 0]
+        self.repeated_diffs = 0
+        self.max_characters = max(1, length / 4)
+        self.max_repeats = [length / 7, length / 8, length / 9]
+        self.max_zero_diffs = max(1, length / 6)
+        self.max_differences = max(1, length / 3)
+        self.max_repeated_diffs = max(1, length / 16)
+
+    def push(self, character):
+        key = self.key
+        key.append(character)
+        self.characters[character] += 1
+        valid = self.characters[character] <= self.max_characters
+        for lag in (1, 2, 3):
+            if len(key) > lag and key[-1 - lag] == character:
+                self.repeats[lag - 1] += 1
+                valid = valid and self.repeats[lag - 1] <= self.max_repeats[lag - 1]
+        if len(key) >= 2:
+            diff = ord(character) - ord(key[-2])
+            self.diffs.append(diff)
+            self.differences[diff] += 1
+            valid = valid and self.differences[diff] <= self.max_differences and \
+                (diff != 0 or self.differences[0] <= self.max_zero_diffs)
+            if len(self.diffs) >= 2 and self.diffs[-2] == diff:
+                self.repeated_diffs += 1
+                valid = valid and self.repeated_diffs <= self.max_repeated_diffs
+        return(valid)
+
+    def pop(self):
+        key = self.key
+        character = key[-1]
+        self.characters[character] -= 1
+        for lag in (1, 2, 3):
+            if len(key) > lag and key[-1 - lag] == character:
+                self.repeats[lag - 1] -= 1
+        if len(key) >= 2:
+            diff = self.diffs.pop()
+            self.differences[diff] -= 1
+            if self.diffs and self.diffs[-1] == diff:
+                self.repeated_diffs -= 1
+        return(key.pop())
+
+
 def main():
     DigitSpan.run()
 
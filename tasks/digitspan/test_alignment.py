@@ -0,0 +1,105 @@
+import random
+import difflib
+
+import pytest
+
+import _alignment
+
+
+def previous_evaluate_trial(answer, sequence):
+    # DigitSpan.evaluate_trial before the alignment module, for comparison
+    evaluation = {}
+    seq_match = difflib.SequenceMatcher(None, answer, sequence)
+    matches = seq_match.get_matching_blocks()
+    evaluation['longest_match'] = max(matches, key=lambda x: x.size)[2]
+    evaluation['total_match'] = sum(m.size for m in matches)
+    evaluation['initial_match_answer'] = matches[0].size if matches[0].a == 0 else 0
+    evaluation['initial_match_sequence'] = matches[0].size if matches[0].b == 0 else 0
+    evaluation['similarity'] = seq_match.ratio()
+    return(evaluation)
+
+
+def distances(a, b):
+    # edit distance, with neighbouring characters swapped as one edit, and
+    # longest common subsequence, from the full matrices
+    d = [[i + j if not i * j else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    osa = [row[:] for row in d]
+    lcs = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + cost)
+            osa[i][j] = min(osa[i - 1][j] + 1, osa[i][j - 1] + 1, osa[i - 1][j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                osa[i][j] = min(osa[i][j], osa[i - 2][j - 2] + 1)
+            lcs[i][j] = lcs[i - 1][j - 1] + 1 if not cost else max(lcs[i - 1][j], lcs[i][j - 1])
+    return(d[-1][-1], osa[-1][-1], lcs[-1][-1])
+
+
+def answers(rng, lengths=range(0, 13)):
+    # sequences and answers as given in the task: typos, swapped, left out
+    # and added characters, and unrelated answers
+    for length in lengths:
+        for alphabet in ['01', '0123', '0123456789']:
+            for _ in range(10):
+                sequence = ''.join(rng.choice(alphabet) for _ in range(length))
+                answer = list(sequence)
+                for _ in range(rng.randrange(4)):
+                    i = rng.randrange(len(answer) + 1)
+                    edit = rng.randrange(4)
+                    if edit == 0:
+                        answer.insert(i, rng.choice(alphabet))
+                    elif i < len(answer) and edit == 1:
+                        del answer[i]
+                    elif i < len(answer) and edit == 2:
+                        answer[i] = rng.choice(alphabet)
+                    elif i + 1 < len(answer):
+                        answer[i], answer[i + 1] = answer[i + 1], answer[i]
+                yield(''.join(answer), sequence)
+                yield(''.join(rng.choice(alphabet) for _ in range(rng.randrange(length + 3))),
+                      sequence)
+
+
+def test_matches_are_those_of_difflib():
+    for answer, sequence in answers(random.Random(1)):
+        scores = _alignment.evaluate(answer, sequence)
+        assert dict((k, scores[k]) for k in _alignment.METRICS[:5]) == \
+            previous_evaluate_trial(answer, sequence), (answer, sequence)
+        assert _alignment.matching_blocks(answer, sequence) == [tuple(m) for m in
+            difflib.SequenceMatcher(None, answer, sequence).get_matching_blocks()]
+
+
+def test_long_sequences_are_left_to_difflib():
+    rng = random.Random(2)
+    for answer, sequence in answers(rng, [199, 200, 260]):
+        assert _alignment.matching_blocks(answer, sequence) == [tuple(m) for m in
+            difflib.SequenceMatcher(None, answer, sequence).get_matching_blocks()]
+
+
+def test_distances_match_the_full_matrices():
+    for answer, sequence in answers(random.Random(3), list(range(0, 13)) + [70]):
+        distance, osa, common = distances(answer, sequence)
+        scores = _alignment.evaluate(answer, sequence)
+        assert (scores['edit_distance'], scores['transpositions'], scores['omissions'],
+                scores['intrusions']) == (distance, distance - osa, len(sequence) - common,
+                                          len(answer) - common), (answer, sequence)
+
+
+def test_evaluate_rows_reverses_answers():
+    rows = [{'user_input': '321', 'sequence': '123', 'reverse': 'True'},
+            {'user_input': '321', 'sequence': '123', 'reverse': '0'},
+            {'user_input': '', 'sequence': '123', 'reverse': '1'}]
+    scored = list(_alignment.evaluate_rows(rows))
+    assert [row['total_match'] for row in scored] == [3, 1, 0]
+    assert scored[1]['edit_distance'] == 2 and scored[2]['omissions'] == 3
+
+
+def test_only_the_metrics_asked_for_are_computed():
+    for answer, sequence in answers(random.Random(4), range(0, 9)):
+        scores = _alignment.evaluate(answer, sequence)
+        for metrics in [(), ('similarity',), ('omissions', 'longest_match'),
+                        ('transpositions',), _alignment.METRICS[5:]]:
+            assert _alignment.evaluate(answer, sequence, metrics) == \
+                dict((m, scores[m]) for m in metrics), (answer, sequence)
+    scored = _alignment.evaluate_batch([('12', '12'), ('1', '12')], ['intrusions'])
+    assert scored == [{'intrusions': 0}, {'intrusions': 0}]
@@ -0,0 +1,78 @@
+import random
+from collections import Counter
+
+import pytest
+
+pytest.importorskip('expyriment')
+
+from digitspan import DigitSpan
+
+
+def previous_check_key_validity(key):
+    # DigitSpan.check_key_validity before the counts were updated per
+    # character, for comparison
+    if sorted(Counter(key).values())[-1] > max(1, len(key) / 4) \
+            or sum([1 for i in range(1, len(key)) if key[i] == key[i-1]]) > len(key) / 7 \
+            or sum([1 for i in range(2, len(key)) if key[i] == key[i-2]]) > len(key) / 8 \
+            or sum([1 for i in range(3, len(key)) if key[i] == key[i-3]]) > len(key) / 9:
+        return(False)
+    if len(key) >= 2:
+        diffs = [ord(key[i]) - ord(key[i-1]) for i in range(1, len(key))]
+        if Counter(diffs)[0] > max(1, len(key) / 6) \
+                or sorted(Counter(diffs).values())[-1] > max(1, len(key) / 3) \
+                or sum([1 for i in range(1, len(diffs)) if diffs[i] == diffs[i-1]]) > max(1, len(key) / 16):
+            return(False)
+    return(True)
+
+
+@pytest.mark.parametrize('type', ['numeric', 'alphabetic', 'ALPHABETIC'])
+def test_generated_keys_are_valid(type):
+    rng = random.Random(type)
+    alphabet = set(DigitSpan.key_alphabet(type))
+    for length in range(1, 25):
+        for _ in range(20):
+            key = DigitSpan.generate_key(length, type, rng)
+            assert len(key) == length and set(key) <= alphabet
+            assert previous_check_key_validity(key), key
+
+
+def test_generated_keys_are_reproducible_and_varied():
+    keys = [DigitSpan.generate_key(6, 'numeric', random.Random(seed)) for seed in range(50)]
+    assert keys == [DigitSpan.generate_key(6, 'numeric', random.Random(seed)) for seed in range(50)]
+    assert len(set(keys)) > 45
+    # every digit is drawn at every position
+    assert all(len(set(key[i] for key in keys)) == 10 for i in range(6))
+
+
+
+def random_keys(rng):
+    # keys of few characters and neighbouring ones, which break the limits
+    # more often than keys of random digits
+    for length in range(1, 30):
+        for alphabet in ['ab', 'abc', '0123', '0123456789', 'acegikmoq']:
+            for _ in range(15):
+                yield(''.join(rng.choice(alphabet) for _ in range(length)))
+    for length in range(2, 30):
+        start = rng.randrange(97, 110)
+        step = rng.choice([1, 2, -1])
+        yield(''.join(chr(start + (i * step) % 12) for i in range(length)))
+
+
+def test_key_validity_matches_previous_implementation():
+    keys = list(random_keys(random.Random(2)))
+    valid = [DigitSpan.check_key_validity(key) for key in keys]
+    assert valid == [previous_check_key_validity(key) for key in keys]
+    assert 0.1 < sum(valid) / float(len(valid)) < 0.9
+
+
+def test_invalid_beginnings_cannot_become_valid():
+    # generate_key relies on a key that is invalid for its final length
+    # staying invalid as characters are added
+    rng = random.Random(3)
+    for key in random_keys(rng):
+        for end in range(1, len(key)):
+            if not DigitSpan.check_key_validity(key[:end], len(key)):
+                assert not previous_check_key_validity(key)
+                break
+        else:
+            assert DigitSpan.check_key_validity(key) == previous_check_key_validity(key)
@@ -40,12 +40,18 @@ SOFTWARE.
 # keywords for the android app expyriment.initialize()
 from expyriment import design, control, stimuli, io, misc
 from _base_expyriment import BaseExpyriment, _
-from random import choice, randint, random, shuffle
+import random
+from random import randint, Random
 try:
     import android
 except ImportError:
     android = None
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 DEFAULTS = {
     'change_nback_level': 'no',
     'increase_nback_correct_ratio': 0.8,
@@ -59,11 +65,37 @@ DEFAULTS = {
     'reaction_time_only': 'no'
 }
 
+SCHEMA = {
+    'DESIGN': {
+        'trials': ('int', 'per_block', 'required'),
+        'nback': ('int', 'per_block'),
+        'nback_mode': ('str', 'per_block'),
+        'repeat_probability': ('float', 'per_block'),
+        'max_lures': ('int', 'per_block'),
+        'num_boxes': ('int', 'per_block', 'required'),
+        'colours': ('colour', 'required'),
+        'display_duration': ('int', 'required'),
+        'break_duration': ('pair', 'required'),
+        'button_highlight_duration': ('int',),
+        'reaction_time_only': ('bool',),
+        'change_nback_level': ('bool',),
+        'increase_nback_correct_ratio': ('float',),
+        'decrease_nback_correct_ratio': ('float',)
+    },
+    'APPEARANCE': {
+        'canvas_size': ('float', 'per_block'),
+        'grid_line_width': ('unit',),
+        'antialiasing': ('bool',),
+        'colour_grid': ('colour',),
+        'colour_fixation_cross': ('colour',)
+    }
+}
+
 
 class NBack():
     @staticmethod
     def run():
-        exp = BaseExpyriment(DEFAULTS)
+        exp = BaseExpyriment(DEFAULTS, SCHEMA)
         nback = NBack(exp)
 
         nback.start()
@@ -73,7 +105,7 @@ class NBack():
         #    [showInstructions(exp, n) for n in SHOW_TUTORIAL]
 
         s = {}
-        for id in range(exp.config.getint('DESIGN', 'blocks')):
+        for id in range(exp.settings.design.blocks):
             block = nback.prepare_block(id, s)
             summary = nback.run_block(block)
             s = summary  # TODO if not block.get_factor('Practice') else s
@@ -88,13 +120,25 @@ class NBack():
         if not android:
             self.exp.mouse.show_cursor()
 
+        self.settings = self.exp.settings
+        self.canvas_pool = {}
+        if not self.settings.design.reaction_time_only:
+            for option in ['nback', 'nback_mode', 'repeat_probability']:
+                if getattr(self.settings.design, option) is None:
+                    raise ValueError('Configuration Option [DESIGN] -> {} not found.'.format(option))
+
         # OPTIONAL OPTIONS
-        self.line_width = self.exp._unit(self.exp.config.get('APPEARANCE', 'grid_line_width'))
+        self.line_width = self.exp._unit(self.settings.appearance.grid_line_width)
 
-        self.break_duration = self.exp.config.gettuple('DESIGN', 'break_duration')
-        self.display_duration = self.exp.config.getint('DESIGN', 'display_duration')
-        self.button_highlight_duration = self.exp.config.getint(
-            'DESIGN', 'button_highlight_duration')
+        self.break_duration = self.settings.design.break_duration
+        self.display_duration = self.settings.design.display_duration
+        self.button_highlight_duration = self.settings.design.button_highlight_duration
+        self.button_highlight_colour = self.settings.appearance.button_highlight_colour
+
+        # settings that no sequence satisfies, e.g. too few options for
+        # max_lures, fail here rather than when their block is reached
+        for settings in NBack.sequence_settings(self.settings.design):
+            NBack.generate_sequence(*settings, rng=Random(0))
 
     def start(self):
         self.exp._start()
@@ -111,17 +155,17 @@ class NBack():
             ('num_boxes', int)])
         block = self.exp._load_block_settings(block, [('canvas_size', float)],
                     section='APPEARANCE')
-        button_height = self.exp._unit(self.exp.config.get('APPEARANCE', 'button_height'))
+        button_height = self.exp._unit(self.settings.appearance.button_height)
         self.canvas_size = int(
             min(self.exp.screen.window_size[0],
                 self.exp.screen.window_size[1] -
                 button_height * 2) * block.get_factor('canvas_size'))
         self.num_boxes = block.get_factor('num_boxes')
-        if self.exp.config.getboolean('DESIGN', 'reaction_time_only'):
+        if self.settings.design.reaction_time_only:
             block.set_factor('reaction_time_only', 'true')
             block.set_factor('nback', 1)
             block.set_factor('nback_mode', 'P')
-            if self.exp.config.has_option('DESIGN', 'repeat_probability'):
+            if self.settings.design.repeat_probability is not None:
                 block = self.exp._load_block_settings(block, [('repeat_probability', float)])
             else:
                 block.set_factor('repeat_probability', 1)
@@ -129,33 +173,30 @@ class NBack():
             block = self.exp._load_block_settings(block, [('nback', int),
                     ('nback_mode', str), ('repeat_probability', float)])
 
-        self.grid = self.prepare_grid_stimulus()
-
-        self.trial_options = {
-            'P': list(range(self.num_boxes)),
-            'C': self.exp._colours(self.exp.config.get('DESIGN', 'colours'))
-        }
-        # allow for one colour only
-        if type(self.trial_options['C'][0]) is int:
-            self.trial_options['C'] = [self.trial_options['C']]
+        self.trial_options = NBack.make_trial_options(self.num_boxes, self.settings.design.colours)
 
         self.modes = {'P': 'mode_position',
                       'C': 'mode_colour'}
 
-        if not block.get_factor('reaction_time_only'):
+        if not block.factor_dict.get('reaction_time_only'):
             mode_text = (_('mode_connector') + ' ').join(
                 ', '.join([_(self.modes[M]) for M in
                            block.get_factor('nback_mode')]
                           ).rsplit(', ', 1))
             block.set_factor('mode_text', mode_text)
 
-        if prev_block and self.exp.config.getboolean('DESIGN', 'change_nback_level'):
+        if prev_block and self.settings.design.change_nback_level:
             block.set_factor('nback', max(1,
                                           prev_block['nback'] +
-                                          prev_block['correct_ratio'] >= self.exp.config.getfloat('DESIGN', 'increase_nback_correct_ratio') -
-                                          prev_block['correct_ratio'] < self.exp.config.getfloat('DESIGN', 'decrease_nback_correct_ratio')))
-
-        for i, trial_item in enumerate(NBack.compute_trial_items(block, self.trial_options)):
+                                          prev_block['correct_ratio'] >= self.settings.design.increase_nback_correct_ratio -
+                                          prev_block['correct_ratio'] < self.settings.design.decrease_nback_correct_ratio))
+
+        # one stimulus per position and colour, shared by all trials showing it
+        self.atlas = {}
+        max_lures = self.settings.design.max_lures[block.id - 1] \
+            if self.settings.design.max_lures is not None else None
+        for i, trial_item in enumerate(NBack.compute_trial_items(
+                block, self.trial_options, max_lures, sequences=self.exp.sequences)):
             block.add_trial(self.prepare_trial(block, trial_item, i+1))
 
         self.exp.add_block(block)
@@ -175,18 +216,21 @@ class NBack():
             else:
                 trial.set_factor(k, item[k])
 
-        s = stimuli.Rectangle([sz, sz], position=[(item['P'] % bx + 0.5) *
-                                                  sz - ctr, (item['P'] // bx + 0.5) * sz - ctr], colour=item['C'])
-        trial.add_stimulus(s)
+        cell = (item['P'], tuple(item['C']))
+        if cell not in self.atlas:
+            self.atlas[cell] = stimuli.Rectangle([sz, sz], position=[(item['P'] % bx + 0.5) *
+                                                                     sz - ctr, (item['P'] // bx + 0.5) * sz - ctr], colour=item['C'])
+            self.exp.prefetcher.add(self.atlas[cell], group=('cells', block.id))
+        trial.add_stimulus(self.atlas[cell])
 
         return(trial)
 
     def run_block(self, block):
-        if block.get_factor('reaction_time_only'):
+        if block.factor_dict.get('reaction_time_only'):
             labels = ['']
         else:
             labels = [_(self.modes[M]) for M in block.get_factor('nback_mode')]
-        self.buttons = self.exp.prepare_button_boxes(labels)
+        self.buttons, self.base_canvas = self.prepare_base_canvas(labels)
         self.canvas = self.new_canvas()
         next_canvas = self.new_canvas()
         self.exp._show_message('block_start_title', 'block_start',
@@ -194,11 +238,17 @@ class NBack():
             block=block)
 
         wait = randint(self.break_duration[0], self.break_duration[1])
-        self.exp.clock.wait(wait - self.canvas.present() -
-                            block.trials[0].stimuli[0].plot(next_canvas) - next_canvas.preload())
+        self.exp.prefetcher.add(next_canvas)
+        self.exp._idle_wait(wait - self.canvas.present() -
+                            block.trials[0].stimuli[0].plot(next_canvas))
         for i, trial in enumerate(block.trials):
             next_canvas, wait = self.run_trial(block, trial, i, next_canvas, wait)
+            # logs are written in between trials, when no response is
+            # timed; the time it takes is part of the next break
+            wait += self.exp._flush_logs()
 
+        # cells of this block that were not preloaded are not needed anymore
+        self.exp.prefetcher.expire(('cells', block.id))
         smry = self.exp._log_block(block)
 
         def filterNone(l): return [i for i in l if i is not None]
@@ -212,8 +262,13 @@ class NBack():
         return(smry)
 
     def run_trial(self, block, trial, id, next_canvas, wait):
+        self.exp.prefetcher.expire(next_canvas)
         next_canvas.present()
         self.exp.clock.reset_stopwatch()
+        repeat = trial.get_factor('repeat')
+        self.exp.input_source.expect(buttons=self.buttons, correct=[
+            btn for btn in self.buttons if repeat and (block.factor_dict.get('reaction_time_only') or
+                                                       btn.label == _(self.modes[repeat]))])
         evts = []
         highlight = False
         show = True
@@ -229,12 +284,13 @@ class NBack():
                     self.canvas.present()
                     block.trials[id +
                                  1].stimuli[0].plot(next_canvas) if len(block.trials) > id + 1 else []
-                    next_canvas.preload()
+                    self.exp.prefetcher.add(next_canvas)
                     wait = randint(self.break_duration[0], self.break_duration[1])
+                    self.exp.prefetcher.run(wait + self.display_duration - self.exp.clock.stopwatch_time)
                     loaded_next_trial = True
                 t = min(wait + self.display_duration - self.exp.clock.stopwatch_time, wait +
                         self.display_duration if not highlight else self.button_highlight_duration)
-            evt = self.exp.mouse.wait_press(duration=t)
+            evt = self.exp.input_source.wait_press(duration=t)
             if not evt[2] and not highlight:
                 if show:
                     show = False
@@ -254,11 +310,10 @@ class NBack():
                     [s - 2*self.line_width for s in overlap[0].size],
                     position=overlap[0].position,
                     line_width=self.line_width * 2,
-                    colour=self.exp._colours(
-                        self.exp.config.get('APPEARANCE', 'button_highlight_colour'))
+                    colour=self.button_highlight_colour
                 ).present(clear=None)
                 highlight = True
-        if block.get_factor('reaction_time_only'):
+        if block.factor_dict.get('reaction_time_only'):
             repeat = True if trial.get_factor('repeat') else False
         else:
             repeat = _(self.modes[trial.get_factor('repeat')]
@@ -275,88 +330,272 @@ class NBack():
             else:
                 rt = times[idx]
                 click = pressed[idx]
-        if block.get_factor('reaction_time_only'):
+        if block.factor_dict.get('reaction_time_only'):
             click = type(click) == str
         results = {
             'wait': oldwait,
             'rt': rt,
-            'pressed_any': bool(click) + 0,
-            'correct': bool(click == repeat) + 0,
-            'correct_repeat': bool(click == repeat and repeat) + 0,
-            'incorrect': bool(click != repeat) + 0,
-            'missedpositive': bool((not click) and repeat) + 0,
-            'falsepositive': bool(click and (not repeat)) + 0,
-            'falsebutton': bool(click and repeat and not click == repeat) + 0,
             'corrected': idx is not False and ('|'.join([str(x) for x in times[0:idx]]) if idx > 0 else False),
             'not_last_press': idx is not False and ('|'.join([str(x) for x in times[(idx+1):]]) if len(evts) > idx + 1 else False),
             'repeat': repeat,
             'pressed': click
         }
+        results.update(NBack.score_trial(repeat, click))
         self.exp._log_trial(block, trial, results)
         return(next_canvas, wait)
 
+    def prepare_base_canvas(self, labels):
+        # the grid and the buttons are composed once for all blocks with the
+        # same grid and buttons; every trial starts from a copy of that
+        key = (self.canvas_size, self.num_boxes, tuple(labels))
+        if key not in self.canvas_pool:
+            buttons = self.exp.prepare_button_boxes(labels)
+            cvs = stimuli.BlankScreen()
+            self.prepare_grid_stimulus().plot(cvs)
+            [btn.plot(cvs) for btn in buttons]
+            self.canvas_pool[key] = (buttons, cvs)
+        return(self.canvas_pool[key])
+
     def new_canvas(self):
-        cvs = stimuli.BlankScreen()
-        self.grid.plot(cvs)
-        [btn.plot(cvs) for btn in self.buttons]
-        return(cvs)
+        return(self.base_canvas.copy())
 
     @staticmethod
-    def compute_trial_items(block, trial_options):
+    def score_trial(repeat, click):
+        # repeat and click are the label of the repeated mode and of the
+        # button pressed, or whether there was a stimulus and a press when
+        # only reaction times are measured; see tools/rescore.py
+        return({
+            'pressed_any': bool(click) + 0,
+            'correct': bool(click == repeat) + 0,
+            'correct_repeat': bool(click == repeat and repeat) + 0,
+            'incorrect': bool(click != repeat) + 0,
+            'missedpositive': bool((not click) and repeat) + 0,
+            'falsepositive': bool(click and (not repeat)) + 0,
+            'falsebutton': bool(click and repeat and not click == repeat) + 0
+        })
+
+    @staticmethod
+    def make_trial_options(num_boxes, colours):
+        # allow for one colour only
+        return({
+            'P': list(range(num_boxes)),
+            'C': [colours] if type(colours[0]) is int else list(colours)
+        })
+
+    @staticmethod
+    def compute_trial_items(block, trial_options, max_lures=None, rng=None, sequences=None):
         num_trials = int(block.get_factor('trials'))
         mode = block.get_factor('nback_mode')
         probability = float(block.get_factor('repeat_probability'))
         nback = int(block.get_factor('nback'))
-
-        log = {}
-        for m in mode:
-            log[m] = []
-
-        # make repeats
-        num_repeat = int(num_trials * probability)
-        each_repeat = int(num_repeat / len(mode))
-        spare_repeat = num_repeat - each_repeat * len(mode)
-        repeats = [''] * (num_trials - num_repeat)
-        [repeats.extend([m] * each_repeat) for m in mode]
-        [repeats.append(choice(mode)) for i in range(spare_repeat)]
-        shuffle(repeats)
-
-        for repeat in repeats:
+        # any trial is a target when only reaction times are measured
+        if block.factor_dict.get('reaction_time_only'):
+            nback = 0
+
+        num_options = dict((m, len(trial_options[m])) for m in mode)
+        sequence = sequences.next(*NBack.sequence_key(
+            num_trials, mode, probability, nback, num_options, max_lures)) if sequences else None
+        if sequence:
+            repeats, items = sequence['repeats'], sequence['items']
+        else:
+            repeats, items = NBack.generate_sequence(
+                num_trials, mode, probability, nback, num_options, max_lures, rng)
+        for i, repeat in enumerate(repeats):
             next = {}
             for m in trial_options:
-                if m not in mode:
+                if m in mode:
+                    next[m] = trial_options[m][items[m][i]]
+                else:
                     next[m] = trial_options[m][int(len(trial_options[m])/2)]
             next['repeat'] = repeat
-            #findnback = lambda l, n: ([l[-n]] if len(l) >= n else []) if MATCH_EXACTLY else l[-n:]
-
-            def findnback(l, n): return ([l[-n]] if len(l) >= n else [])
-            if repeat:
-                choose = findnback(log[repeat], nback)
-                next[repeat] = choice(choose) if len(choose) > 0 else choice(trial_options[repeat])
-                for m in mode:
-                    avoid = findnback(log[m], nback)
-                    next[m] = choice([x for x in trial_options[m] if x not in avoid]
-                                     ) if not m in next else next[m]
-                    log[m].append(next[m])
-            else:
-                for m in mode:
-                    # take last nback items
-                    avoid = findnback(log[m], nback)
-                    # select next item that is not on avoid list
-                    next[m] = choice([x for x in trial_options[m] if x not in avoid])
-                    log[m].append(next[m])
             yield next
 
+    @staticmethod
+    def sequence_settings(design):
+        # the sequence settings of every block, for every n-back level the
+        # block may have with change_nback_level; see tools/precompile.py
+        for b in range(design.blocks):
+            trial_options = NBack.make_trial_options(design.num_boxes[b], design.colours)
+            if design.reaction_time_only:
+                # any trial is a target, see compute_trial_items
+                mode, levels = 'P', [0]
+                probability = design.repeat_probability[b] if design.repeat_probability else 1
+            else:
+                mode, levels = design.nback_mode[b], [design.nback[b]]
+                probability = design.repeat_probability[b]
+                if design.change_nback_level:
+                    levels = range(1, max(design.nback) + b + 1)
+            num_options = dict((m, len(trial_options[m])) for m in mode)
+            max_lures = design.max_lures[b] if design.max_lures is not None else None
+            for nback in levels:
+                yield((design.trials[b], mode, float(probability), nback, num_options, max_lures))
+
+    @staticmethod
+    def sequence_key(num_trials, modes, probability, nback, num_options, max_lures=None):
+        # settings of a sequence in the sequence bank
+        return('nback', num_trials, modes, probability, nback,
+               [num_options[m] for m in modes], max_lures)
+
+    @staticmethod
+    def generate_sequence(num_trials, modes, probability, nback, num_options,
+                          max_lures=None, rng=None, attempts=20):
+        # returns the repeated mode per trial ('' for none) and, per mode, the
+        # index of the option shown in each trial. the number of repeats is
+        # exact and balanced between modes; trials that are not a repeat
+        # never match the trial n back, and lures (matching n-1 or n+1 trials
+        # back) are avoided where possible and at most max_lures per mode.
+        # with nback 0, trials are not related to each other at all
+        rng = rng or random
+        for _ in range(attempts):
+            repeats = NBack.place_repeats(num_trials, modes, probability, nback, rng)
+            items = {}
+            for m in modes:
+                items[m] = NBack.fill_mode(repeats, m, nback, num_options[m], rng, max_lures)
+                if items[m] is None:
+                    break
+            else:
+                if NBack.verify_sequence(repeats, items, nback, max_lures):
+                    return(repeats, items)
+        raise ValueError('Could not generate {} trials for {}-back of {} with at most {} lures per '
+                         'mode; more options, repeats or lures are needed.'.format(
+                             num_trials, nback, ', '.join('{} {}'.format(num_options[m], m) for m in modes),
+                             max_lures))
+
+    @staticmethod
+    def place_repeats(num_trials, modes, probability, nback, rng):
+        # repeats can only follow the first n trials
+        positions = list(range(max(nback, 0), num_trials))
+        num_repeat = min(int(num_trials * probability), len(positions))
+        each_repeat = num_repeat // len(modes)
+        labels = [m for m in modes for i in range(each_repeat)] + \
+            rng.sample(list(modes), num_repeat - each_repeat * len(modes))
+        rng.shuffle(labels)
+        repeats = [''] * num_trials
+        for i, m in zip(rng.sample(positions, num_repeat), labels):
+            repeats[i] = m
+        return(repeats)
+
+    @staticmethod
+    def fill_mode(repeats, mode, nback, num_options, rng, max_lures=None):
+        # the options of one mode, or None if no sequence has the repeats
+        # with at most max_lures lures. whether an option is allowed or a
+        # lure only depends on which of the last n+1 trials showed the same
+        # option, so the fewest lures needed until the end are computed for
+        # each such pattern first, and every trial then takes a random
+        # option that still allows to stay within max_lures
+        if nback < 1:
+            return([int(rng.random() * num_options) for _ in repeats])
+        if num_options < 2:
+            raise ValueError('{}-back needs at least two options to choose from.'.format(nback))
+        targets = [repeat == mode for repeat in repeats]
+        start = (None,) * (nback + 1)
+        patterns = [set([start])]
+        for target in targets:
+            patterns.append(set(step[0] for pattern in patterns[-1]
+                                for step in NBack.pattern_steps(pattern, target, nback, num_options)))
+        needed = [{} for _ in targets] + [dict((pattern, 0) for pattern in patterns[-1])]
+        for i in range(len(targets) - 1, -1, -1):
+            for pattern in patterns[i]:
+                lures = [lure + needed[i + 1][following] for following, lure in
+                         NBack.pattern_steps(pattern, targets[i], nback, num_options)
+                         if following in needed[i + 1]]
+                if lures:
+                    needed[i][pattern] = min(lures)
+        budget = float('inf') if max_lures is None else max_lures
+        if needed[0].get(start, budget + 1) > budget:
+            return(None)
+
+        sequence, window, lures = [], start, 0
+        for i, target in enumerate(targets):
+            pattern = NBack.pattern(window)
+            labels = dict((x, label) for x, label in zip(window, pattern) if x is not None)
+            # options that are no lure, and those that are
+            fitting = ([], [])
+            for x in range(num_options):
+                step = NBack.pattern_step(pattern, labels.get(x, -1), target, nback)
+                if step and step[0] in needed[i + 1] and \
+                        lures + step[1] + needed[i + 1][step[0]] <= budget:
+                    fitting[step[1]].append((x, step[1]))
+            options = fitting[0] or fitting[1]
+            x, lure = options[int(rng.random() * len(options))]
+            sequence.append(x)
+            lures += lure
+            window = (x,) + window[:-1]
+        return(sequence)
+
+    @staticmethod
+    def pattern(window):
+        # the last n+1 options, most recent first, numbered by first occurrence
+        labels = {}
+        return(tuple(None if x is None else labels.setdefault(x, len(labels)) for x in window))
+
+    @staticmethod
+    def pattern_step(pattern, label, target, nback):
+        # the pattern after an option with the label (-1 for one that is
+        # not in the pattern), and whether it is a lure; None if not allowed
+        back = pattern[nback - 1]
+        if target and back is not None:
+            if label != back:
+                return(None)
+            lure = False
+        else:
+            if label == back:
+                return(None)
+            lure = nback > 1 and label == pattern[nback - 2] or label == pattern[nback]
+        return(NBack.pattern((label,) + pattern[:-1]), int(lure))
+
+    @staticmethod
+    def pattern_steps(pattern, target, nback, num_options):
+        labels = sorted(set(label for label in pattern if label is not None))
+        for label in labels + ([-1] if len(labels) < num_options else []):
+            step = NBack.pattern_step(pattern, label, target, nback)
+            if step:
+                yield(step)
+
+    @staticmethod
+    def verify_sequence(repeats, items, nback, max_lures=None):
+        # every mode needs to match the trial n back exactly where it is
+        # repeated, and may have at most max_lures lures
+        if nback < 1:
+            return(True)
+        for m, sequence in items.items():
+            if numpy is not None:
+                values = numpy.asarray(sequence)
+                targets = numpy.asarray([r == m for r in repeats], dtype=bool)
+                matches = numpy.zeros(len(values), dtype=bool)
+                matches[nback:] = values[nback:] == values[:max(len(values) - nback, 0)]
+                if not numpy.array_equal(matches, targets):
+                    return(False)
+                if max_lures is None:
+                    continue
+                lures = numpy.zeros(len(values), dtype=bool)
+                if nback > 1:
+                    lures[nback - 1:] = values[nback - 1:] == values[:max(len(values) - nback + 1, 0)]
+                lures[nback + 1:] |= values[nback + 1:] == values[:max(len(values) - nback - 1, 0)]
+                if int((lures & ~targets).sum()) > max_lures:
+                    return(False)
+            else:
+                lures = 0
+                for i, x in enumerate(sequence):
+                    target = repeats[i] == m
+                    if (i >= nback and x == sequence[i - nback]) != target:
+                        return(False)
+                    if not target and (nback > 1 and i >= nback - 1 and x == sequence[i - nback + 1] or
+                                       i >= nback + 1 and x == sequence[i - nback - 1]):
+                        lures += 1
+                if max_lures is not None and lures > max_lures:
+                    return(False)
+        return(True)
+
     def prepare_grid_stimulus(self):
         side = self.num_boxes**(0.5)
         block_size = self.canvas_size / side
         center = self.canvas_size / 2
         grid = stimuli.BlankScreen()
 
-        colour_grid = self.exp._colours(self.exp.config.get('APPEARANCE', 'colour_grid'))
-        colour_fixation_cross = self.exp._colours(
-            self.exp.config.get('APPEARANCE', 'colour_fixation_cross'))
-        antialiasing = 10 if self.exp.config.getboolean('APPEARANCE', 'antialiasing') else None
+        colour_grid = self.settings.appearance.colour_grid
+        colour_fixation_cross = self.settings.appearance.colour_fixation_cross
+        antialiasing = 10 if self.settings.appearance.antialiasing else None
 
         if colour_grid:
             for a, b in [(i % side, i // side) for i in range(self.num_boxes)]:
@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import random
+import subprocess
+
+import pytest
+
+pytest.importorskip('expyriment')
+
+import nback
+from nback import NBack
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOOLS = os.path.join(HERE, '..', '..', 'tools')
+
+# runs one simulated block with the default settings, in which the logs
+# are due to be written after every trial, and prints when files were opened for writing, the stopwatch
+# was reset, and responses were waited for
+TRACE_SESSION = '''
+import sys, json
+sys.path.insert(0, {tools!r})
+import simulate
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+
+simulate.init_worker({directory!r}, 'nback', {config!r},
+                     {{'DESIGN': {{'blocks': '1', 'trials': '12'}}}})
+events = []
+_open = builtins.open
+
+
+def traced_open(name, mode='r', *args, **kwargs):
+    if any(m in mode for m in 'wa+'):
+        events.append('write')
+    return(_open(name, mode, *args, **kwargs))
+
+
+def traced(name, method):
+    def call(*args, **kwargs):
+        events.append(name)
+        return(method(*args, **kwargs))
+    return(call)
+
+
+builtins.open = traced_open
+simulate.base.SimulatedClock.reset_stopwatch = traced(
+    'reset_stopwatch', simulate.base.SimulatedClock.reset_stopwatch)
+simulate.base.SimulatedParticipant.wait_press = traced(
+    'wait_press', simulate.base.SimulatedParticipant.wait_press)
+simulate.run_session(('nback', 1, 1, {output!r}))
+sys.stdout.write('\\nEVENTS ' + json.dumps(events) + '\\n')
+'''
+
+
+def test_no_file_is_written_while_responses_are_timed(tmpdir):
+    script = TRACE_SESSION.format(tools=TOOLS, directory=HERE, output=str(tmpdir),
+                                  config=os.path.join(HERE, 'config.conf'))
+    process = subprocess.Popen([sys.executable, '-c', script],
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log = process.communicate()[0].decode('utf-8', 'replace')
+    assert process.returncode == 0, log
+    events = json.loads(log.split('EVENTS ', 1)[1])
+
+    starts = [i for i, event in enumerate(events) if event == 'reset_stopwatch']
+    assert len(starts) == 12
+    for start, end in zip(starts, starts[1:] + [len(events)]):
+        trial = events[start:end]
+        last_response = max(i for i, event in enumerate(trial) if event == 'wait_press')
+        assert 'write' not in trial[:last_response]
+    # the logs were written in between the trials nonetheless
+    assert all('write' in events[start:end] for start, end in zip(starts, starts[1:]))
+
+
+def count_lures(repeats, items, nback):
+    # lures per mode, counted independently of NBack.verify_sequence
+    return(dict((m, sum(1 for i, x in enumerate(sequence) if repeats[i] != m and any(
+        0 <= i - back and x == sequence[i - back] for back in set([nback - 1, nback + 1]) - set([0]))))
+        for m, sequence in items.items()))
+
+
+def candidate_sequences(rng):
+    # generated sequences, the same with one trial changed, and random ones
+    for nback_level in [1, 2, 3]:
+        for num_options in [2, 3, 9]:
+            options = {'P': 9, 'C': num_options}
+            repeats, items = NBack.generate_sequence(30, 'PC', 0.3, nback_level, options, rng=rng)
+            yield(repeats, items, nback_level)
+            changed = dict((m, list(sequence)) for m, sequence in items.items())
+            i = rng.randrange(30)
+            changed['C'][i] = (changed['C'][i] + 1) % num_options
+            yield(repeats, changed, nback_level)
+            yield(repeats, dict((m, [rng.randrange(options[m]) for _ in range(30)])
+                                for m in 'PC'), nback_level)
+    yield([''] * 3, {'P': [1, 1, 1]}, 5)
+
+
+def test_verify_sequence_without_numpy_agrees(monkeypatch):
+    pytest.importorskip('numpy')
+    rng = random.Random(1)
+    for repeats, items, nback_level in candidate_sequences(rng):
+        for max_lures in [None, 0, 2, 5]:
+            verified = NBack.verify_sequence(repeats, items, nback_level, max_lures)
+            with monkeypatch.context() as patch:
+                patch.setattr(nback, 'numpy', None)
+                assert NBack.verify_sequence(repeats, items, nback_level, max_lures) == verified
+
+
+@pytest.mark.parametrize('settings', [
+    (20, 'PC', 0.3, 2, {'P': 9, 'C': 3}, 6),
+    (20, 'C', 0.3, 2, {'C': 4}, 0),
+    (40, 'PC', 0.25, 3, {'P': 9, 'C': 3}, 4),
+    (60, 'P', 0.3, 1, {'P': 3}, 0),
+    (100, 'PC', 0.3, 2, {'P': 9, 'C': 9}, 0),
+    (12, 'P', 1, 0, {'P': 9}, None)])
+def test_generated_sequences_meet_the_settings(settings):
+    num_trials, modes, probability, nback_level, num_options, max_lures = settings
+    for seed in range(5):
+        repeats, items = NBack.generate_sequence(*settings, rng=random.Random(seed))
+        assert len(repeats) == num_trials
+        assert sum(1 for r in repeats if r) == int(num_trials * probability)
+        counts = [repeats.count(m) for m in modes]
+        assert max(counts) - min(counts) <= 1
+        for m in modes:
+            assert len(items[m]) == num_trials
+            assert all(0 <= x < num_options[m] for x in items[m])
+            if nback_level:
+                assert all((i >= nback_level and x == items[m][i - nback_level]) == (repeats[i] == m)
+                           for i, x in enumerate(items[m]))
+        if max_lures is not None:
+            assert max(count_lures(repeats, items, nback_level).values()) <= max_lures
+
+
+def test_generated_sequences_are_reproducible():
+    settings = (40, 'PC', 0.3, 2, {'P': 9, 'C': 3}, 12)
+    assert NBack.generate_sequence(*settings, rng=random.Random(7)) == \
+        NBack.generate_sequence(*settings, rng=random.Random(7))
+
+
+@pytest.mark.parametrize('settings', [
+    # no run of more than three trials without a colour repeat can avoid
+    # matching the colour one, two or three trials back with three colours
+    (20, 'PC', 0.3, 2, {'P': 9, 'C': 3}, 0),
+    (20, 'P', 0.3, 1, {'P': 2}, 0),
+    (40, 'C', 0.3, 3, {'C': 3}, 0),
+    (20, 'P', 0.3, 2, {'P': 1}, None)])
+def test_impossible_settings_are_reported(settings):
+    with pytest.raises(ValueError):
+        NBack.generate_sequence(*settings, rng=random.Random(0))
+
+
+# runs one simulated block and prints whether every new trial canvas showed
+# the grid and buttons of its base canvas, and whether the base canvases
+# were left as they were
+CANVAS_SESSION = '''
+import sys
+sys.path.insert(0, {tools!r})
+import simulate
+simulate.init_worker({directory!r}, 'nback', {config!r}, {{'DESIGN': {{'blocks': '1', 'trials': '6'}}}})
+NBack = simulate.module.NBack
+canvases = []
+_new_canvas = NBack.new_canvas
+
+
+def pixels(canvas):
+    return(canvas._get_surface().get_buffer().raw)
+
+
+def new_canvas(self):
+    canvas = _new_canvas(self)
+    blank = pixels(simulate.base.stimuli.BlankScreen())
+    canvases.append((pixels(canvas) == pixels(self.base_canvas), self.base_canvas,
+                     pixels(self.base_canvas), blank))
+    return(canvas)
+
+
+NBack.new_canvas = new_canvas
+simulate.run_session(('nback', 1, 1, {output!r}))
+sys.stdout.write('\\nCANVASES {{}} {{}} {{}} {{}}\\n'.format(
+    len(canvases), all(same for same, _, _, _ in canvases),
+    all(pixels(base) == before for _, base, before, _ in canvases),
+    all(before != blank for _, _, before, blank in canvases)))
+'''
+
+
+def test_trial_canvases_start_from_the_grid(tmpdir):
+    script = CANVAS_SESSION.format(tools=TOOLS, directory=HERE, output=str(tmpdir),
+                                   config=os.path.join(HERE, 'config.conf'))
+    process = subprocess.Popen([sys.executable, '-c', script],
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log = process.communicate()[0].decode('utf-8', 'replace')
+    assert process.returncode == 0, log
+    assert log.split('CANVASES ', 1)[1].split() == ['8', 'True', 'True', 'True']
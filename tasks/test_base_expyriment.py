@@ -0,0 +1,349 @@
+import os
+import gzip
+import json
+import random
+import threading
+from ast import literal_eval
+
+import pytest
+
+pytest.importorskip('expyriment')
+
+import _base_expyriment
+from _base_expyriment import (ColumnarLog, LogFile, LogWriter, Prefetcher, RowBuffer,
+                              SequenceBank, SummaryColumns, TrialData, columnar_to_csv,
+                              detach_log_buffer, log_values_to_cols, mean, median, read_columns,
+                              sd, var)
+
+
+def previous_log_values_to_cols(column_names, data):
+    # log_values_to_cols before the columns were compiled, for comparison
+    cols = []
+    for col in column_names:
+        func = None
+        filter = None
+        if '(' in col and ')' == col[-1]:
+            func, col = col[:-1].split('(')
+        if '[' in col and ']' == col[-1]:
+            col, filter = col[:-1].split('[')
+        value = data.get(col, 'NA')
+        if filter and type(value) == list:
+            if '==' in filter:
+                filter_field, filter_value = filter.split('==')
+                filter_value = literal_eval(filter_value)
+                value = [value[i] for i in range(len(value)) if str(
+                    data[filter_field][i]) == str(filter_value)]
+            elif '!=' in filter:
+                filter_field, filter_value = filter.split('!=')
+                filter_value = literal_eval(filter_value)
+                value = [value[i] for i in range(len(value)) if str(
+                    data[filter_field][i]) != str(filter_value)]
+            else:
+                value = [value[i] for i in range(len(value)) if data[filter][i]]
+        if func:
+            value = [v for v in value if v]
+            value = {'avg': mean, 'mean': mean, 'sd': sd, 'median': median, 'var': var,
+                     'max': max, 'min': min, 'sum': sum, 'len': len}[func](value)
+        cols.append(value)
+    return(cols)
+
+
+BLOCK = {
+    'block': 2,
+    'rt': [512, None, 431.5, 388, 0, 602, 455],
+    'correct': [True, False, True, True, False, True, True],
+    'correct_repeat': [1, 0, 1, 0, 0, 1, 1],
+    'sequence_length': [3, 4, 4, 5, 5, 6, 5],
+    'user_input': ['123', '', '4321', '12345', '1234', '654321', '12345'],
+    'difference': [-3, 2, -1.5, 0, 4, -2, 1]
+}
+
+COLUMNS = ['block', 'missing', 'mean(rt)', 'avg(rt)', 'sd(rt)', 'var(rt)', 'median(rt)',
+           'max(rt)', 'min(rt)', 'sum(rt)', 'len(rt)', 'len(correct)', 'mean(correct)',
+           'median(correct)', 'mean(rt[correct_repeat==1])', 'sd(rt[correct_repeat==1])',
+           'mean(rt[correct!=True])', 'len(sequence_length[correct])',
+           'len(sequence_length[correct==True])', 'max(sequence_length)']
+
+
+def test_summary_columns_match_previous_implementation():
+    assert log_values_to_cols(COLUMNS, BLOCK) == previous_log_values_to_cols(COLUMNS, BLOCK)
+
+
+def test_summary_columns_filter_comparisons():
+    assert log_values_to_cols(['len(rt[sequence_length>4])', 'max(rt[sequence_length<=4])',
+                               'mean(sequence_length[rt>=455])'], BLOCK) == [3, 512, 14 / 3.0]
+
+
+def test_nested_functions():
+    values = log_values_to_cols(['mean(len(user_input))', 'max(abs(difference))',
+                                 'abs(mean(difference))', 'abs(min(difference))'], BLOCK)
+    assert values == [4.5, 4, abs(mean([-3, 2, -1.5, 4, -2, 1])), 3]
+    # the mean of no values is missing, and so is its absolute value
+    assert log_values_to_cols(['abs(mean(rt[block==3]))'], dict(BLOCK, block=[2] * 7)) == [None]
+
+
+@pytest.mark.parametrize('spec', ['mean(sum(rt))', 'len(mean(rt))', 'abs(median(max(rt)))',
+                                  'sd(mean(len(user_input)))'])
+def test_unsupported_nesting_is_rejected(spec):
+    with pytest.raises(ValueError) as error:
+        SummaryColumns([spec])
+    assert spec in str(error.value)
+
+
+@pytest.mark.parametrize('spec', ['mean(rt[correct==1]', 'mean(rt))', 'mean((rt)', 'rt]',
+                                  'len(correct[correct==True]]'])
+def test_unbalanced_brackets_are_rejected(spec):
+    with pytest.raises(ValueError) as error:
+        SummaryColumns([spec])
+    assert spec in str(error.value)
+
+
+def test_unknown_function_is_rejected():
+    with pytest.raises(ValueError):
+        SummaryColumns(['mode(rt)'])
+
+
+def random_values(kind, rng, count):
+    # including values that are left out of the summaries, e.g. None and 0
+    draw = {'int': lambda: rng.choice([None, 0, rng.randint(-5, 900)]),
+            'float': lambda: rng.choice([None, 0.0, rng.uniform(-5, 900)]),
+            'bool': lambda: rng.choice([True, True, False, None])}[kind]
+    return([draw() for _ in range(count)])
+
+
+@pytest.mark.parametrize('kind', ['int', 'float', 'bool'])
+@pytest.mark.parametrize('count', [1, 2, 3, 8, 15, 40])
+def test_streamed_summaries_match_previous_implementation(kind, count):
+    rng = random.Random(count)
+    columns = ['mean(x)', 'avg(x)', 'sum(x)', 'len(x)', 'max(x)', 'min(x)', 'median(x)',
+               'median(x[keep])', 'sd(x)', 'var(x)']
+    data = TrialData(columns)
+    for x, keep in zip(random_values(kind, rng, count), random_values('bool', rng, count)):
+        data.append({'block': 1, 'x': x, 'keep': keep})
+    for column in columns:
+        try:
+            previous = previous_log_values_to_cols([column], data.block)[0]
+        except ValueError:
+            # max and min of no values
+            with pytest.raises(ValueError):
+                SummaryColumns([column]).evaluate(data.block, data.block_summary)
+            continue
+        value = SummaryColumns([column]).evaluate(data.block, data.block_summary)[0]
+        if column in ('sd(x)', 'var(x)') and previous is not None:
+            # the moments are accumulated rather than computed in two passes
+            assert value == pytest.approx(previous, rel=1e-9, abs=1e-9), column
+        else:
+            assert (value, type(value)) == (previous, type(previous)), column
+
+
+class ListLog():
+    def __init__(self):
+        self.rows = []
+
+    def add(self, row):
+        self.rows.append(row)
+
+
+def test_row_buffer_commits_rows_in_order():
+    first, second = ListLog(), ListLog()
+    buffer = RowBuffer(2)
+    changed = [1, 2]
+    for i in range(5):
+        buffer.add(first if i % 2 else second, [i, changed])
+    changed.append(3)
+    assert first.rows == [] and buffer.count == 5
+    buffer.commit()
+    assert first.rows == [[1, [1, 2]], [3, [1, 2]]]
+    assert second.rows == [[0, [1, 2]], [2, [1, 2]], [4, [1, 2]]]
+    # the slots are reused after a commit
+    buffer.add(first, [5])
+    buffer.commit()
+    assert buffer.count == 0 and first.rows[-1] == [5]
+
+
+def test_log_file_is_saved_after_its_queued_rows(tmpdir):
+    writer = LogWriter()
+    log = LogFile(filename='order.csv', col_names=['row'], directory=str(tmpdir), writer=writer)
+    log.save()
+    # the writer is busy while one row is queued and the next one buffered,
+    # as when the program exits before the writer is closed
+    busy = threading.Event()
+    writer.put(busy.wait)
+    log.add([1])
+    writer.put(detach_log_buffer(log))
+    log.add([2])
+    threading.Timer(0.2, busy.set).start()
+    log.save()
+    writer.close()
+    with open(log._fullpath) as f:
+        assert f.read().split() == ['row', '1', '2']
+
+
+def test_log_writer_writes_right_away_once_closed():
+    writer = LogWriter()
+    writer.close()
+    written = []
+    writer.put(lambda: written.append(1))
+    assert written == [1]
+
+
+def drawn(filename, subject):
+    return(SequenceBank.load(filename, subject).sequences()[SequenceBank.key('task', 1)])
+
+
+def test_sequence_bank_groups_have_their_own_sequences(tmpdir):
+    filename = str(tmpdir.join('sequences.json.gz'))
+    key = SequenceBank.key('task', 1)
+    SequenceBank.save(filename, 'task', 8, [{key: ['a', 'b']}, {key: ['c', 'd']}])
+    assert [drawn(filename, subject) for subject in range(1, 9)] == [
+        ['a', 'b'], ['c', 'd'], ['b', 'a'], ['d', 'c']] * 2
+    with pytest.raises(ValueError):
+        drawn(filename, 9)
+
+
+def test_sequence_bank_without_groups(tmpdir):
+    # as written before there were groups
+    filename = str(tmpdir.join('sequences.json.gz'))
+    with gzip.open(filename, 'wb') as f:
+        f.write(json.dumps({'task': 'task', 'subjects': 3, 'pools': {
+            SequenceBank.key('task', 1): ['a', 'b', 'c']}}).encode('utf-8'))
+    orders = [drawn(filename, subject) for subject in range(1, 4)]
+    assert all(sorted(order) == ['a', 'b', 'c'] for order in orders)
+    assert [order[0] for order in orders] == ['a', 'b', 'c']
+
+
+def columnar_csv(directory):
+    filename = directory + '.csv'
+    columnar_to_csv(directory, filename)
+    with open(filename) as f:
+        return(f.read().splitlines())
+
+
+def write_columnar(directory, rows):
+    log = ColumnarLog(directory)
+    for row in rows:
+        log.add(row)
+    log.save()
+
+
+@pytest.mark.parametrize('with_numpy', [True, False])
+def test_columnar_log_round_trip(tmpdir, monkeypatch, with_numpy):
+    if not with_numpy:
+        monkeypatch.setattr(_base_expyriment, 'numpy', None)
+    directory = str(tmpdir.join('columns'))
+    write_columnar(directory, [
+        [('trial', 1), ('id', 2**60 + 1), ('pressed', True), ('rt', None), ('key', '12')],
+        [('trial', 2), ('id', None), ('pressed', None), ('rt', 412.5), ('key', 'ab')]])
+    # appended to after reopening, with a new column and changed types
+    write_columnar(directory, [
+        [('trial', 3), ('id', -2**63), ('pressed', False), ('rt', 380), ('key', 7),
+         ('trail', [1, 2])]])
+    data = read_columns(directory)
+    ids = data['id'].tolist() if with_numpy else data['id']
+    assert ids == [2**60 + 1, None, -2**63]
+    if with_numpy:
+        assert data['trial'].dtype.kind == 'i' and data['pressed'].dtype.kind == 'b'
+        assert data['id'].mask.tolist() == [False, True, False]
+        assert data['trial'].tolist() == [1, 2, 3]
+    else:
+        assert data['trial'] == [1, 2, 3] and data['pressed'] == [True, None, False]
+    assert columnar_csv(directory) == [
+        'trial,id,pressed,rt,key,trail',
+        '1,1152921504606846977,True,None,12,',
+        '2,None,None,412.5,ab,',
+        '3,-9223372036854775808,False,380.0,7,1|2']
+
+    # ints become floats, and bools text, as they would be in the csv
+    write_columnar(directory, [[('trial', 4.5), ('pressed', 1), ('id', 2**64)]])
+    data = read_columns(directory, names=['trial', 'pressed'])
+    assert list(data['trial']) == [1, 2, 3, 4.5]
+    assert list(data['pressed']) == ['True', 'None', 'False', '1']
+    assert [row.split(',')[:3] for row in columnar_csv(directory)[1:]] == [
+        ['1.0', '1152921504606846977', 'True'], ['2.0', 'None', 'None'],
+        ['3.0', '-9223372036854775808', 'False'], ['4.5', '18446744073709551616', '1']]
+
+
+def test_columnar_log_drops_partial_rows(tmpdir):
+    directory = str(tmpdir.join('columns'))
+    write_columnar(directory, [[('trial', 1), ('pressed', True), ('key', 'a')]])
+    # as if the program ended while the next row was written
+    for name in os.listdir(directory):
+        if name != 'schema.json':
+            with open(os.path.join(directory, name), 'ab') as f:
+                f.write(b'\x01' * 5)
+    write_columnar(directory, [[('trial', 2), ('pressed', None), ('key', 'b')]])
+    assert columnar_csv(directory) == ['trial,pressed,key', '1,True,a', '2,None,b']
+
+
+def test_columnar_log_reads_ints_written_as_doubles(tmpdir):
+    # int columns were written as doubles before they had a dtype
+    directory = str(tmpdir.join('columns'))
+    os.makedirs(directory)
+    _base_expyriment._append_numbers(os.path.join(directory, 'c0'), [1.0, float('nan')])
+    with open(os.path.join(directory, 'schema.json'), 'w') as f:
+        json.dump({'rows': 2, 'columns': [{'name': 'trial', 'type': 'int', 'file': 'c0'}]}, f)
+    write_columnar(directory, [[('trial', 3)]])
+    assert columnar_csv(directory) == ['trial', '1', 'None', '3']
+
+
+class StepClock():
+    def __init__(self):
+        self.time = 0
+
+
+class Job():
+    # a stimulus that takes the given time to preload
+    def __init__(self, clock, cost, done):
+        self.clock, self.cost, self.done = clock, cost, done
+        self.is_preloaded = False
+
+    def preload(self):
+        self.clock.time += self.cost
+        self.is_preloaded = True
+        self.done.append(self)
+
+
+def test_prefetcher_skips_jobs_that_do_not_fit():
+    clock, done = StepClock(), []
+    prefetcher = Prefetcher(clock)
+    prefetcher.add(Job(clock, 80, done), 'slow')
+    prefetcher.run()
+    slow, fast = Job(clock, 80, done), Job(clock, 5, done)
+    prefetcher.add(slow, 'slow')
+    prefetcher.add(fast, 'fast')
+    prefetcher.run(60)
+    assert done[1:] == [fast]
+    prefetcher.run(100)
+    assert done[1:] == [fast, slow]
+
+
+def test_prefetcher_recovers_from_a_slow_job():
+    clock, done = StepClock(), []
+    prefetcher = Prefetcher(clock)
+    # e.g. the first text, which loads the font
+    prefetcher.add(Job(clock, 800, done), 'text')
+    prefetcher.run()
+    for _ in range(6):
+        prefetcher.add(Job(clock, 5, done), 'text')
+        prefetcher.run()
+    assert prefetcher.cost('text') < 20
+    prefetcher.add(Job(clock, 5, done), 'text')
+    assert prefetcher.run(20) == 5
+    # while a slower job raises the estimate right away
+    prefetcher.add(Job(clock, 30, done), 'text')
+    prefetcher.run()
+    assert prefetcher.cost('text') == 30
+
+
+def test_prefetcher_drops_expired_and_preloaded_jobs():
+    clock, done = StepClock(), []
+    prefetcher = Prefetcher(clock)
+    trial, other = object(), object()
+    first, second, third = Job(clock, 5, done), Job(clock, 5, done), Job(clock, 5, done)
+    prefetcher.add(first, group=trial)
+    prefetcher.add(lambda: done.append('feedback'), 'feedback', trial)
+    prefetcher.add(second, group=other)
+    prefetcher.add(third)
+    third.is_preloaded = True
+    prefetcher.expire(trial)
+    assert prefetcher.run() == 5 and done == [second]
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" TRAIL RECORDER.
+records the trail drawn in the trail making task as (x, y, time) samples
+and writes them to binary trail files, one per block, which can be loaded
+for analysis with read_trail().
+
+A trail file starts with the 8 bytes b'TRAIL\\x00\\x01\\x00', followed by
+one record per sample of four little-endian doubles: trial, x, y, and
+time [ms since the start of the trial].
+
+MIT License, see LICENSE in the repository.
+"""
+
+import os
+import sys
+import mmap
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TRAIL_MAGIC = b'TRAIL\x00\x01\x00'
+TRAIL_FIELDS = ('trial', 'x', 'y', 'time')
+
+
+class TrailRecorder():
+    # samples are kept in a preallocated ring of doubles; when it is full,
+    # or when the trial ends, they are appended to the trail file, so that
+    # memory stays bounded however high the sample rate is
+    def __init__(self, filename, capacity=4096, writer=None):
+        self.filename = filename
+        self.capacity = capacity
+        self.writer = writer
+        self.trial = 0
+        self._samples = array('d', [0.0]) * (capacity * len(TRAIL_FIELDS))
+        self._size = 0
+
+    def start_trial(self, trial):
+        self.flush()
+        self.trial = trial
+
+    def add(self, x, y, time):
+        i = self._size * 4
+        self._samples[i] = self.trial
+        self._samples[i + 1] = x
+        self._samples[i + 2] = y
+        self._samples[i + 3] = time
+        self._size += 1
+        if self._size == self.capacity:
+            self.flush()
+
+    def flush(self):
+        job = self.detach()
+        if not job:
+            return
+        if self.writer:
+            self.writer.put(job)
+        else:
+            job()
+
+    def detach(self):
+        # copies the samples off the ring and returns a function that appends
+        # them to the trail file, or False if there is nothing to write
+        if not self._size:
+            return(False)
+        samples = self._samples[:self._size * 4]
+        self._size = 0
+        if sys.byteorder == 'big':
+            samples.byteswap()
+        data = samples.tobytes() if hasattr(samples, 'tobytes') else samples.tostring()
+        filename = self.filename
+
+        def write():
+            size = os.path.getsize(filename) if os.path.exists(filename) else 0
+            with open(filename, 'ab') as f:
+                if not size:
+                    f.write(TRAIL_MAGIC)
+                elif (size - len(TRAIL_MAGIC)) % 32:
+                    # drop a sample that an interrupted write left incomplete
+                    f.truncate(size - (size - len(TRAIL_MAGIC)) % 32)
+                f.write(data)
+        return(write)
+
+
+def read_trail(filename, trial=None):
+    # returns a numpy record array (memory mapped) with the fields trial,
+    # x, y, and time if numpy is available, otherwise a list of tuples
+    with open(filename, 'rb') as f:
+        if f.read(len(TRAIL_MAGIC)) != TRAIL_MAGIC:
+            raise ValueError('{} is not a trail file.'.format(filename))
+        size = os.path.getsize(filename)
+        count = (size - len(TRAIL_MAGIC)) // 32
+        if not count:
+            samples = numpy.zeros(0, dtype=[(n, '<f8') for n in TRAIL_FIELDS]) if numpy is not None else []
+        else:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if numpy is not None:
+                samples = numpy.frombuffer(mapped, dtype=[(n, '<f8') for n in TRAIL_FIELDS],
+                                           count=count, offset=len(TRAIL_MAGIC))
+            else:
+                values = array('d')
+                data = mapped[len(TRAIL_MAGIC):len(TRAIL_MAGIC) + count * 32]
+                if hasattr(values, 'frombytes'):
+                    values.frombytes(data)
+                else:
+                    values.fromstring(data)
+                mapped.close()
+                if sys.byteorder == 'big':
+                    values.byteswap()
+                samples = list(zip(values[0::4], values[1::4], values[2::4], values[3::4]))
+    if trial is None:
+        return(samples)
+    if numpy is not None:
+        return(samples[samples['trial'] == trial])
+    return([s for s in samples if s[0] == trial])
@@ -0,0 +1,42 @@
+import random
+from itertools import combinations
+
+import pytest
+
+pytest.importorskip('expyriment')
+
+from trailmaking import TrailMaking
+
+
+def check_layout(positions, area, radius, num_positions):
+    assert len(positions) == num_positions == len(set(positions))
+    for x, y in positions:
+        assert -area[0] / 2.0 + radius - 1 < x < area[0] / 2.0 - radius + 1
+        assert -area[1] / 2.0 + radius - 1 < y < area[1] / 2.0 - radius + 1
+    return(min(TrailMaking.point_distance(a, b) for a, b in combinations(positions, 2)))
+
+
+@pytest.mark.parametrize('area, num_positions', [((1280, 800), 5), ((1280, 800), 25),
+                                                 ((800, 1280), 12), ((601, 403), 8)])
+def test_layouts_keep_the_minimum_distance(area, num_positions):
+    rng = random.Random(num_positions)
+    for _ in range(10):
+        positions = TrailMaking.make_random_positions(area, 20, num_positions, 80, 30, rng)
+        assert check_layout(positions, area, 20, num_positions) >= 80
+
+
+def test_crowded_layouts_reduce_the_distance():
+    # 40 targets do not fit 80 px apart, but do closer together
+    rng = random.Random(1)
+    for _ in range(10):
+        positions = TrailMaking.make_random_positions((300, 300), 20, 40, 80, 30, rng)
+        assert 1 <= check_layout(positions, (300, 300), 20, 40) < 80
+
+
+@pytest.mark.parametrize('area, radius, num_positions', [((22, 22), 10, 30), ((10, 10), 10, 3),
+                                                         ((60, 44), 20, 300)])
+def test_impossible_layouts_are_reported(area, radius, num_positions):
+    with pytest.raises(ValueError) as error:
+        TrailMaking.make_random_positions(area, radius, num_positions, 4 * radius, 30,
+                                          random.Random(0))
+    assert '{}x{}'.format(*area) in str(error.value)
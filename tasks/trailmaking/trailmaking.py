@@ -39,8 +39,14 @@ SOFTWARE.
 
 from expyriment import design, control, stimuli, io, misc
 from _base_expyriment import BaseExpyriment, _, python_version
-from random import randint
+from _trail import TrailRecorder
+import random
 import itertools
+import hashlib
+import json
+import math
+import os
+import pygame
 try:
     import android
 except ImportError:
@@ -55,7 +61,7 @@ DEFAULTS = {
     'stimulus_text_correction_y': 0.2,
     'target_font': 'sans',
     'min_distance_of_targets': 4,
-    'attempts_before_reducing_min_distance': 200,
+    'attempts_before_reducing_min_distance': 30,
     'colour_line': (0, 255, 0),
     'colour_target': (255, 255, 0),
     'colour_target_label': (0, 0, 0),
@@ -63,20 +69,58 @@ DEFAULTS = {
     'colour_target_error': (255, 0, 0),
     'colour_target_hint': (0, 255, 0),
     'colour_window_boundary': None,
-    'antialiasing': 'yes'
+    'antialiasing': 'yes',
+    'incremental_drawing': 'yes',
+    'trail_buffer_samples': 4096
+}
+
+SCHEMA = {
+    'DESIGN': {
+        'trials': ('int', 'per_block', 'required'),
+        'num_targets': ('int', 'per_block', 'required'),
+        'target_titles': ('str', 'per_block', 'required'),
+        'timeout': ('int', 'per_block', 'required'),
+        'on_pointer_release': ('str',),
+        'on_mismatched_circle': ('str',),
+        'layout_seed': ('int',),
+        'layout_directory': ('str',)
+    },
+    'APPEARANCE': {
+        'target_radius': ('unit',),
+        'line_width': ('unit',),
+        'stimulus_relative_text_size': ('float',),
+        'stimulus_text_correction_y': ('float',),
+        'target_font': ('str',),
+        'min_distance_of_targets': ('float',),
+        'attempts_before_reducing_min_distance': ('float',),
+        'colour_line': ('colour',),
+        'colour_target': ('colour',),
+        'colour_target_label': ('colour',),
+        'colour_target_done': ('colour',),
+        'colour_target_error': ('colour',),
+        'colour_target_hint': ('colour',),
+        'colour_window_boundary': ('colour',),
+        'antialiasing': ('bool',),
+        'incremental_drawing': ('bool',)
+    },
+    'LOG': {
+        'trail_file': ('str',),
+        'trail_buffer_samples': ('int',)
+    }
 }
 
 
 class TrailMaking():
     @staticmethod
     def run():
-        exp = BaseExpyriment(DEFAULTS)
+        exp = BaseExpyriment(DEFAULTS, SCHEMA)
         trail_making = TrailMaking(exp)
 
-        for i in range(exp.config.getint('DESIGN', 'blocks')):
+        # the layouts of the subject are known once the subject id is
+        trail_making.start()
+        for i in range(exp.settings.design.blocks):
             trail_making.prepare_block(i)
 
-        trail_making.start()
         for block in exp.blocks:
             trail_making.run_block(block)
 
@@ -90,32 +134,50 @@ class TrailMaking():
         if not android:
             self.exp.mouse.show_cursor()
 
+        settings = self.exp.settings
+
         # OPTIONAL OPTIONS
-        self.radius = self.exp._unit(self.exp.config.get('APPEARANCE', 'target_radius'))
-        self.line_width = self.exp._unit(self.exp.config.get('APPEARANCE', 'line_width'))
+        self.radius = self.exp._unit(settings.appearance.target_radius)
+        self.line_width = self.exp._unit(settings.appearance.line_width)
         self.ring_radius = self.radius - self.line_width / 2
 
-        self.colour_line = self.exp.config.gettuple('APPEARANCE', 'colour_line')
+        self.colour_line = settings.appearance.colour_line
+
+        self.antialiasing = settings.appearance.antialiasing
+        # drawing straight to the display only works without OpenGL
+        self.incremental_drawing = settings.appearance.incremental_drawing and \
+            not getattr(self.exp.screen, 'opengl', getattr(self.exp.screen, 'open_gl', True))
+        self.colour_target = settings.appearance.colour_target
 
-        self.antialiasing = self.exp.config.getboolean('APPEARANCE', 'antialiasing')
-        self.colour_target = self.exp.config.gettuple('APPEARANCE', 'colour_target')
+        self.colour_target_done = settings.appearance.colour_target_done
+        self.colour_target_error = settings.appearance.colour_target_error
+        self.colour_target_hint = settings.appearance.colour_target_hint
+        self.colour_window_boundary = settings.appearance.colour_window_boundary
 
-        self.colour_target_done = self.exp.config.gettuple('APPEARANCE', 'colour_target_done')
-        self.colour_target_error = self.exp.config.gettuple('APPEARANCE', 'colour_target_error')
-        self.colour_target_hint = self.exp.config.gettuple('APPEARANCE', 'colour_target_hint')
+        self.colour_target_label = settings.appearance.colour_target_label
+        self.target_font = settings.appearance.target_font
+        self.stimulus_text_correction_y = settings.appearance.stimulus_text_correction_y
 
-        self.colour_target_label = self.exp.config.gettuple('APPEARANCE', 'colour_target_label')
-        self.target_font = self.exp.config.get('APPEARANCE', 'target_font')
-        self.stimulus_text_correction_y = self.exp.config.getfloat(
-            'APPEARANCE', 'stimulus_text_correction_y')
+        self.stimulus_relative_text_size = settings.appearance.stimulus_relative_text_size
 
-        self.stimulus_relative_text_size = self.exp.config.getfloat(
-            'APPEARANCE', 'stimulus_relative_text_size')
+        self.min_distance_of_targets = settings.appearance.min_distance_of_targets
+        self.attempts_before_reducing_min_distance = \
+            settings.appearance.attempts_before_reducing_min_distance
 
-        self.on_pointer_release = self.exp.config.get('DESIGN', 'on_pointer_release')
-        self.on_mismatched_circle = self.exp.config.get('DESIGN', 'on_mismatched_circle')
+        self.on_pointer_release = settings.design.on_pointer_release
+        self.on_mismatched_circle = settings.design.on_mismatched_circle
 
         self.labels = TrailMaking.make_labels()
+        # the same seed gives the same layouts in the same order
+        self.random = random.Random(settings.design.layout_seed) \
+            if settings.design.layout_seed is not None else random.Random()
+        self.layouts = LayoutLibrary(settings.design.layout_directory) \
+            if settings.design.layout_directory is not None else None
+        self.target_indices = {}
+
+        self.trail_file = settings.log.trail_file
+        self.trail_buffer_samples = settings.log.trail_buffer_samples
+        self.trail_recorder = None
 
     def start(self):
         self.exp._start()
@@ -127,11 +189,11 @@ class TrailMaking():
 
     def prepare_block(self, id):
         block = design.Block()
-        block.set_factor('num_targets', self.exp.config.getforblock('DESIGN', 'num_targets', id, cast=int))
-        block.set_factor('target_titles', self.exp.config.getforblock(
-            'DESIGN', 'target_titles', id))
-        block.set_factor('timeout', self.exp.config.getforblock('DESIGN', 'timeout', id, cast=int))
-        for t in range(self.exp.config.getforblock('DESIGN', 'trials', id, cast=int)):
+        settings = self.exp.settings.design
+        block.set_factor('num_targets', settings.num_targets[id])
+        block.set_factor('target_titles', settings.target_titles[id])
+        block.set_factor('timeout', settings.timeout[id])
+        for t in range(settings.trials[id]):
             block.add_trial(self.prepare_trial(block))
         self.exp.add_block(block)
 
@@ -140,12 +202,19 @@ class TrailMaking():
         # TODO: practice = e['Practice'] if 'Practice' in e else False
         labels = self.labels[block.get_factor('target_titles')][:block.get_factor('num_targets')]
 
-        positions = TrailMaking.make_random_positions(
-            self.exp.screen.window_size,
-            self.radius,
-            block.get_factor('num_targets'),
-            self.exp.config.getfloat('DESIGN', 'min_distance_of_targets') * self.radius,
-            self.exp.config.getfloat('DESIGN', 'attempts_before_reducing_min_distance'))
+        settings = (self.exp.screen.window_size, self.radius, block.get_factor('num_targets'),
+                    self.min_distance_of_targets * self.radius)
+        positions = self.exp.sequences.next('trailmaking', LayoutLibrary.key(*settings)) \
+            if self.exp.sequences else None
+        if positions is not None:
+            positions = [tuple(p) for p in positions]
+        elif self.layouts:
+            positions = self.layouts.next(self.random, *settings)
+        if positions is None:
+            positions = TrailMaking.make_random_positions(*settings + (
+                self.attempts_before_reducing_min_distance,
+                self.random))
+        trial.set_factor('layout', LayoutLibrary.layout_id(positions))
 
         for lab, pos in zip(labels, positions):
             stim = stimuli.Circle(radius=self.radius, position=pos,
@@ -161,12 +230,28 @@ class TrailMaking():
                                     text_font=self.target_font)
             trial.add_stimulus(stim)
             trial.add_stimulus(label)
+        # rendered while messages are shown before the trail; the trial is
+        # copied when added to a block, so they are grouped by its first
+        # stimulus
+        for stim in trial.stimuli:
+            self.exp.prefetcher.add(stim, group=trial.stimuli[0].id)
+        # trials are copied when added to a block, but their stimuli are not
+        targets = TargetIndex(self.radius)
+        for stim in trial.stimuli[::2]:
+            targets.add(stim)
+        self.target_indices[trial.stimuli[0].id] = targets
         return(trial)
 
     def run_block(self, block):
         # self.exp._show_message('', 'click_to_start')
+        if self.trail_file:
+            self.trail_recorder = TrailRecorder(
+                os.path.join(io.defaults.datafile_directory, self.trail_file.format(
+                    subject_id=self.exp._subject, session_id=self.exp._session, block_id=block.id + 1)),
+                capacity=self.trail_buffer_samples, writer=self.exp._log_writer)
         for trial in block.trials:
             self.run_trial(block, trial)
+        self.trail_recorder = None
         # self.exp._log_block(block)
 
     def run_trial(self, block, trial):
@@ -177,25 +262,29 @@ class TrailMaking():
         self.exp._show_message('', 'instruction', format={'target_order': target_order})
 
         idoffset = trial.stimuli[1].id - 1
+        targets = self.target_indices[trial.stimuli[0].id]
 
         def make_surface(trial):
             sf = stimuli.BlankScreen()
-            boundary = self.exp.config.gettuple('APPEARANCE', 'colour_window_boundary')
-            if boundary:
+            if self.colour_window_boundary:
                 stimuli.Rectangle(self.exp.screen.window_size,
                                   line_width=self.line_width,
-                                  colour=boundary).plot(sf)
+                                  colour=self.colour_window_boundary).plot(sf)
             [s.plot(sf) for s in trial.stimuli]
             return sf
 
+        self.exp.prefetcher.expire(trial.stimuli[0].id)
         surface = make_surface(trial)
         surface.present()
+        pen = TrailPen(self.line_width, self.colour_line) if self.incremental_drawing else None
 
         cumulated = 0
-        path = []
+        if self.trail_recorder:
+            self.trail_recorder.start_trial(trial.id)
         currentcircle = 0
         score = 0
-        mouse = self.exp.mouse.position
+        self.exp.input_source.expect(targets=[s.position for s in trial.stimuli[::2]], radius=self.radius)
+        mouse = self.exp.input_source.position
         has_moved = False
 
         logs = {'lost_touch': [], 'touched_targets': []}
@@ -211,18 +300,20 @@ class TrailMaking():
 
         in_circle = -1
         mismatched_circles = []
-        misc.Clock.reset_stopwatch(self.exp.clock)
+        self.exp.clock.reset_stopwatch()
 
         while True:
-            new_mouse = self.exp.mouse.wait_motion(duration=20)[0]
+            new_mouse = self.exp.input_source.wait_motion(duration=20)[0]
+            redraw = pen is None
             if self.exp.clock.stopwatch_time / 1000 >= block.get_factor('timeout'):
                 self.exp._log_trial(block, trial, get_log('timeout'))
                 break
-            if self.exp.mouse.pressed_buttons[0] != 1:
+            if self.exp.input_source.pressed_buttons[0] != 1:
                 lost = False
                 if currentcircle > 0 or len(mismatched_circles) > 0:
                     lost = True
-                if self.on_pointer_release == 'reset':
+                # nothing to reset when nothing was drawn since the last time
+                if self.on_pointer_release == 'reset' and (has_moved or lost):
                     currentcircle = 0
                     mismatched_circles = []
                     score = 0  # TODO
@@ -243,63 +334,73 @@ class TrailMaking():
                 continue
             if abs(new_mouse[0]) >= self.exp.screen.window_size[0]/2 or abs(new_mouse[1]) >= self.exp.screen.window_size[1]/2:
                 continue
-            if mouse is not None:
+            if mouse is not None and pen:
+                pen.stroke(surface, mouse, new_mouse)
+            elif mouse is not None:
                 stimuli.Line(mouse, new_mouse, self.line_width, self.colour_line).plot(surface)
                 stimuli.Circle(radius=self.line_width/2,
                                position=new_mouse,
                                colour=self.colour_line,
                                anti_aliasing=self.antialiasing
                                ).plot(surface)
+            if mouse is not None:
                 cumulated += TrailMaking.point_distance(new_mouse, mouse)
-                path.append([new_mouse[0], new_mouse[1], self.exp.clock.stopwatch_time])
-
-            def get_stimulus_position(sid): return [
-                x for x in trial.stimuli if x.id == sid][0].position
-
-            for s in trial.stimuli:
-                if 'Circle' in s.__class__.__name__:
-                    x, y = s.position
-                    if TrailMaking.point_distance((x, y), new_mouse) <= self.radius:
-                        if in_circle == -1:
-                            in_circle = s.id
-                            if (s.id - idoffset)/2+0 == currentcircle:
-                                # stimuli.Circle(radius=CIRCLE_SIZE, colour=COLOUR_CIRCLE_DONE, line_width=LINEWIDTH, position=(x, y)).plot(surface)
-                                # , anti_aliasing=ANTIALIASING
-                                currentcircle += 1
-                                # score += SCORE_CORRECT_CIRCLE
-                                logs['touched_targets'].append(get_log('correct_touch'))
-                                self.exp._log_trial(block, trial, logs['touched_targets'][-1])
-                                if len(mismatched_circles) > 0:
-                                    for ss in mismatched_circles + [s.id]:
-                                        trial.stimuli[ss - idoffset].plot(surface)
-                                        trial.stimuli[ss - idoffset + 1].plot(surface)
-                                    mismatched_circles = []
-                            elif (s.id - idoffset)/2+0 < currentcircle - 1 or (s.id - idoffset)/2+0 > currentcircle:
-                                if self.on_mismatched_circle == 'repeat_last':
-                                    if len(mismatched_circles) == 0 and currentcircle > 0:
-                                        currentcircle -= 1
-                                    stimuli.Circle(radius=self.ring_radius, colour=self.colour_target_hint, line_width=self.line_width, position=get_stimulus_position(
-                                        currentcircle*2 + idoffset)).plot(surface)
-                                if self.on_mismatched_circle in ['highlight_only', 'repeat_last']:
-                                    mismatched_circles.append(s.id)
-                                    stimuli.Circle(radius=self.ring_radius,
-                                                   colour=self.colour_target_error,
-                                                   line_width=self.line_width,
-                                                   position=(x, y),
-                                                   anti_aliasing=self.antialiasing).plot(surface)
-                                # score += SCORE_WRONG_CIRCLE
-                                logs['touched_targets'].append(
-                                    get_log('wrong_touch:' + str(currentcircle)))
-                                self.exp._log_trial(block, trial, logs['touched_targets'][-1])
-                    else:
-                        if in_circle == s.id and TrailMaking.point_distance((x, y), new_mouse) >= self.radius + 1:
-                            trial.stimuli[in_circle - idoffset + 1].plot(surface)
-                            in_circle = -1
-            surface.present()
+                if self.trail_recorder:
+                    self.trail_recorder.add(new_mouse[0], new_mouse[1], self.exp.clock.stopwatch_time)
+
+            if in_circle != -1 and TrailMaking.point_distance(
+                    targets.position(in_circle), new_mouse) >= self.radius + 1:
+                trial.stimuli[in_circle - idoffset + 1].plot(surface)
+                in_circle = -1
+                redraw = True
+
+            hits = targets.query(new_mouse, self.radius)
+            if in_circle == -1 and hits:
+                s = targets.stimuli[hits[0]]
+                x, y = s.position
+                in_circle = s.id
+                redraw = True
+                if (s.id - idoffset)/2+0 == currentcircle:
+                    # stimuli.Circle(radius=CIRCLE_SIZE, colour=COLOUR_CIRCLE_DONE, line_width=LINEWIDTH, position=(x, y)).plot(surface)
+                    # , anti_aliasing=ANTIALIASING
+                    currentcircle += 1
+                    # score += SCORE_CORRECT_CIRCLE
+                    logs['touched_targets'].append(get_log('correct_touch'))
+                    self.exp._log_trial(block, trial, logs['touched_targets'][-1])
+                    if len(mismatched_circles) > 0:
+                        for ss in mismatched_circles + [s.id]:
+                            trial.stimuli[ss - idoffset].plot(surface)
+                            trial.stimuli[ss - idoffset + 1].plot(surface)
+                        mismatched_circles = []
+                elif (s.id - idoffset)/2+0 < currentcircle - 1 or (s.id - idoffset)/2+0 > currentcircle:
+                    if self.on_mismatched_circle == 'repeat_last':
+                        if len(mismatched_circles) == 0 and currentcircle > 0:
+                            currentcircle -= 1
+                        stimuli.Circle(radius=self.ring_radius, colour=self.colour_target_hint, line_width=self.line_width, position=targets.position(
+                            currentcircle*2 + idoffset)).plot(surface)
+                    if self.on_mismatched_circle in ['highlight_only', 'repeat_last']:
+                        mismatched_circles.append(s.id)
+                        stimuli.Circle(radius=self.ring_radius,
+                                       colour=self.colour_target_error,
+                                       line_width=self.line_width,
+                                       position=(x, y),
+                                       anti_aliasing=self.antialiasing).plot(surface)
+                    # score += SCORE_WRONG_CIRCLE
+                    logs['touched_targets'].append(
+                        get_log('wrong_touch:' + str(currentcircle)))
+                    self.exp._log_trial(block, trial, logs['touched_targets'][-1])
+            if redraw:
+                surface.present()
+                if pen:
+                    pen.clear()
+            else:
+                pen.update(surface)
             mouse = new_mouse
             if currentcircle >= len(trial.stimuli)/2:
                 self.exp._log_trial(block, trial, get_log('finish'))
                 break
+        if self.trail_recorder:
+            self.trail_recorder.flush()
         logs['time'] = self.exp.clock.stopwatch_time
         logs['distance'] = cumulated
         logs['score'] = score
@@ -309,7 +410,6 @@ class TrailMaking():
         self.exp._log_block(trial, block, logs, {'trail': trial.id},
                             TrailMaking.make_trail_summary(logs, block))
         # TODO
-        # self.log_trail(block, path)
         # self.log_targets(block, block.trials[0].stimuli)
         return()
 
@@ -343,21 +443,65 @@ class TrailMaking():
         return(labels)
 
     @staticmethod
-    def make_random_positions(area, radius, num_positions, min_distance, min_attempts):
-        positions = []
+    def make_random_positions(area, radius, num_positions, min_distance, min_attempts, rng=random):
+        # positions are first tried anywhere in the area, which is fastest
+        # for a few targets; if one does not fit within the given number of
+        # attempts, they are picked from a poisson-disk sample of the whole
+        # area instead, reducing the minimum distance by .05 of the radius
+        # until that holds enough positions, or the distance is down to 1
+        grid = PositionGrid(area, radius, min_distance)
+        too_small = '{} targets of radius {} do not fit into a window of {}x{}.'.format(
+            num_positions, radius, area[0], area[1])
+        if grid.left > grid.right or grid.bottom > grid.top:
+            raise ValueError(too_small)
         for i in range(num_positions):
-            failed_position = 0
-            while True:
-                p = randint(int(-area[0]/2 + radius), int(area[0]/2 - radius)
-                            ), randint(int(-area[1]/2 + radius), int(area[1]/2 - radius))
-                if not [1 for x in positions if TrailMaking.point_distance(p, x) < min_distance]:
-                    positions.append(p)
+            for _ in range(int(min_attempts)):
+                p = rng.randint(grid.left, grid.right), rng.randint(grid.bottom, grid.top)
+                if grid.fits(p):
+                    grid.add(p)
+                    break
+            else:
+                break
+        else:
+            return(grid.positions)
+
+        while True:
+            positions = TrailMaking.make_poisson_disk_positions(
+                area, radius, min_distance, int(min_attempts), rng)
+            if len(positions) >= num_positions:
+                return(rng.sample(positions, num_positions))
+            if min_distance <= 1:
+                raise ValueError(too_small)
+            # the number of positions grows with the inverse square of the
+            # distance, so several steps can be skipped at once
+            step = 0.05 * radius
+            estimate = min_distance * math.sqrt(1.0 * len(positions) / num_positions)
+            min_distance = max(min_distance - step * max(int((min_distance - estimate) / step), 1), 1)
+
+    @staticmethod
+    def make_poisson_disk_positions(area, radius, min_distance, attempts, rng=random):
+        # Bridson's algorithm: new positions are tried around a random active
+        # position until one fits; after the given number of attempts without
+        # one, that position is no longer active
+        grid = PositionGrid(area, radius, min_distance)
+        p = rng.randint(grid.left, grid.right), rng.randint(grid.bottom, grid.top)
+        grid.add(p)
+        active = [p]
+        while active:
+            i = rng.randrange(len(active))
+            x, y = active[i]
+            for _ in range(attempts):
+                angle = rng.uniform(0, 2 * math.pi)
+                distance = rng.uniform(min_distance, 2 * min_distance)
+                p = int(round(x + distance * math.cos(angle))), int(round(y + distance * math.sin(angle)))
+                if grid.left <= p[0] <= grid.right and grid.bottom <= p[1] <= grid.top and grid.fits(p):
+                    grid.add(p)
+                    active.append(p)
                     break
-                else:
-                    failed_position += 1
-                    if failed_position > min_attempts:
-                        return(TrailMaking.make_random_positions(area, radius, num_positions, min_distance - 0.05 * radius, min_attempts))
-        return(positions)
+            else:
+                active[i] = active[-1]
+                active.pop()
+        return(grid.positions)
 
     @staticmethod
     def point_distance(a, b):
@@ -371,17 +515,208 @@ class TrailMaking():
             mindist += TrailMaking.point_distance(
                 block.trials[0].stimuli[tid].position, block.trials[0].stimuli[tid-2].position)
 
+        return(TrailMaking.summarise_trail(results['lost_touch'] + results['touched_targets'],
+                                           results['distance'], mindist))
+
+    @staticmethod
+    def summarise_trail(events, distance, min_distance=None):
+        # events are the logged rows of a trail; without the minimum distance
+        # (see tools/rescore.py) the ratio is not known either
         return(
             {
-                'num_lost_touch': len(results['lost_touch']),
-                'num_wrong_targets': len([1 for x in results['touched_targets'] if x['event'].startswith('wrong')]),
-                'num_done_targets': max([x['current_target'] for x in results['touched_targets'] if x['event'].startswith('correct')]),
-                'min_distance': mindist,
-                'ratio_min_distance': results['distance'] / mindist
+                'num_lost_touch': len([1 for x in events if x['event'] == 'lost_touch']),
+                'num_wrong_targets': len([1 for x in events if x['event'].startswith('wrong')]),
+                'num_done_targets': max([0] + [x['current_target'] for x in events if x['event'].startswith('correct')]),
+                'min_distance': min_distance,
+                'ratio_min_distance': distance / min_distance if min_distance else None
             }
         )
 
 
+class TrailPen():
+    # draws the trail straight onto the pixels of the canvas and copies only
+    # the changed region to the display, instead of plotting new stimuli and
+    # presenting the whole canvas for every sample
+    def __init__(self, line_width, colour):
+        self.radius = max(int(round(line_width / 2.0)), 1)
+        # pygame fills polygons including their edges
+        self.half_width = max(line_width - 1, 1) / 2.0
+        self.colour = colour
+        self.polygon = [[0, 0], [0, 0], [0, 0], [0, 0]]
+        self.dirty = None
+
+    def stroke(self, canvas, start, end):
+        # the canvas keeps its surface once stimuli were plotted on it
+        target = canvas._get_surface()
+        width, height = target.get_size()
+        x1, y1 = TrailPen._to_pixels(start, width, height)
+        x2, y2 = TrailPen._to_pixels(end, width, height)
+        length = ((x2 - x1)**2 + (y2 - y1)**2)**0.5
+        if length:
+            nx, ny = (y1 - y2) * self.half_width / length, (x2 - x1) * self.half_width / length
+            self.polygon[0][:] = int(x1 + nx), int(y1 + ny)
+            self.polygon[1][:] = int(x2 + nx), int(y2 + ny)
+            self.polygon[2][:] = int(x2 - nx), int(y2 - ny)
+            self.polygon[3][:] = int(x1 - nx), int(y1 - ny)
+            pygame.draw.polygon(target, self.colour, self.polygon)
+        pygame.draw.circle(target, self.colour, (x2, y2), self.radius)
+
+        margin = self.radius + 1
+        rect = pygame.Rect(min(x1, x2) - margin, min(y1, y2) - margin,
+                           abs(x2 - x1) + 2 * margin + 1, abs(y2 - y1) + 2 * margin + 1)
+        if self.dirty:
+            self.dirty.union_ip(rect)
+        else:
+            self.dirty = rect
+
+    def update(self, canvas):
+        if not self.dirty:
+            return
+        display = pygame.display.get_surface()
+        source = canvas._get_surface()
+        offset = ((display.get_width() - source.get_width()) // 2,
+                  (display.get_height() - source.get_height()) // 2)
+        area = self.dirty.clip(source.get_rect())
+        display.blit(source, area.move(offset), area)
+        pygame.display.update(area.move(offset))
+        self.dirty = None
+
+    def clear(self):
+        self.dirty = None
+
+    @staticmethod
+    def _to_pixels(position, width, height):
+        # as expyriment converts positions to coordinates on a surface
+        return(int(position[0]) + width // 2 - (1 - width % 2),
+               -int(position[1]) + height // 2 - (1 - height % 2))
+
+
+class PositionGrid():
+    # positions within an area keeping a minimum distance; cells are
+    # min_distance / sqrt(2) wide so that each holds at most one position
+    # and checking a position only looks at the 21 cells around it
+    def __init__(self, area, radius, min_distance):
+        self.left, self.right = int(-area[0]/2 + radius), int(area[0]/2 - radius)
+        self.bottom, self.top = int(-area[1]/2 + radius), int(area[1]/2 - radius)
+        self.min_distance = min_distance
+        self.cell_size = min_distance / math.sqrt(2)
+        self.cells = {}
+        self.positions = []
+
+    def add(self, p):
+        self.cells[self._cell(p)] = p
+        self.positions.append(p)
+
+    def fits(self, p):
+        cx, cy = self._cell(p)
+        for gx, gy in PositionGrid.neighbours:
+            q = self.cells.get((cx + gx, cy + gy))
+            if q is not None and TrailMaking.point_distance(p, q) < self.min_distance:
+                return(False)
+        return(True)
+
+    def _cell(self, p):
+        return(int((p[0] - self.left) // self.cell_size), int((p[1] - self.bottom) // self.cell_size))
+
+    # positions in the corners of the 5x5 cells are always far enough apart
+    neighbours = [(x, y) for x in range(-2, 3) for y in range(-2, 3) if abs(x) + abs(y) < 4]
+
+
+class LayoutLibrary():
+    # layouts generated in advance with tools/trail_layouts.py; there is one
+    # file per window size, radius, number of targets, and minimum distance,
+    # named by a hash of these, and read when first needed. every layout is
+    # identified by a hash of its positions, which is logged as 'layout'
+    def __init__(self, directory):
+        self.directory = directory
+        self.layouts = {}
+        self.order = {}
+
+    def next(self, rng, window_size, radius, num_targets, min_distance):
+        # all layouts of a file are used in random order before any repeats
+        key = LayoutLibrary.key(window_size, radius, num_targets, min_distance)
+        if key not in self.layouts:
+            self.layouts[key] = LayoutLibrary.load(os.path.join(self.directory, key + '.json'))
+        if not self.layouts[key]:
+            return(None)
+        if not self.order.get(key):
+            self.order[key] = list(range(len(self.layouts[key])))
+            rng.shuffle(self.order[key])
+        return(self.layouts[key][self.order[key].pop()])
+
+    @staticmethod
+    def key(window_size, radius, num_targets, min_distance):
+        settings = [list(window_size), round(radius, 2), num_targets, round(min_distance, 2)]
+        return(hashlib.sha1(json.dumps(settings).encode('utf-8')).hexdigest()[:16])
+
+    @staticmethod
+    def layout_id(positions):
+        return(hashlib.sha1(json.dumps([list(p) for p in positions]).encode('utf-8')).hexdigest()[:12])
+
+    @staticmethod
+    def load(filename):
+        # layouts whose positions do not match their id are skipped
+        if not os.path.exists(filename):
+            return([])
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        return([[tuple(p) for p in layout['positions']] for layout in data['layouts']
+                if LayoutLibrary.layout_id(layout['positions']) == layout['id']])
+
+    @staticmethod
+    def save(directory, window_size, radius, num_targets, min_distance, layouts):
+        # adds the layouts to those already in the file
+        filename = os.path.join(directory, LayoutLibrary.key(
+            window_size, radius, num_targets, min_distance) + '.json')
+        existing = LayoutLibrary.load(filename)
+        ids = set(LayoutLibrary.layout_id(p) for p in existing)
+        layouts = existing + [p for p in layouts if LayoutLibrary.layout_id(p) not in ids]
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'w') as f:
+            json.dump({
+                'window_size': list(window_size),
+                'radius': round(radius, 2),
+                'num_targets': num_targets,
+                'min_distance': round(min_distance, 2),
+                'layouts': [{'id': LayoutLibrary.layout_id(p), 'positions': [list(x) for x in p]}
+                            for p in layouts]
+            }, f)
+        return(filename)
+
+
+class TargetIndex():
+    # uniform grid of the target centres with cells as wide as a target, so
+    # that hit-testing a point only looks at the targets in the cells nearby
+    def __init__(self, radius):
+        self.cell_size = max(2 * radius, 1)
+        self.grid = {}
+        self.stimuli = {}
+
+    def add(self, stimulus):
+        self.stimuli[stimulus.id] = stimulus
+        x, y = stimulus.position
+        self.grid.setdefault(self._cell(x, y), []).append((stimulus.id, x, y))
+
+    def position(self, sid):
+        return(self.stimuli[sid].position)
+
+    def query(self, point, distance):
+        # ids of all targets within the distance of the point, in the order of the ids
+        cx, cy = self._cell(*point)
+        reach = int(math.ceil(1.0 * distance / self.cell_size))
+        hits = []
+        for gx in range(cx - reach, cx + reach + 1):
+            for gy in range(cy - reach, cy + reach + 1):
+                for sid, x, y in self.grid.get((gx, gy), ()):
+                    if TrailMaking.point_distance((x, y), point) <= distance:
+                        hits.append(sid)
+        return(sorted(hits))
+
+    def _cell(self, x, y):
+        return(int(math.floor(1.0 * x / self.cell_size)), int(math.floor(1.0 * y / self.cell_size)))
+
+
 def main():
     TrailMaking.run()
 
@@ -390,21 +725,6 @@ if __name__ == '__main__' or android:
     main()
 
 
-def logTrail(exp, block, path):
-    if not SUMMARY_LOG_PRACTICE and block.get_factor('Practice'):
-        return
-    if TRAIL_LOG_FILE_NAME:
-        p = exp.subject
-        b = block.id + 1
-        fname = exp.data.directory + '/' + \
-            TRAIL_LOG_FILE_NAME.format(subject_id=p, session_id=exp.session, block_id=b)
-        if not os.path.isfile(fname):
-            with open(fname, "w") as f:
-                f.write(','.join(['participant', 'block', 'x', 'y', 'time']) + '\n')
-        with open(fname, 'a') as f:
-            [f.write(','.join([str(x) for x in [p, b] + pth]) + '\n') for pth in path]
-
-
 def logTargets(exp, block, stimuli):
     if not SUMMARY_LOG_PRACTICE and block.get_factor('Practice'):
         return
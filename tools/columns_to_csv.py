@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""COLUMNAR LOG CONVERTER.
+converts logs written with the `columnar_directory` option in the [LOG]
+section into csv files with the same columns as the csv logs of the tasks.
+Every directory given is written to a csv file of the same name next to it,
+or into the output directory if one is set.
+
+Usage: python tools/columns_to_csv.py [-o output directory] [-d delimiter] directory [directory ...]
+"""
+
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks'))
+
+from _base_expyriment import columnar_to_csv
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts columnar logs into csv files.')
+    parser.add_argument('directories', nargs='+')
+    parser.add_argument('-o', '--output', default=None)
+    parser.add_argument('-d', '--delimiter', default=',')
+    args = parser.parse_args()
+
+    for directory in args.directories:
+        directory = directory.rstrip('/\\')
+        if not os.path.exists(os.path.join(directory, 'schema.json')):
+            sys.stderr.write('{} is not a columnar log\n'.format(directory))
+            continue
+        filename = os.path.basename(directory) + '.csv'
+        if args.output:
+            filename = os.path.join(args.output, filename)
+        else:
+            filename = os.path.join(os.path.dirname(directory), filename)
+        columnar_to_csv(directory, filename, delimiter=args.delimiter)
+        print(filename)
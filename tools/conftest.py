@@ -0,0 +1,39 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+TASKS = os.path.join(TOOLS, '..', 'tasks')
+
+
+def one_block(task):
+    # settings of a single, short block of every task
+    settings = ['DESIGN.blocks=1']
+    if task == 'trailmaking':
+        import pygame
+        # system fonts are not necessarily installed where the tests run
+        font = os.path.join(os.path.dirname(pygame.__file__), pygame.font.get_default_font())
+        settings += ['DESIGN.num_targets=5', 'DESIGN.target_titles=123', 'DESIGN.timeout=100',
+                     'APPEARANCE.target_font=' + font]
+    return(settings)
+
+
+@pytest.fixture
+def simulate(tmpdir):
+    # runs simulated sessions of a task with tools/simulate.py and returns
+    # the output directory
+    pytest.importorskip('expyriment')
+
+    def run(task, sessions=1, settings=()):
+        output = str(tmpdir.join('simulated'))
+        command = [sys.executable, os.path.join(TOOLS, 'simulate.py'), task, '-n', str(sessions),
+                   '-j', '1', '-s', '1', '-o', output]
+        for setting in list(one_block(task)) + list(settings):
+            command += ['--set', setting]
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        log = process.communicate()[0].decode('utf-8', 'replace')
+        assert process.returncode == 0, log
+        return(output)
+    return(run)
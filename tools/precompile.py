@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""SEQUENCE BANK GENERATOR.
+generates the trial sequences of a task in advance for the `sequence_bank`
+option in the [GENERAL] section: the trials of the n-back and simple
+reaction time tasks, the keys of the digit span task, and the layouts of the
+trail making task. The settings are read from the configuration of the task,
+and one pool of sequences is written per combination of settings that may
+occur in a session, with as many sequences as one subject can draw from it
+(times --sets). Subjects draw from each pool in the order of a balanced latin
+square, so that every sequence is shown equally often in every position.
+
+By default, all subjects are shown the same sequences and only their order
+is balanced. With --groups, subjects are assigned to the groups in turn
+(subject 1 to group 1, subject 2 to group 2, ...) and every group has pools
+of its own; with as many groups as subjects, every subject has their own
+sequences. The order is balanced within each group.
+
+Sequences that depend on the performance of the subject, i.e. the sequence
+length of the digit span task and the n-back level with
+`change_nback_level`, are generated for every value they may take.
+
+For the trail making task, the window size and radius need to be exactly
+those of the experiment, see tools/trail_layouts.py.
+
+Usage: python tools/precompile.py nback -n 24 [-s 1] [--sets 1] [--groups 1] [-c config.conf] [-o sequences.json.gz]
+       python tools/precompile.py trailmaking -n 24 -w 1280x800 --dpi 96
+       python tools/precompile.py nback -o tasks/nback/sequences.json.gz --show 3
+"""
+
+import os
+import sys
+import random
+import argparse
+import importlib
+
+TASKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks')
+
+
+def nback_pools(module, settings, args):
+    counts = {}
+    for block_settings in module.NBack.sequence_settings(settings.design):
+        key = settings_key(module.NBack.sequence_key(*block_settings))
+        counts[key] = (block_settings, counts[key][1] + 1 if key in counts else 1)
+    pools = {}
+    for key, (settings, count) in counts.items():
+        pools[key] = []
+        for _ in range(count * args.sets):
+            repeats, items = module.NBack.generate_sequence(*settings + (random,))
+            pools[key].append({'repeats': repeats, 'items': items})
+    return(pools)
+
+
+def digitspan_pools(module, settings, args):
+    design = settings.design
+    counts = {}
+    for b in range(design.blocks):
+        start, trials = design.starting_length[b], design.trials[b]
+        # the length changes by one after every trial, and stays at one
+        for length in range(max(1, start - trials + 1), start + trials):
+            settings = (length, design.sequence_type[b])
+            key = settings_key(('digitspan',) + settings)
+            draws = trials if length == 1 else (trials + 1) // 2
+            counts[key] = (settings, counts[key][1] + draws if key in counts else draws)
+    return(dict((key, [module.DigitSpan.generate_key(*settings) for _ in range(count * args.sets)])
+                for key, (settings, count) in counts.items()))
+
+
+def trailmaking_pools(module, settings, args):
+    from trail_layouts import radius_in_px
+    design, appearance = settings.design, settings.appearance
+    window_size = [int(x) for x in args.window.lower().split('x')] if args.window \
+        else settings.general.window_size
+    if not window_size:
+        raise ValueError('the trail making task needs the window size, e.g. -w 1280x800.')
+    radius = radius_in_px(appearance.target_radius, args.dpi or settings.general.dpi)
+    min_distance = appearance.min_distance_of_targets * radius
+    counts = {}
+    for b in range(design.blocks):
+        key = settings_key(('trailmaking', module.LayoutLibrary.key(
+            window_size, radius, design.num_targets[b], min_distance)))
+        counts[key] = (design.num_targets[b], counts[key][1] + design.trials[b]
+                       if key in counts else design.trials[b])
+    return(dict((key, [[list(p) for p in module.TrailMaking.make_random_positions(
+        window_size, radius, num_targets, min_distance,
+        appearance.attempts_before_reducing_min_distance, random)] for _ in range(count * args.sets)])
+        for key, (num_targets, count) in counts.items()))
+
+
+POOLS = {
+    'nback': nback_pools,
+    'rt_simple': nback_pools,
+    'digitspan': digitspan_pools,
+    'trailmaking': trailmaking_pools
+}
+
+
+def settings_key(settings):
+    from _base_expyriment import SequenceBank
+    return(SequenceBank.key(*settings))
+
+
+def show(filename, subject):
+    from _base_expyriment import SequenceBank
+    for key, sequences in sorted(SequenceBank.load(filename, subject).sequences().items()):
+        print(key)
+        for sequence in sequences:
+            print('    {}'.format(sequence))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates the sequence bank of a task.')
+    parser.add_argument('task', choices=sorted(POOLS))
+    parser.add_argument('-n', '--subjects', type=int, default=None)
+    parser.add_argument('--sets', type=int, default=1,
+                        help='sequences per pool, in multiples of what one subject draws')
+    parser.add_argument('--groups', type=int, default=1,
+                        help='groups of subjects with sequences of their own')
+    parser.add_argument('-s', '--seed', type=int, default=None)
+    parser.add_argument('-c', '--config', default=None, help='[default: config.conf of the task]')
+    parser.add_argument('-o', '--output', default=None,
+                        help='[default: sequences.json.gz in the directory of the task]')
+    parser.add_argument('-w', '--window', default=None, help='window size in pixels, e.g. 1280x800')
+    parser.add_argument('--dpi', type=float, default=None)
+    parser.add_argument('--show', type=int, default=None, metavar='SUBJECT',
+                        help='print the sequences of a subject in an existing sequence bank')
+    args = parser.parse_args()
+
+    directory = os.path.join(TASKS, args.task)
+    sys.path.insert(0, directory)
+    output = args.output or os.path.join(directory, 'sequences.json.gz')
+    if args.show is not None:
+        show(output, args.show)
+        sys.exit()
+    if not args.subjects:
+        parser.error('the number of subjects is required.')
+    if not 1 <= args.groups <= args.subjects:
+        parser.error('there need to be between one group and one group per subject.')
+
+    module = importlib.import_module(args.task)
+    from _base_expyriment import SequenceBank, read_settings
+    settings = read_settings(module.DEFAULTS, module.SCHEMA,
+                             filename=args.config or os.path.join(directory, 'config.conf'))[1]
+    random.seed(args.seed)
+    pools = [POOLS[args.task](module, settings, args) for _ in range(args.groups)]
+    for key in sorted(pools[0]):
+        print('{:>5}  {}'.format(len(pools[0][key]), key))
+    if args.groups > 1:
+        print('for each of {} groups'.format(args.groups))
+    print(SequenceBank.save(output, args.task, args.subjects, pools))
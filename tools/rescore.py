@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""TRIAL LOG RESCORING.
+scores the trials in existing trial logs (.xpd-files) of a task again, and
+summarises them into block and experiment summaries with the columns that
+are currently set as `cols_block` and `cols_experiment` in the
+configuration of the task; a column can thus be added to a summary and
+filled in for all sessions that were already run. The files are processed
+in parallel, one session per file.
+
+The trials are scored from the columns of the trial log, i.e. as set in
+`cols_trial` when they were run:
+- nback, rt_simple: all analysis columns from `repeat` and `pressed`;
+  `repeat` is not logged by default for rt_simple, and is taken to be True
+  if every trial was a target, i.e. `repeat_probability` is not set or 1
+- digitspan: `correct` and all matches from `sequence`, `user_input`, and
+  `reverse`, see _alignment.py
+- trailmaking: the number of lost touches, wrong and done targets from
+  `event` and `current_target`; the minimum distance needs the positions
+  of the targets and is left empty
+A trial log that lacks one of these columns is not scored at all, rather
+than scored wrongly. Variables that were neither logged nor can be scored
+again, e.g. block variables that were not logged as trial columns, are None.
+The configuration needs to be that of the sessions, except for the columns;
+options can be replaced with --set as for tools/simulate.py.
+
+The trial logs are written to the output directory with the columns of
+`cols_trial` added that were scored again, alongside the summaries.
+
+Usage: python tools/rescore.py digitspan tasks/digitspan/data [-c config.conf] [-o rescored] [-j 4]
+       python tools/rescore.py nback tasks/nback/data --set "LOG.cols_block=mean(correct)"
+"""
+
+import os
+import sys
+import csv
+import argparse
+import importlib
+import multiprocessing
+from ast import literal_eval
+
+TASKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks')
+
+# columns that are text in the experiment even if they look like numbers
+TEXT_COLUMNS = {
+    'nback': ('nback_mode',),
+    'rt_simple': ('nback_mode',),
+    'digitspan': ('sequence', 'user_input', 'sequence_type'),
+    'trailmaking': ('target_titles', 'layout', 'event')
+}
+# columns of the trial log that the trials are scored from
+REQUIRED = {
+    'nback': ('repeat', 'pressed'),
+    'rt_simple': ('repeat', 'pressed'),
+    'digitspan': ('sequence', 'user_input', 'reverse'),
+    'trailmaking': ('event', 'current_target')
+}
+# trailmaking summarises every trail, the other tasks every block
+GROUPS = {
+    'trailmaking': ('block', 'trial')
+}
+
+
+def score_nback(module, row, columns):
+    return(module.NBack.score_trial(row.get('repeat'), row.get('pressed')))
+
+
+def score_digitspan(module, row, columns):
+    # only the metrics that are logged or summarised are computed
+    if columns not in logged_metrics:
+        logged_metrics[columns] = [m for m in module._alignment.METRICS
+                                   if any(m in c for c in columns)]
+    return(module.DigitSpan.score_trial(row.get('user_input') or '', row.get('sequence') or '',
+                                        row.get('reverse'), logged_metrics[columns]))
+
+
+logged_metrics = {}
+
+
+def summarise_trailmaking(module, rows):
+    return(module.TrailMaking.summarise_trail(rows, rows[-1].get('distance') or 0))
+
+
+SCORES = {
+    'nback': (score_nback, None),
+    'rt_simple': (score_nback, None),
+    'digitspan': (score_digitspan, None),
+    'trailmaking': (None, summarise_trailmaking)
+}
+
+
+def logged_defaults(settings):
+    # values of required columns that need not be logged: when only
+    # reaction times are measured and every trial is a target, as in
+    # NBack.prepare_block, `repeat` is True in every trial
+    design = settings.design
+    if getattr(design, 'reaction_time_only', False) and \
+            all(p == 1 for p in design.repeat_probability or [1]):
+        return({'repeat': True})
+    return({})
+
+
+def parse_value(value):
+    # values as they were logged, e.g. '1' -> 1, 'None' -> None
+    try:
+        return(literal_eval(value))
+    except (ValueError, SyntaxError):
+        return(value)
+
+
+def read_trials(filename, text_columns=()):
+    with open(filename, 'r') as f:
+        reader = csv.DictReader(line for line in f if not line.startswith('#'))
+        rows = [dict((k, v if k in text_columns else parse_value(v)) for k, v in row.items())
+                for row in reader]
+    return(reader.fieldnames or [], rows)
+
+
+def init_worker(directory, task):
+    global module, base
+    sys.path.insert(0, directory)
+    module = importlib.import_module(task)
+    base = importlib.import_module('_base_expyriment')
+
+
+def rescore_file(job):
+    # the scored trials, and the block and experiment summaries of one session
+    task, filename, defaults, cols_trial, cols_block, cols_experiment = job
+    fieldnames, rows = read_trials(filename, TEXT_COLUMNS.get(task, ()))
+    missing = [c for c in REQUIRED[task] if c not in fieldnames and c not in defaults]
+    if rows and missing:
+        raise ValueError('{} cannot be scored again without the column(s) {} in cols_trial.'.format(
+            filename, ', '.join(missing)))
+    score, summarise = SCORES[task]
+    group = GROUPS.get(task, ('block',))
+    trialdata = base.TrialData(cols_block, cols_experiment)
+    block_names = base.remove_duplicates(['subject', 'session', 'block'] + list(cols_block))
+    block_columns = base.SummaryColumns(block_names)
+    blocks = []
+    # block variables, such as `reverse`, are the last logged value
+    single = [n for n in block_names if base.SummaryColumns.compile(n)[0] == 'value']
+    columns = tuple(cols_trial) + tuple(cols_block) + tuple(cols_experiment)
+    start = 0
+    for i, row in enumerate(rows):
+        for column, value in defaults.items():
+            row.setdefault(column, value)
+        if score:
+            row.update(score(module, row, columns))
+        trialdata.append(row)
+        if i + 1 < len(rows) and all(rows[i + 1].get(g) == row.get(g) for g in group):
+            continue
+        overridden = dict((n, row[n]) for n in single if n in row)
+        if summarise:
+            overridden.update(summarise(module, rows[start:i + 1]))
+        start = i + 1
+        args = dict(trialdata.block)
+        args.update(overridden)
+        blocks.append(block_columns.evaluate(args, trialdata.block_summary, overridden))
+    experiment = None
+    if rows and cols_experiment:
+        overridden = {'subject': rows[-1].get('subject'), 'session': rows[-1].get('session')}
+        args = dict(trialdata.session)
+        args.update(overridden)
+        experiment = base.SummaryColumns(['subject', 'session'] + list(cols_experiment)).evaluate(
+            args, trialdata.session_summary, overridden)
+    fieldnames = list(fieldnames) + [c for c in cols_trial if c not in fieldnames and
+                                     any(c in row for row in rows)]
+    trials = [[row.get(c) for c in fieldnames] for row in rows]
+    return(filename, fieldnames, trials, block_names, blocks, experiment)
+
+
+def trial_logs(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, files in sorted(os.walk(path)):
+                for name in sorted(files):
+                    if name.endswith('.xpd'):
+                        yield(os.path.join(directory, name))
+        else:
+            yield(path)
+
+
+def cell(value):
+    # as LogFile.add writes the summaries in the experiment
+    return(str('|'.join(str(v) for v in value) if isinstance(value, (list, tuple)) else value))
+
+
+def write_csv(filename, header, rows):
+    with open(filename, 'w') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows([cell(v) for v in row] for row in rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scores existing trial logs of a task again.')
+    parser.add_argument('task', choices=sorted(SCORES))
+    parser.add_argument('paths', nargs='+', help='.xpd-files, or directories with .xpd-files')
+    parser.add_argument('-c', '--config', default=None, help='[default: config.conf of the task]')
+    parser.add_argument('-o', '--output', default='rescored', help='[default: rescored]')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of processes [default: number of cpus]')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.option=value',
+                        help='replaces an option of the configuration, may be repeated')
+    args = parser.parse_args()
+    from simulate import parse_overrides
+    try:
+        overrides = parse_overrides(args.set)
+    except ValueError as e:
+        parser.error(str(e))
+
+    directory = os.path.join(TASKS, args.task)
+    init_worker(directory, args.task)
+    settings = base.read_settings(module.DEFAULTS, module.SCHEMA, overrides=overrides,
+                                  filename=args.config or os.path.join(directory, 'config.conf'))[1]
+    columns = [list(getattr(settings.log, option) or ())
+               for option in ('cols_trial', 'cols_block', 'cols_experiment')]
+    defaults = logged_defaults(settings)
+    jobs = [(args.task, filename, defaults) + tuple(columns) for filename in trial_logs(args.paths)]
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    pool = multiprocessing.Pool(args.jobs, init_worker, (directory, args.task))
+    block_rows, experiment_rows, block_header = [], [], None
+    try:
+        for filename, fieldnames, trials, block_header, blocks, experiment in \
+                pool.imap(rescore_file, jobs, chunksize=4):
+            write_csv(os.path.join(args.output, os.path.basename(filename).rsplit('.', 1)[0] + '.csv'),
+                      fieldnames, trials)
+            block_rows.extend(blocks)
+            if experiment is not None:
+                experiment_rows.append(experiment)
+    finally:
+        pool.close()
+        pool.join()
+
+    if block_header and settings.log.cols_block and settings.log.block_summary_file:
+        write_csv(os.path.join(args.output, settings.log.block_summary_file), block_header, block_rows)
+    if settings.log.cols_experiment and settings.log.experiment_summary_file:
+        write_csv(os.path.join(args.output, settings.log.experiment_summary_file),
+                  ['subject', 'session'] + columns[2], experiment_rows)
+    print('{} sessions, {} blocks scored into {}'.format(len(jobs), len(block_rows), args.output))
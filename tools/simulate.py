@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""SIMULATED SESSIONS.
+runs sessions of a task without a participant, and without a display: the
+responses are given by the simulated participant of the [SIMULATION]
+section of the configuration (see SimulatedParticipant in
+_base_expyriment.py), and the time of a session only passes when the
+experiment waits, so that a session takes as long as it takes to generate,
+present, log, and score its trials. This allows to check a configuration or
+a change of the code with many sessions, e.g. on a server, and to measure
+how many sessions per second can be run.
+
+Sessions are run in parallel processes, every session into its own data
+directory, sessions/<subject>, with the subjects 1 to -n; the block and
+experiment summaries of all sessions are then joined into the output
+directory. With a seed, the sessions are reproducible. Options of the
+configuration can be replaced for all sessions with --set, e.g. to run a
+single block.
+
+Usage: python tools/simulate.py nback -n 100 [-c config.conf] [-o simulated] [-j 4] [-s 1]
+       python tools/simulate.py nback --set DESIGN.blocks=1 --set SIMULATION.accuracy=0.7
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import importlib
+import multiprocessing
+
+# no window, and no sound, also in the processes running the sessions
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+TASKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks')
+
+CLASSES = {
+    'nback': 'NBack',
+    'rt_simple': 'NBack',
+    'digitspan': 'DigitSpan',
+    'trailmaking': 'TrailMaking'
+}
+
+
+def init_worker(directory, task, config, overrides={}):
+    global module, base, options
+    # the task reads its messages from its directory, and names its logs
+    # after the script that is run
+    os.chdir(directory)
+    sys.path.insert(0, directory)
+    sys.argv[:1] = [os.path.join(directory, task + '.py')]
+    base = importlib.import_module('_base_expyriment')
+    module = importlib.import_module(task)
+    base.config_file = config
+    options = overrides
+
+
+def run_session(job):
+    # number of rows logged, simulated and actual duration of one session
+    task, subject, seed, output = job
+    from expyriment import io
+    io.defaults.datafile_directory = os.path.join(output, 'sessions', str(subject))
+    io.defaults.eventfile_directory = os.path.join(io.defaults.datafile_directory, 'events')
+    if not os.path.isdir(io.defaults.eventfile_directory):
+        os.makedirs(io.defaults.eventfile_directory)
+    simulation = dict(options.get('SIMULATION', {}), active='yes', subject=subject, session=1)
+    if seed is not None:
+        simulation['seed'] = seed
+        random.seed(seed)
+    base.config_overrides = dict(options, SIMULATION=simulation)
+    start = time.time()
+    exp = getattr(module, CLASSES[task]).run()
+    return(subject, len(exp.trialdata), exp.clock.time, time.time() - start)
+
+
+def parse_overrides(assignments):
+    # ['DESIGN.blocks=1', ...] -> {'DESIGN': {'blocks': '1'}, ...}
+    overrides = {}
+    for assignment in assignments:
+        option, separator, value = assignment.partition('=')
+        section, dot, option = option.strip().partition('.')
+        if not separator or not dot or not section or not option:
+            raise ValueError('{} is not of the form SECTION.option=value.'.format(assignment))
+        overrides.setdefault(section.upper(), {})[option] = value.strip()
+    return(overrides)
+
+
+def join_summaries(output, subjects):
+    # the csv files of all sessions, with the header of the first one
+    joined = {}
+    for subject in subjects:
+        directory = os.path.join(output, 'sessions', str(subject))
+        for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+            if not name.endswith('.csv'):
+                continue
+            with open(os.path.join(directory, name), 'r') as f:
+                lines = f.readlines()
+            if name in joined:
+                lines = lines[1:]
+            joined.setdefault(name, []).extend(lines)
+    for name, lines in sorted(joined.items()):
+        with open(os.path.join(output, name), 'w') as f:
+            f.writelines(lines)
+    return(sorted(joined))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs simulated sessions of a task.')
+    parser.add_argument('task', choices=sorted(CLASSES))
+    parser.add_argument('-n', '--sessions', type=int, default=1)
+    parser.add_argument('-c', '--config', default=None, help='[default: config.conf of the task]')
+    parser.add_argument('-o', '--output', default='simulated', help='[default: simulated]')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='number of processes [default: number of cpus]')
+    parser.add_argument('-s', '--seed', type=int, default=None,
+                        help='session i is run with the seed + i [default: none]')
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.option=value',
+                        help='replaces an option of the configuration, may be repeated')
+    args = parser.parse_args()
+    try:
+        overrides = parse_overrides(args.set)
+    except ValueError as e:
+        parser.error(str(e))
+
+    directory = os.path.abspath(os.path.join(TASKS, args.task))
+    config = os.path.abspath(args.config or os.path.join(directory, 'config.conf'))
+    output = os.path.abspath(args.output)
+    subjects = range(1, args.sessions + 1)
+    jobs = [(args.task, subject, None if args.seed is None else args.seed + subject, output)
+            for subject in subjects]
+
+    start = time.time()
+    pool = multiprocessing.Pool(args.jobs, init_worker, (directory, args.task, config, overrides))
+    rows, simulated = 0, 0
+    try:
+        for subject, num_rows, duration, _ in pool.imap_unordered(run_session, jobs):
+            rows += num_rows
+            simulated += duration
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start
+
+    for name in join_summaries(output, subjects):
+        print('joined {}'.format(os.path.join(output, name)))
+    print('{} sessions, {} trial rows in {:.1f} s ({:.2f} sessions/s, {:.0f} rows/s), '
+          '{:.2f} h of simulated sessions'.format(
+              len(jobs), rows, elapsed, len(jobs) / elapsed, rows / elapsed, simulated / 3600000.0))
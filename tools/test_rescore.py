@@ -0,0 +1,54 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+
+# block summaries of every task that depend on how the trials are scored
+SCORED = {
+    'nback': ['LOG.cols_block=mean(rt[correct_repeat==1]), len(correct), sum(correct), '
+              'sum(falsepositive), sum(missedpositive), sum(falsebutton)'],
+    'rt_simple': ['LOG.cols_block=mean(rt), sum(correct), sum(incorrect), sum(falsepositive), '
+                  'sum(missedpositive)'],
+    'digitspan': ['LOG.cols_block=reverse, sum(correct), mean(similarity), max(longest_match), '
+                  'sum(total_match), mean(initial_match_answer)']
+}
+
+
+def rescore(task, output, settings=()):
+    command = [sys.executable, os.path.join(TOOLS, 'rescore.py'), task,
+               os.path.join(output, 'sessions'), '-j', '1', '-o', os.path.join(output, 'rescored')]
+    for setting in settings:
+        command += ['--set', setting]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    log = process.communicate()[0].decode('utf-8', 'replace')
+    return(process.returncode, log)
+
+
+def read(filename):
+    with open(filename) as f:
+        return(f.read().splitlines())
+
+
+@pytest.mark.parametrize('task', sorted(SCORED))
+def test_rescored_summaries_match_the_sessions(simulate, task):
+    output = simulate(task, sessions=2, settings=SCORED[task])
+    returncode, log = rescore(task, output, SCORED[task])
+    assert returncode == 0, log
+    simulated = read(os.path.join(output, task + '_blocks.csv'))
+    assert len(simulated) == 3
+    assert read(os.path.join(output, 'rescored', 'blocks.csv')) == simulated
+
+
+@pytest.mark.parametrize('task, settings', [
+    # `repeat` is only implied when every trial is a target
+    ('rt_simple', ['DESIGN.repeat_probability=0.5']),
+    ('nback', ['LOG.cols_trial=rt, correct'])])
+def test_missing_columns_are_not_scored(simulate, task, settings):
+    output = simulate(task, settings=settings)
+    returncode, log = rescore(task, output, settings)
+    assert returncode != 0
+    assert 'without the column(s)' in log
+    assert not os.path.exists(os.path.join(output, 'rescored', 'blocks.csv'))
@@ -0,0 +1,25 @@
+import os
+import csv
+
+import pytest
+
+from simulate import parse_overrides
+
+
+@pytest.mark.parametrize('task', ['nback', 'rt_simple', 'digitspan', 'trailmaking'])
+def test_simulates_one_block(simulate, task):
+    output = simulate(task)
+    with open(os.path.join(output, task + '_blocks.csv')) as f:
+        blocks = list(csv.DictReader(f))
+    assert len(blocks) == 1
+    assert blocks[0]['subject'] == '1'
+    sessions = os.listdir(os.path.join(output, 'sessions', '1'))
+    assert any(name.endswith('.xpd') for name in sessions)
+
+
+def test_parse_overrides():
+    assert parse_overrides(['DESIGN.blocks=1', 'simulation.rt_mu = 300', 'LOG.cols_block=a, b']) == {
+        'DESIGN': {'blocks': '1'}, 'SIMULATION': {'rt_mu': '300'}, 'LOG': {'cols_block': 'a, b'}}
+    for assignment in ['DESIGN.blocks', 'blocks=1', '.blocks=1']:
+        with pytest.raises(ValueError):
+            parse_overrides([assignment])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""TRAIL MAKING LAYOUT GENERATOR.
+generates layouts of the trail making targets in advance, for the
+`layout_directory` option in the [DESIGN] section of the trail making task.
+One file is written per window size and number of targets, and layouts are
+added to a file that already exists.
+
+The window size, radius, and minimum distance need to be exactly those of
+the experiment: the window size in pixels as set in `window_size` or the
+screen resolution in full screen mode, the radius as `target_radius` (in px,
+or in mm, cm, or in together with the dpi of the device), and the minimum
+distance as `min_distance_of_targets`, in multiples of the radius.
+
+Usage: python tools/trail_layouts.py -w 1280x800 -r 5mm --dpi 96 -t 5 10 -n 20 [-d layouts]
+"""
+
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tasks', 'trailmaking'))
+
+from trailmaking import TrailMaking, LayoutLibrary, DEFAULTS
+
+
+def radius_in_px(radius, dpi):
+    units = {'in': 1, 'cm': 2.54, 'mm': 25.4}
+    if radius[-2:] in units:
+        if not dpi:
+            raise ValueError('a radius in {} needs the dpi of the device.'.format(radius[-2:]))
+        return(dpi * float(radius[:-2]) / units[radius[-2:]])
+    return(float(radius))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates layouts for the trail making task.')
+    parser.add_argument('-w', '--window', nargs='+', required=True,
+                        help='window sizes in pixels, e.g. 1280x800')
+    parser.add_argument('-r', '--radius', default=DEFAULTS['target_radius'])
+    parser.add_argument('--dpi', type=float, default=None)
+    parser.add_argument('-m', '--min-distance', type=float,
+                        default=DEFAULTS['min_distance_of_targets'])
+    parser.add_argument('-a', '--attempts', type=int,
+                        default=DEFAULTS['attempts_before_reducing_min_distance'])
+    parser.add_argument('-t', '--targets', type=int, nargs='+', required=True)
+    parser.add_argument('-n', '--number', type=int, default=20, help='layouts per file')
+    parser.add_argument('-s', '--seed', type=int, default=None)
+    parser.add_argument('-d', '--directory', default='layouts')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    radius = radius_in_px(args.radius, args.dpi)
+    for window in args.window:
+        window_size = [int(x) for x in window.lower().split('x')]
+        for num_targets in args.targets:
+            layouts = [TrailMaking.make_random_positions(window_size, radius, num_targets,
+                                                         args.min_distance * radius, args.attempts, rng)
+                       for _ in range(args.number)]
+            print(LayoutLibrary.save(args.directory, window_size, radius, num_targets,
+                                     args.min_distance * radius, layouts))